@@ -1,8 +1,21 @@
-from .ical import CalendarConverter, EventConverter, DateDateTime
+from .ical import (
+    CalendarConverter,
+    EventConverter,
+    DateDateTime,
+    SourceSnapshot,
+    SourceDelta,
+    CompactEvent,
+    MergedCalendarConverter,
+    MergeSource,
+    gcal_to_ical,
+    write_ics,
+)
 
 from .gcal import (
     GoogleCalendarService,
     GoogleCalendar,
+    HttpPool,
+    ServiceAccountRing,
     EventData,
     EventList,
     EventTuple,
@@ -10,24 +23,75 @@ from .gcal import (
     EventDateOrDateTime,
     EventDate,
     EventDateTime,
+    EventExtendedProperties,
     EventsSearchResults,
     ACLRule,
     ACLScope,
     CalendarData,
     BatchRequestCallback,
+    EventCallback,
+)
+
+from .icsparser import FastCalendarConverter
+
+from .results import (
+    ResultSink,
+    LoggingResultSink,
+    SummaryResultSink,
+    JsonlResultSink,
+    MultiResultSink,
+    make_result_sink,
+    start_queue_logging,
 )
 
-from .sync import CalendarSync, ComparedEvents
+from .ratelimit import TokenBucket, SharedTokenBucket
+
+from .quota import QuotaBudget, QuotaExceeded
+
+from .cache import ConversionCache
+
+from .deadline import RunDeadline, DeadlineExceeded
+
+from .workqueue import SyncJob, SyncJobQueue, PostgresJobQueue, make_job_queue
+
+from .journal import SyncJournal, JournalPlan
+
+from .sync import (
+    CalendarSync,
+    ComparedEvents,
+    InsertOperation,
+    UpdateOperation,
+    DeleteOperation,
+    SyncOperation,
+)
 
 __all__ = [
     "ical",
     "gcal",
     "sync",
+    "icsparser",
+    "journal",
+    "ratelimit",
+    "quota",
+    "cache",
+    "deadline",
+    "results",
+    "workqueue",
     "CalendarConverter",
     "EventConverter",
     "DateDateTime",
+    "SourceSnapshot",
+    "SourceDelta",
+    "CompactEvent",
+    "MergedCalendarConverter",
+    "MergeSource",
+    "gcal_to_ical",
+    "write_ics",
+    "FastCalendarConverter",
     "GoogleCalendarService",
     "GoogleCalendar",
+    "HttpPool",
+    "ServiceAccountRing",
     "EventData",
     "EventList",
     "EventTuple",
@@ -35,10 +99,36 @@ __all__ = [
     "EventDateOrDateTime",
     "EventDate",
     "EventDateTime",
+    "EventExtendedProperties",
     "EventsSearchResults",
     "ACLRule",
     "ACLScope",
     "CalendarData",
+    "EventCallback",
+    "ResultSink",
+    "LoggingResultSink",
+    "SummaryResultSink",
+    "JsonlResultSink",
+    "MultiResultSink",
+    "make_result_sink",
+    "start_queue_logging",
+    "TokenBucket",
+    "SharedTokenBucket",
+    "QuotaBudget",
+    "QuotaExceeded",
+    "ConversionCache",
+    "RunDeadline",
+    "DeadlineExceeded",
+    "SyncJob",
+    "SyncJobQueue",
+    "PostgresJobQueue",
+    "make_job_queue",
+    "SyncJournal",
+    "JournalPlan",
     "CalendarSync",
     "ComparedEvents",
+    "InsertOperation",
+    "UpdateOperation",
+    "DeleteOperation",
+    "SyncOperation",
 ]
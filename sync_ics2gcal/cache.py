@@ -0,0 +1,164 @@
+import json
+import logging
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .gcal import EventData
+
+# new entries are written by chunks of this size
+WRITE_CHUNK = 1000
+
+
+class ConversionCache:
+    """persistent cache of converted events between runs (SQLite):
+    key (hash of raw event content) -> converted event
+
+    least recently used entries are evicted, when total size of entries
+    exceeds max size
+
+    one instance is used by one thread (connection is opened on first use
+    and closed by flush)
+    """
+
+    logger = logging.getLogger("ConversionCache")
+
+    def __init__(self, filename: str, max_bytes: int = 64 * 1024 * 1024):
+        """
+
+        Arguments:
+            filename -- SQLite filename
+
+        Keyword Arguments:
+            max_bytes -- max total size of cached events (JSON), default 64 MiB
+        """
+        self.filename: str = filename
+        self.max_bytes: int = max_bytes
+        self.hits: int = 0
+        self.misses: int = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._used: List[Tuple[float, str]] = []
+        self._new: List[Tuple[str, str, int, float]] = []
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS events (key TEXT PRIMARY KEY, "
+                "event TEXT, size INTEGER, used REAL)"
+            )
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.filename, timeout=60, isolation_level=None)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def get(self, key: str) -> Optional[EventData]:
+        """cached event
+
+        Arguments:
+            key -- hash of raw event
+
+        Returns:
+            converted event or None if not cached
+        """
+
+        row = (
+            self._connection()
+            .execute("SELECT event FROM events WHERE key = ?", (key,))
+            .fetchone()
+        )
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._used.append((time.time(), key))
+        result: EventData = json.loads(row[0])
+        return result
+
+    def put(self, key: str, event: EventData) -> None:
+        """add converted event to cache (written by chunks)
+
+        Arguments:
+            key -- hash of raw event
+            event -- converted event
+        """
+
+        value = json.dumps(event, ensure_ascii=False)
+        self._new.append((key, value, len(value), time.time()))
+        if len(self._new) >= WRITE_CHUNK:
+            self._write()
+
+    def _write(self) -> None:
+        """write new entries and usage times of hits"""
+
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany("INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?)", self._new)
+        conn.executemany("UPDATE events SET used = ? WHERE key = ?", self._used)
+        conn.execute("COMMIT")
+        self._new.clear()
+        self._used.clear()
+
+    def _evict(self) -> int:
+        """remove least recently used entries over max size
+
+        Returns:
+            number of removed entries
+        """
+
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        (total,) = conn.execute("SELECT COALESCE(SUM(size), 0) FROM events").fetchone()
+        evicted: List[Tuple[str]] = []
+        if total > self.max_bytes:
+            for key, size in conn.execute("SELECT key, size FROM events ORDER BY used"):
+                evicted.append((key,))
+                total -= size
+                if total <= self.max_bytes:
+                    break
+            conn.executemany("DELETE FROM events WHERE key = ?", evicted)
+        conn.execute("COMMIT")
+        return len(evicted)
+
+    def flush(self) -> None:
+        """end of conversion: write new entries, evict old entries,
+        log counts and close connection"""
+
+        if self._conn is None and not self._new and not self._used:
+            return
+        try:
+            self._write()
+            evicted = self._evict()
+        finally:
+            self._connection().close()
+            self._conn = None
+        self.logger.info(
+            "%d hits, %d misses, %d evicted", self.hits, self.misses, evicted
+        )
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def from_config(config: Optional[Dict[str, Any]]) -> Optional["ConversionCache"]:
+        """make conversion cache from config dict
+
+        Arguments:
+
+        **config** -- config with keys:
+
+        file: - SQLite filename
+
+        (optional) max_mb: - max size of cached events in MiB, default 64
+
+        -- **None**: no cache
+        """
+
+        if config is None:
+            return None
+        return ConversionCache(
+            config["file"], int(config.get("max_mb", 64) * 1024 * 1024)
+        )
@@ -0,0 +1,109 @@
+import time
+from typing import Any, Dict, Optional
+
+from .quota import QuotaExceeded
+
+
+class DeadlineExceeded(QuotaExceeded):
+    """too little time is left until deadline of run"""
+
+
+class RunDeadline:
+    """time budget of sync run: timeouts of requests are limited
+    by remaining time, new write batches are not started when less than
+    reserve time is left (remaining operations are deferred as by quota)
+    """
+
+    def __init__(self, seconds: float, reserve: float = 30):
+        """deadline is started on creation
+
+        Arguments:
+            seconds -- time budget of run
+
+        Keyword Arguments:
+            reserve -- time left for batch, new batches are not started
+                after it (default: 30 seconds)
+        """
+        self.seconds: float = seconds
+        self.reserve: float = reserve
+        self.expires: float = 0.0
+        self.cancelled: Optional[str] = None
+        self.start()
+
+    def start(self) -> None:
+        """start time budget of new run"""
+
+        self.expires = time.monotonic() + self.seconds
+        self.cancelled = None
+
+    def cancel(self, reason: str) -> None:
+        """stop run: no new requests are started (thread-safe)
+
+        Arguments:
+            reason -- message of DeadlineExceeded
+        """
+
+        self.cancelled = reason
+
+    def remaining(self) -> float:
+        """seconds left until deadline (negative if passed)"""
+
+        return self.expires - time.monotonic()
+
+    def check(self) -> None:
+        """check that there is time for new batch
+
+        Raises:
+            DeadlineExceeded -- if less than reserve time is left,
+                or run is cancelled
+        """
+
+        if self.cancelled is not None:
+            raise DeadlineExceeded(self.cancelled)
+        remaining = self.remaining()
+        if remaining < self.reserve:
+            raise DeadlineExceeded(
+                "run deadline is near, {:.1f} seconds left".format(remaining)
+            )
+
+    def timeout(self, timeout: Optional[float] = None) -> float:
+        """timeout of next request: time left until deadline
+
+        Keyword Arguments:
+            timeout -- max timeout of request (optional)
+
+        Raises:
+            DeadlineExceeded -- if deadline is passed, or run is cancelled
+
+        Returns:
+            seconds
+        """
+
+        if self.cancelled is not None:
+            raise DeadlineExceeded(self.cancelled)
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("run deadline is passed")
+        if timeout is None:
+            return remaining
+        return min(timeout, remaining)
+
+    @staticmethod
+    def from_config(config: Optional[Dict[str, Any]]) -> Optional["RunDeadline"]:
+        """make run deadline from config dict
+
+        Arguments:
+
+        **config** -- config with keys:
+
+        seconds: - time budget of run
+
+        (optional) reserve: - seconds before deadline,
+        when new batches are not started
+
+        -- **None**: no deadline
+        """
+
+        if config is None:
+            return None
+        return RunDeadline(config["seconds"], config.get("reserve", 30))
@@ -1,6 +1,14 @@
+import base64
+import bisect
+import hashlib
+import json
 import logging
-from datetime import datetime
+import queue
+from datetime import datetime, timedelta
 from typing import (
+    Iterable,
+    Iterator,
+    Set,
     List,
     Dict,
     Any,
@@ -13,11 +21,19 @@ from typing import (
     NamedTuple,
 )
 
+import dateutil.parser
 import google.auth
+import google_auth_httplib2
 from google.oauth2 import service_account
 from googleapiclient import discovery
+from googleapiclient.http import build_http
 from pytz import utc
 
+from .ratelimit import TokenBucket
+from .results import ResultSink, LoggingResultSink
+from .quota import QuotaBudget, QuotaExceeded
+from .deadline import RunDeadline
+
 
 class EventDate(TypedDict, total=False):
     date: str
@@ -49,6 +65,11 @@ class CalendarData(TypedDict, total=False):
     timeZone: str
 
 
+class EventExtendedProperties(TypedDict, total=False):
+    private: Dict[str, str]
+    shared: Dict[str, str]
+
+
 class EventData(TypedDict, total=False):
     id: str
     summary: str
@@ -63,6 +84,9 @@ class EventData(TypedDict, total=False):
     sequence: int
     transparency: str
     visibility: str
+    extendedProperties: EventExtendedProperties
+    recurringEventId: str
+    originalStartTime: EventDateOrDateTime
 
 
 EventDataKey = Union[
@@ -79,6 +103,7 @@ EventDataKey = Union[
     Literal["sequence"],
     Literal["transparency"],
     Literal["visibility"],
+    Literal["extendedProperties"],
 ]
 EventList = List[EventData]
 EventTuple = Tuple[EventData, EventData]
@@ -90,6 +115,165 @@ class EventsSearchResults(NamedTuple):
 
 
 BatchRequestCallback = Callable[[str, Any, Optional[Exception]], None]
+EventCallback = Callable[[EventData], None]
+
+# max requests in one batch
+BATCH_SIZE = 50
+# max events in one page of events list
+LIST_PAGE_SIZE = 2500
+# all-day events are compared with datetimes with this margin,
+# their dates are in calendar timezone
+ALL_DAY_MARGIN = timedelta(days=1)
+
+
+class HttpPool:
+    """thread-safe pool of authorized http transports,
+    each request takes free transport (with its keep-alive connections)
+    and returns it back after response
+
+    can be used as http of service Resource, also for batch requests
+    """
+
+    def __init__(
+        self,
+        credentials: Any,
+        size: int = 4,
+        timeout: Optional[float] = None,
+        deadline: Optional[RunDeadline] = None,
+    ):
+        """
+
+        Arguments:
+            credentials -- google auth credentials
+
+        Keyword Arguments:
+            size -- number of transports, max concurrent requests
+            timeout -- socket timeout in seconds (default: no timeout)
+            deadline -- run deadline, timeout of each request is limited
+                by remaining time (optional)
+        """
+        self.credentials: Any = credentials
+        self.size: int = size
+        self.timeout: Optional[float] = timeout
+        self.deadline: Optional[RunDeadline] = deadline
+        # LIFO: last used transport has open connection
+        self._pool: "queue.LifoQueue[Any]" = queue.LifoQueue()
+        for _ in range(size):
+            self._pool.put(HttpPool.make_http(credentials, timeout))
+
+    @staticmethod
+    def make_http(credentials: Any, timeout: Optional[float] = None) -> Any:
+        """make authorized http transport (not thread-safe)"""
+
+        http = build_http()
+        http.timeout = timeout
+        return google_auth_httplib2.AuthorizedHttp(credentials, http=http)
+
+    @staticmethod
+    def set_timeout(http: Any, timeout: Optional[float]) -> None:
+        """set socket timeout of authorized http transport,
+        also for its open connections"""
+
+        transport = http.http
+        transport.timeout = timeout
+        for connection in transport.connections.values():
+            connection.timeout = timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+
+    def request(self, *args: Any, **kwargs: Any) -> Any:
+        """make request with free transport from pool (wait for it)
+
+        Raises:
+            DeadlineExceeded -- if deadline is passed
+        """
+
+        http = self._pool.get()
+        try:
+            if self.deadline is not None:
+                HttpPool.set_timeout(http, self.deadline.timeout(self.timeout))
+            return http.request(*args, **kwargs)
+        finally:
+            self._pool.put(http)
+
+    def close(self) -> None:
+        """close connections of all transports"""
+
+        # take all transports before return, LIFO queue gives last returned
+        transports = [self._pool.get() for _ in range(self.size)]
+        for http in transports:
+            http.close()
+            self._pool.put(http)
+
+
+def service_account_email(service_account_file: str) -> str:
+    """email of service account (to share calendars with it)
+
+    Arguments:
+        service_account_file -- service account filename
+    """
+
+    with open(service_account_file, "r", encoding="utf-8") as f:
+        return str(json.load(f)["client_email"])
+
+
+class ServiceAccountRing:
+    """consistent hashing of calendars to pool of service accounts,
+    to spread API quota of calendars (per account) between accounts
+
+    each account has many points on hash ring, calendar belongs to account
+    of next point after hash of calendar id: when account is added
+    or removed, only calendars of its ring segments are moved
+    """
+
+    def __init__(self, accounts: List[str], replicas: int = 100):
+        """
+
+        Arguments:
+            accounts -- service account filenames
+
+        Keyword Arguments:
+            replicas -- points of each account on hash ring
+        """
+        if not accounts:
+            raise ValueError("no service accounts")
+        self.accounts: List[str] = list(accounts)
+        points = sorted(
+            (ServiceAccountRing._hash("{}#{}".format(account, i)), account)
+            for account in self.accounts
+            for i in range(replicas)
+        )
+        self._hashes: List[int] = [point for point, _ in points]
+        self._owners: List[str] = [account for _, account in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.sha1(key.encode("utf-8")).digest()[:8], "big")
+
+    def account(self, calendar_id: str) -> str:
+        """service account of calendar
+
+        Arguments:
+            calendar_id -- calendar id
+
+        Returns:
+            service account filename
+        """
+
+        index = bisect.bisect(self._hashes, ServiceAccountRing._hash(calendar_id))
+        return self._owners[index % len(self._owners)]
+
+    @staticmethod
+    def from_config(config: Optional[Dict[str, Any]]) -> Optional["ServiceAccountRing"]:
+        """make ring from 'service_accounts' list of config dict
+
+        Returns:
+            ring or None if no pool of accounts in config
+        """
+
+        if config is None or not config.get("service_accounts"):
+            return None
+        return ServiceAccountRing(config["service_accounts"])
 
 
 class GoogleCalendarService:
@@ -100,35 +284,83 @@ class GoogleCalendarService:
     """
 
     @staticmethod
-    def default() -> discovery.Resource:
+    def build(
+        credentials: Any,
+        pool_size: Optional[int] = None,
+        timeout: Optional[float] = None,
+        deadline: Optional[RunDeadline] = None,
+    ) -> discovery.Resource:
+        """make service Resource with credentials
+
+        Arguments:
+            credentials -- google auth credentials
+
+        Keyword Arguments:
+            pool_size -- use thread-safe pool of transports of this size (optional)
+            timeout -- socket timeout in seconds (optional)
+            deadline -- limit timeouts by remaining time of run (optional)
+        """
+
+        if pool_size is not None or deadline is not None:
+            http = HttpPool(credentials, pool_size or 1, timeout, deadline)
+        elif timeout is not None:
+            http = HttpPool.make_http(credentials, timeout)
+        else:
+            return discovery.build(
+                "calendar", "v3", credentials=credentials, cache_discovery=False
+            )
+        return discovery.build("calendar", "v3", http=http, cache_discovery=False)
+
+    @staticmethod
+    def default(
+        pool_size: Optional[int] = None,
+        timeout: Optional[float] = None,
+        deadline: Optional[RunDeadline] = None,
+    ) -> discovery.Resource:
         """make service Resource from default credentials (authorize)
         ( https://developers.google.com/identity/protocols/application-default-credentials )
         ( https://googleapis.dev/python/google-auth/latest/reference/google.auth.html#google.auth.default )
+
+        Keyword Arguments:
+            pool_size -- use thread-safe pool of transports of this size (optional)
+            timeout -- socket timeout in seconds (optional)
+            deadline -- limit timeouts by remaining time of run (optional)
         """
 
         scopes = ["https://www.googleapis.com/auth/calendar"]
         credentials, _ = google.auth.default(scopes=scopes)
-        service = discovery.build(
-            "calendar", "v3", credentials=credentials, cache_discovery=False
-        )
-        return service
+        return GoogleCalendarService.build(credentials, pool_size, timeout, deadline)
 
     @staticmethod
-    def from_srv_acc_file(service_account_file: str) -> discovery.Resource:
-        """make service Resource from service account filename (authorize)"""
+    def from_srv_acc_file(
+        service_account_file: str,
+        pool_size: Optional[int] = None,
+        timeout: Optional[float] = None,
+        deadline: Optional[RunDeadline] = None,
+    ) -> discovery.Resource:
+        """make service Resource from service account filename (authorize)
+
+        Keyword Arguments:
+            pool_size -- use thread-safe pool of transports of this size (optional)
+            timeout -- socket timeout in seconds (optional)
+            deadline -- limit timeouts by remaining time of run (optional)
+        """
 
         scopes = ["https://www.googleapis.com/auth/calendar"]
         credentials = service_account.Credentials.from_service_account_file(
             service_account_file
         )
         scoped_credentials = credentials.with_scopes(scopes)
-        service = discovery.build(
-            "calendar", "v3", credentials=scoped_credentials, cache_discovery=False
+        return GoogleCalendarService.build(
+            scoped_credentials, pool_size, timeout, deadline
         )
-        return service
 
     @staticmethod
-    def from_config(config: Optional[Dict[str, str]] = None) -> discovery.Resource:
+    def from_config(
+        config: Optional[Dict[str, Any]] = None,
+        deadline: Optional[RunDeadline] = None,
+        calendar_id: Optional[str] = None,
+    ) -> discovery.Resource:
         """make service Resource from config dict
 
         Arguments:
@@ -139,17 +371,135 @@ class GoogleCalendarService:
         if key not in dict then default credentials will be used
         ( https://developers.google.com/identity/protocols/application-default-credentials )
 
+        (optional) service_accounts: - list of service account filenames,
+        calendar is assigned to one of them by consistent hashing of calendar id,
+        without calendar id: service_account (if set) or first account is used
+
+        (optional) http_pool_size: - size of thread-safe pool of http transports
+
+        (optional) http_timeout: - socket timeout in seconds
+
         -- **None**: default credentials will be used
+
+        **deadline** -- (optional) limit timeouts by remaining time of run
+
+        **calendar_id** -- (optional) calendar to use service for
         """
 
-        if config is not None and "service_account" in config:
-            service_account_filename: str = config["service_account"]
-            service = GoogleCalendarService.from_srv_acc_file(service_account_filename)
+        if config is None:
+            config = {}
+        pool_size: Optional[int] = config.get("http_pool_size")
+        timeout: Optional[float] = config.get("http_timeout")
+        service_account_filename: Optional[str] = config.get("service_account")
+        ring = ServiceAccountRing.from_config(config)
+        if ring is not None:
+            if calendar_id is not None:
+                service_account_filename = ring.account(calendar_id)
+            elif service_account_filename is None:
+                service_account_filename = ring.accounts[0]
+        if service_account_filename is not None:
+            service = GoogleCalendarService.from_srv_acc_file(
+                service_account_filename, pool_size, timeout, deadline
+            )
         else:
-            service = GoogleCalendarService.default()
+            service = GoogleCalendarService.default(pool_size, timeout, deadline)
         return service
 
 
+# base32 alphabet -> base32hex alphabet (event id characters)
+BASE32HEX = str.maketrans(
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZ234567", "0123456789abcdefghijklmnopqrstuv"
+)
+
+
+def make_event_id(calendar_id: str, ical_uid: str) -> str:
+    """deterministic event id for iCalUID in calendar,
+    sha1 of both in base32hex (allowed characters of event id)
+
+    Arguments:
+        calendar_id -- calendar id
+        ical_uid -- event iCalUID
+
+    Returns:
+        event id, 32 characters
+    """
+
+    digest = hashlib.sha1((calendar_id + "\n" + ical_uid).encode("utf-8")).digest()
+    return base64.b32encode(digest).decode("ascii").translate(BASE32HEX)
+
+
+# private extended property with fingerprint of event content
+FINGERPRINT_KEY = "ics2gcalHash"
+# fields of source event, not compared by fingerprint
+FINGERPRINT_EXCLUDED = frozenset(("id", "created", "updated", "extendedProperties"))
+
+
+def event_content_hash(event: EventData) -> str:
+    """hash of converted event content"""
+
+    content = json.dumps(event, sort_keys=True, ensure_ascii=False, default=dict)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def event_fingerprint(event: EventData) -> str:
+    """hash of converted event content, without timestamps
+
+    Arguments:
+        event -- source event resource
+
+    Returns:
+        fingerprint
+    """
+
+    content = {k: v for k, v in event.items() if k not in FINGERPRINT_EXCLUDED}
+    return event_content_hash(content)  # type: ignore
+
+
+def stored_fingerprint(event: EventData) -> Optional[str]:
+    """fingerprint saved in event (listed from calendar)
+
+    Returns:
+        fingerprint or None if not saved
+    """
+
+    return event.get("extendedProperties", {}).get("private", {}).get(FINGERPRINT_KEY)
+
+
+def format_rfc3339(value: datetime) -> str:
+    """utc datetime as string in RFC3339 format, for API requests
+
+    Arguments:
+        value -- datetime with tz-info
+
+    Returns:
+        utc datetime value as string
+    """
+
+    return utc.normalize(value.astimezone(utc)).replace(tzinfo=None).isoformat() + "Z"
+
+
+def event_time_bounds(event: EventData) -> Tuple[datetime, datetime]:
+    """start and end of event, all-day events are widened by ALL_DAY_MARGIN
+
+    Arguments:
+        event -- event resource with start and end
+
+    Returns:
+        tuple: (start, end), datetimes with tz-info
+    """
+
+    bounds: List[datetime] = []
+    for key, margin in (("start", -ALL_DAY_MARGIN), ("end", ALL_DAY_MARGIN)):
+        value: Dict[str, str] = event[key]  # type: ignore
+        if "dateTime" in value:
+            bounds.append(dateutil.parser.isoparse(value["dateTime"]))
+        else:
+            bounds.append(
+                utc.localize(dateutil.parser.isoparse(value["date"])) + margin
+            )
+    return bounds[0], bounds[1]
+
+
 def select_event_key(event: EventData) -> Optional[str]:
     """select event key for logging
 
@@ -168,24 +518,187 @@ def select_event_key(event: EventData) -> Optional[str]:
     return key
 
 
+def event_body(event: EventData) -> EventData:
+    """event resource as dict for request body
+
+    Arguments:
+        event -- event resource or read-only mapping with same keys
+
+    Returns:
+        event resource dict
+    """
+
+    if isinstance(event, dict):
+        return event
+    return EventData(**event)
+
+
 class GoogleCalendar:
     """class to interact with calendar on Google"""
 
     logger = logging.getLogger("GoogleCalendar")
 
-    def __init__(self, service: discovery.Resource, calendar_id: Optional[str]):
+    def __init__(
+        self,
+        service: discovery.Resource,
+        calendar_id: Optional[str],
+        rate_limiter: Optional[TokenBucket] = None,
+        batch_size: int = BATCH_SIZE,
+        list_shards: int = 1,
+        list_shard_span: timedelta = timedelta(days=30),
+        result_sink: Optional[ResultSink] = None,
+        quota: Optional[QuotaBudget] = None,
+        deterministic_ids: bool = False,
+        fingerprints: bool = False,
+        deadline: Optional[RunDeadline] = None,
+    ):
+        """
+
+        Arguments:
+            service -- calendar service Resource
+            calendar_id -- calendar id
+
+        Keyword Arguments:
+            rate_limiter -- limiter for all requests (optional)
+            batch_size -- max requests in one batch
+            list_shards -- number of time ranges to list events concurrently
+            list_shard_span -- time range of shard, if listing range is open
+            result_sink -- receiver of results for each event (default: log each)
+            quota -- counter and budget of API units (optional)
+            deterministic_ids -- insert events with ids made from calendar id
+                and iCalUID, so they can be updated and deleted without search
+            fingerprints -- save fingerprint of content in each written event,
+                and list it with events
+            deadline -- run deadline, write batches are not started
+                near it (optional)
+        """
         self.service: discovery.Resource = service
         self.calendar_id: str = str(calendar_id)
+        self.rate_limiter: Optional[TokenBucket] = rate_limiter
+        self.batch_size: int = batch_size
+        self.list_shards: int = list_shards
+        self.list_shard_span: timedelta = list_shard_span
+        self.result_sink: ResultSink = (
+            result_sink if result_sink is not None else LoggingResultSink(self.logger)
+        )
+        self.quota: Optional[QuotaBudget] = quota
+        self.deterministic_ids: bool = deterministic_ids
+        self.fingerprints: bool = fingerprints
+        self.deadline: Optional[RunDeadline] = deadline
+        # results (success or failure) of write requests
+        self.written: int = 0
+
+    def _execute(self, request: Any) -> Any:
+        """execute single request
+
+        Arguments:
+            request -- api request
+
+        Raises:
+            DeadlineExceeded -- if run deadline is passed (or run is cancelled)
+
+        Returns:
+            response
+        """
+
+        if self.deadline is not None:
+            self.deadline.timeout()
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        if self.quota is not None:
+            self.quota.use(1)
+        return request.execute()
+
+    def _budget_batch_size(self) -> int:
+        """max requests in next batch, limited by quota budget
+
+        Raises:
+            QuotaExceeded -- if budget is exhausted
+            DeadlineExceeded -- if run deadline is near
+        """
+
+        if self.deadline is not None:
+            self.deadline.check()
+        remaining = self.quota.remaining() if self.quota is not None else None
+        if remaining is None:
+            return self.batch_size
+        if remaining <= 0:
+            raise QuotaExceeded("quota budget exhausted for " + self.calendar_id)
+        return min(self.batch_size, remaining)
+
+    def _execute_batches(
+        self,
+        requests: Iterable[Any],
+        callback: BatchRequestCallback,
+        limited: bool = False,
+    ) -> None:
+        """execute requests with batches (of batch_size),
+        request id is sequential number of request
+
+        Arguments:
+            requests -- api requests
+            callback -- callback for each request
+
+        Keyword Arguments:
+            limited -- limit requests by quota budget and run deadline
+
+        Raises:
+            QuotaExceeded -- if limited and budget is exhausted
+                (or DeadlineExceeded if deadline is near),
+                not sent requests are skipped
+        """
+
+        batch: Any = None
+        count: int = 0
+        size: int = self.batch_size
+        for i, request in enumerate(requests):
+            if batch is None:
+                if limited:
+                    size = self._budget_batch_size()
+                batch = self.service.new_batch_http_request(callback=callback)
+                count = 0
+            batch.add(request, request_id=str(i))
+            count += 1
+            if count >= size:
+                self._execute_batch(batch, count)
+                batch = None
+        if batch is not None:
+            self._execute_batch(batch, count)
+
+    def _execute_batch(self, batch: Any, count: int) -> None:
+        """execute batch request
+
+        Arguments:
+            batch -- batch request
+            count -- number of requests in batch
+
+        Raises:
+            DeadlineExceeded -- if run deadline is passed (or run is cancelled)
+        """
+
+        if self.deadline is not None:
+            self.deadline.timeout()
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(count)
+        if self.quota is not None:
+            self.quota.use(count)
+        batch.execute()
 
     def _make_request_callback(
-        self, action: str, events_by_req: EventList
+        self,
+        action: str,
+        events_by_req: EventList,
+        on_success: Optional[EventCallback] = None,
     ) -> BatchRequestCallback:
-        """make callback for log result of batch request
+        """make callback for pass result of batch request to result sink
 
         Arguments:
             action -- action name
             events_by_req -- list of events ordered by request id
 
+        Keyword Arguments:
+            on_success -- called with source event on success (optional)
+
         Returns:
             callback function
         """
@@ -193,52 +706,153 @@ class GoogleCalendar:
         def callback(
             request_id: str, response: Any, exception: Optional[Exception]
         ) -> None:
+            self.written += 1
             event: EventData = events_by_req[int(request_id)]
             event_key: Optional[str] = select_event_key(event)
             key: str = event_key if event_key is not None else ""
 
             if exception is not None:
-                self.logger.error(
-                    "failed to %s event with %s: %s, exception: %s",
-                    action,
-                    key,
-                    event.get(key),
-                    str(exception),
-                )
+                self.result_sink.failure(action, key, event.get(key), exception)
             else:
+                if on_success is not None:
+                    on_success(event)
                 resp_key: Optional[str] = select_event_key(response)
                 if resp_key is not None:
                     event = response
                     key = resp_key
-                self.logger.info("event %s ok, %s: %s", action, key, event.get(key))
+                self.result_sink.success(action, key, event.get(key))
 
         return callback
 
-    def list_events_from(self, start: datetime) -> EventList:
-        """list events from calendar, where start date >= start"""
-        fields: str = "nextPageToken,items(id,iCalUID,updated)"
-        events: EventList = []
-        page_token: Optional[str] = None
-        time_min: str = (
-            utc.normalize(start.astimezone(utc)).replace(tzinfo=None).isoformat() + "Z"
-        )
-        while True:
-            response = (
-                self.service.events()
-                .list(
-                    calendarId=self.calendar_id,
-                    pageToken=page_token,
-                    singleEvents=True,
-                    timeMin=time_min,
-                    fields=fields,
-                )
-                .execute()
+    def _shard_bounds(
+        self, time_min: datetime, time_max: Optional[datetime]
+    ) -> List[Tuple[datetime, Optional[datetime]]]:
+        """split time range to shards for listing
+
+        Arguments:
+            time_min -- start of range
+            time_max -- end of range, None for open range
+
+        Returns:
+            list of tuples: (shard start, shard end or None)
+        """
+
+        shards = max(1, self.list_shards)
+        if time_max is not None:
+            span = (time_max - time_min) / shards
+        else:
+            span = self.list_shard_span
+        bounds: List[Tuple[datetime, Optional[datetime]]] = []
+        for i in range(shards):
+            bounds.append((time_min + span * i, time_min + span * (i + 1)))
+        bounds[-1] = (bounds[-1][0], time_max)
+        return bounds
+
+    def iter_events(
+        self,
+        time_min: datetime,
+        time_max: Optional[datetime] = None,
+        fields: Optional[str] = None,
+    ) -> Iterator[EventList]:
+        """iterate over pages of events in time range,
+        time range is split to shards (list_shards), pages of shards are requested
+        concurrently with batches
+
+        Arguments:
+            time_min -- list events, that ends after time_min
+
+        Keyword Arguments:
+            time_max -- list events, that starts before time_max (optional)
+            fields -- event fields to request (default: fields to compare with source)
+
+        Returns:
+            iterator of event lists (pages), without duplicates
+        """
+
+        shards: List[Dict[str, Any]] = []
+        for shard_min, shard_max in self._shard_bounds(time_min, time_max):
+            shard: Dict[str, Any] = dict(
+                timeMin=format_rfc3339(shard_min), pageToken=None
+            )
+            if shard_max is not None:
+                shard["timeMax"] = format_rfc3339(shard_max)
+            shards.append(shard)
+
+        if fields is None:
+            fields = self._listed_fields()
+        # events that span shard bounds are listed in each shard, only ids
+        # of events near bounds are kept to skip duplicates
+        bounds: List[datetime] = [
+            shard_min for shard_min, _ in self._shard_bounds(time_min, time_max)
+        ][1:]
+        if bounds:
+            fields = ",".join(
+                [fields]
+                + [key for key in ("start", "end") if key not in fields.split(",")]
             )
-            if "items" in response:
-                events.extend(response["items"])
-                page_token = response.get("nextPageToken")
-                if not page_token:
-                    break
+        seen: Set[str] = set()
+
+        def near_bound(event: EventData) -> bool:
+            event_start, event_end = event_time_bounds(event)
+            i = bisect.bisect_right(bounds, event_start)
+            return i < len(bounds) and bounds[i] < event_end
+
+        list_fields: str = "nextPageToken,items({})".format(fields)
+
+        def make_request(shard: Dict[str, Any]) -> Any:
+            return self.service.events().list(
+                calendarId=self.calendar_id,
+                singleEvents=True,
+                maxResults=LIST_PAGE_SIZE,
+                fields=list_fields,
+                **shard,
+            )
+
+        while shards:
+            responses: List[Any] = [None] * len(shards)
+            if 1 == len(shards):
+                responses[0] = self._execute(make_request(shards[0]))
+            else:
+                errors: List[Exception] = []
+
+                def callback(
+                    request_id: str, response: Any, exception: Optional[Exception]
+                ) -> None:
+                    if exception is not None:
+                        errors.append(exception)
+                    responses[int(request_id)] = response
+
+                self._execute_batches(map(make_request, shards), callback)
+                if errors:
+                    raise errors[0]
+
+            next_shards: List[Dict[str, Any]] = []
+            for shard, response in zip(shards, responses):
+                page: EventList = []
+                for event in response.get("items", []):
+                    if bounds and near_bound(event):
+                        if event["id"] in seen:
+                            continue
+                        seen.add(event["id"])
+                    page.append(event)
+                yield page
+                shard["pageToken"] = response.get("nextPageToken")
+                if shard["pageToken"]:
+                    next_shards.append(shard)
+            shards = next_shards
+
+    def list_events_from(
+        self, start: datetime, end: Optional[datetime] = None
+    ) -> EventList:
+        """list events from calendar, where start date >= start
+
+        Keyword Arguments:
+            end -- list only events, that starts before end (optional)
+        """
+
+        events: EventList = []
+        for page in self.iter_events(start, end):
+            events.extend(page)
         self.logger.info("%d events listed", len(events))
         return events
 
@@ -253,7 +867,8 @@ class GoogleCalendar:
                   events_exist - list of tuples: (new_event, exists_event)
         """
 
-        fields: str = "items(id,iCalUID,updated)"
+        # deleted events are found too, with status 'cancelled'
+        fields: str = "items({},status)".format(self._listed_fields())
         events_by_req: EventList = []
         exists: List[EventTuple] = []
         not_found: EventList = []
@@ -276,126 +891,350 @@ class GoogleCalendar:
             else:
                 not_found.append(events_by_req[int(request_id)])
 
-        batch = self.service.new_batch_http_request(callback=list_callback)
-        i: int = 0
-        for event in events:
-            events_by_req.append(event)
-            batch.add(
-                self.service.events().list(
+        def requests() -> Iterable[Any]:
+            for event in events:
+                events_by_req.append(event)
+                yield self.service.events().list(
                     calendarId=self.calendar_id,
                     iCalUID=event["iCalUID"],
                     showDeleted=True,
                     fields=fields,
-                ),
-                request_id=str(i),
-            )
-            i += 1
-        batch.execute()
+                )
+
+        self._execute_batches(requests(), list_callback)
         self.logger.info("%d events exists, %d not found", len(exists), len(not_found))
         return EventsSearchResults(exists, not_found)
 
-    def insert_events(self, events: EventList) -> None:
+    def _event_body(self, event: EventData) -> EventData:
+        """request body of source event, with fingerprint (if enabled)"""
+
+        body = event_body(event)
+        if self.fingerprints:
+            body = body.copy()
+            body["extendedProperties"] = EventExtendedProperties(
+                private={FINGERPRINT_KEY: event_fingerprint(event)}
+            )
+        return body
+
+    def _listed_fields(self) -> str:
+        """fields of listed events, to compare with source
+        (and start, to order operations and split them to windows)"""
+
+        if self.fingerprints:
+            return (
+                "id,iCalUID,updated,start,extendedProperties/private/" + FINGERPRINT_KEY
+            )
+        return "id,iCalUID,updated,start"
+
+    def event_id(self, event: EventData) -> str:
+        """deterministic id of event in this calendar
+
+        Arguments:
+            event -- event resource with iCalUID
+
+        Returns:
+            event id
+        """
+
+        return make_event_id(self.calendar_id, event["iCalUID"])
+
+    def insert_events(
+        self, events: EventList, on_success: Optional[EventCallback] = None
+    ) -> None:
         """insert list of events
 
+        with deterministic ids: events with existing id (maybe deleted)
+        are updated, events with existing iCalUID and other id
+        (inserted before without deterministic ids) are imported
+
         Arguments:
             events  - events list
+
+        Keyword Arguments:
+            on_success -- called with event on success (optional)
         """
 
         fields: str = "id"
         events_by_req: EventList = []
+        conflicts: EventList = []
 
-        insert_callback = self._make_request_callback("insert", events_by_req)
-        batch = self.service.new_batch_http_request(callback=insert_callback)
-        i: int = 0
-        for event in events:
-            events_by_req.append(event)
-            batch.add(
-                self.service.events().insert(
-                    calendarId=self.calendar_id, body=event, fields=fields
-                ),
-                request_id=str(i),
+        insert_callback = self._make_request_callback(
+            "insert", events_by_req, on_success
+        )
+
+        def callback(
+            request_id: str, response: Any, exception: Optional[Exception]
+        ) -> None:
+            if 409 == getattr(exception, "status_code", None):
+                conflicts.append(events_by_req[int(request_id)])
+                return
+            insert_callback(request_id, response, exception)
+
+        def requests() -> Iterable[Any]:
+            for event in events:
+                events_by_req.append(event)
+                body = self._event_body(event)
+                if self.deterministic_ids:
+                    if body is event:
+                        body = body.copy()
+                    body["id"] = self.event_id(event)
+                yield self.service.events().insert(
+                    calendarId=self.calendar_id, body=body, fields=fields
+                )
+
+        self._execute_batches(
+            requests(),
+            callback if self.deterministic_ids else insert_callback,
+            limited=True,
+        )
+        if not conflicts:
+            return
+
+        # conflict by id or by iCalUID: update by id, else not found
+        self.logger.info("%d events already exist, update them", len(conflicts))
+        missing: EventList = []
+        update_callback = self._make_request_callback("update", conflicts, on_success)
+
+        def update_conflict_callback(
+            request_id: str, response: Any, exception: Optional[Exception]
+        ) -> None:
+            if getattr(exception, "status_code", None) in (404, 410):
+                missing.append(conflicts[int(request_id)])
+                return
+            update_callback(request_id, response, exception)
+
+        self._execute_batches(
+            (
+                self.service.events().update(
+                    calendarId=self.calendar_id,
+                    eventId=self.event_id(event),
+                    body=self._event_body(event),
+                    fields=fields,
+                )
+                for event in conflicts
+            ),
+            update_conflict_callback,
+            limited=True,
+        )
+        if missing:
+            self.logger.info(
+                "%d events exist with other ids, import them", len(missing)
             )
-            i += 1
-        batch.execute()
+            self.import_events(missing, on_success)
+
+    def import_events(
+        self, events: EventList, on_success: Optional[EventCallback] = None
+    ) -> None:
+        """import list of events: insert, or update event with same iCalUID,
+        no need to find exists events before
+
+        Arguments:
+            events  - events list
 
-    def patch_events(self, event_tuples: List[EventTuple]) -> None:
+        Keyword Arguments:
+            on_success -- called with event on success (optional)
+        """
+
+        fields: str = "id"
+        events_by_req: EventList = []
+
+        import_callback = self._make_request_callback(
+            "import", events_by_req, on_success
+        )
+
+        def requests() -> Iterable[Any]:
+            for event in events:
+                events_by_req.append(event)
+                yield self.service.events().import_(
+                    calendarId=self.calendar_id,
+                    body=self._event_body(event),
+                    fields=fields,
+                )
+
+        self._execute_batches(requests(), import_callback, limited=True)
+
+    def patch_events(
+        self, event_tuples: List[EventTuple], on_success: Optional[EventCallback] = None
+    ) -> None:
         """patch (update) events
 
         Arguments:
             event_tuples  -- list of tuples: (new_event, exists_event)
+
+        Keyword Arguments:
+            on_success -- called with event on success (optional)
         """
 
         fields: str = "id"
         events_by_req: EventList = []
 
-        patch_callback = self._make_request_callback("patch", events_by_req)
-        batch = self.service.new_batch_http_request(callback=patch_callback)
-        i: int = 0
-        for event_new, event_old in event_tuples:
-            if "id" not in event_old:
-                continue
-            events_by_req.append(event_new)
-            batch.add(
-                self.service.events().patch(
-                    calendarId=self.calendar_id, eventId=event_old["id"], body=event_new
-                ),
-                fields=fields,
-                request_id=str(i),
-            )
-            i += 1
-        batch.execute()
+        patch_callback = self._make_request_callback("patch", events_by_req, on_success)
 
-    def update_events(self, event_tuples: List[EventTuple]) -> None:
+        def requests() -> Iterable[Any]:
+            for event_new, event_old in event_tuples:
+                if "id" not in event_old:
+                    continue
+                events_by_req.append(event_new)
+                yield self.service.events().patch(
+                    calendarId=self.calendar_id,
+                    eventId=event_old["id"],
+                    body=self._event_body(event_new),
+                    fields=fields,
+                )
+
+        self._execute_batches(requests(), patch_callback, limited=True)
+
+    def update_events(
+        self, event_tuples: List[EventTuple], on_success: Optional[EventCallback] = None
+    ) -> None:
         """update events
 
         Arguments:
             event_tuples  -- list of tuples: (new_event, exists_event)
+
+        Keyword Arguments:
+            on_success -- called with event on success (optional)
         """
 
         fields: str = "id"
         events_by_req: EventList = []
 
-        update_callback = self._make_request_callback("update", events_by_req)
-        batch = self.service.new_batch_http_request(callback=update_callback)
-        i: int = 0
-        for event_new, event_old in event_tuples:
-            if "id" not in event_old:
-                continue
-            events_by_req.append(event_new)
-            batch.add(
-                self.service.events().update(
+        update_callback = self._make_request_callback(
+            "update", events_by_req, on_success
+        )
+
+        def requests() -> Iterable[Any]:
+            for event_new, event_old in event_tuples:
+                if "id" not in event_old:
+                    continue
+                events_by_req.append(event_new)
+                yield self.service.events().update(
                     calendarId=self.calendar_id,
                     eventId=event_old["id"],
-                    body=event_new,
+                    body=self._event_body(event_new),
                     fields=fields,
-                ),
-                request_id=str(i),
-            )
-            i += 1
-        batch.execute()
+                )
+
+        self._execute_batches(requests(), update_callback, limited=True)
 
-    def delete_events(self, events: EventList) -> None:
-        """delete events
+    def delete_events(
+        self, events: EventList, on_success: Optional[EventCallback] = None
+    ) -> None:
+        """delete events, already deleted events (HTTP 404 or 410)
+        are deleted successfully
+
+        with deterministic ids: events not found by their deterministic id
+        are searched by iCalUID (inserted before without deterministic ids)
+        and deleted by found id
 
         Arguments:
             events  -- list of events
+
+        Keyword Arguments:
+            on_success -- called with event on success (optional)
         """
 
         events_by_req: EventList = []
+        missing: EventList = []
+
+        result_callback = self._make_request_callback(
+            "delete", events_by_req, on_success
+        )
 
-        delete_callback = self._make_request_callback("delete", events_by_req)
-        batch = self.service.new_batch_http_request(callback=delete_callback)
-        i: int = 0
-        for event in events:
-            events_by_req.append(event)
-            batch.add(
-                self.service.events().delete(
+        def delete_callback(
+            request_id: str, response: Any, exception: Optional[Exception]
+        ) -> None:
+            status = getattr(exception, "status_code", None)
+            if status in (404, 410):
+                event = events_by_req[int(request_id)]
+                if (
+                    404 == status
+                    and self.deterministic_ids
+                    and event["id"] == self.event_id(event)
+                ):
+                    missing.append(event)
+                    return
+                self.logger.info("event %s already deleted", event["id"])
+                result_callback(request_id, "", None)
+                return
+            result_callback(request_id, response, exception)
+
+        def requests() -> Iterable[Any]:
+            for event in events:
+                events_by_req.append(event)
+                yield self.service.events().delete(
                     calendarId=self.calendar_id, eventId=event["id"]
-                ),
-                request_id=str(i),
-            )
-            i += 1
-        batch.execute()
+                )
+
+        self._execute_batches(requests(), delete_callback, limited=True)
+        if not missing:
+            return
+
+        # not found by id: inserted with other id, or already deleted
+        self.logger.info("%d events not found by id, search them", len(missing))
+        exists, not_found = self.find_exists(missing)
+        legacy: EventList = []
+        for event, exists_event in exists:
+            if "cancelled" == exists_event.get("status"):
+                not_found.append(event)
+            else:
+                legacy.append(exists_event)
+        done_callback = self._make_request_callback("delete", not_found, on_success)
+        for request_id in range(len(not_found)):
+            done_callback(str(request_id), "", None)
+        if legacy:
+            self.delete_events(legacy, on_success)
+
+    def prune_events(
+        self, before: datetime, time_min: Optional[datetime] = None
+    ) -> int:
+        """delete events, that end before datetime (retention of past events):
+        ids are listed by shards (list_shards), then events are deleted
+        by batches, with rate limit and quota budget
+
+        if quota budget is exhausted (or run deadline is near),
+        remaining events are deleted by next call
+
+        Arguments:
+            before -- events that end before it are deleted
+
+        Keyword Arguments:
+            time_min -- list events that end after it (default: 1970-01-01)
+
+        Returns:
+            number of deleted events
+        """
+
+        if time_min is None:
+            time_min = datetime(1970, 1, 1, tzinfo=utc)
+        if before <= time_min:
+            return 0
+
+        to_delete: EventList = []
+        deleted: EventList = []
+        try:
+            # deletes change listing, so all ids are listed before
+            for page in self.iter_events(time_min, before, fields="id,iCalUID,end"):
+                for event in page:
+                    end: Dict[str, str] = event["end"]  # type: ignore
+                    if "dateTime" in end:
+                        event_end = dateutil.parser.isoparse(end["dateTime"])
+                    else:
+                        event_end = utc.localize(dateutil.parser.isoparse(end["date"]))
+                    if event_end <= before:
+                        to_delete.append(
+                            EventData(id=event["id"], iCalUID=event["iCalUID"])
+                        )
+            self.delete_events(to_delete, deleted.append)
+        except QuotaExceeded as e:
+            self.logger.warning("%s, remaining events are deleted by next run", e)
+        self.logger.info(
+            "%d of %d events ended before %s deleted",
+            len(deleted),
+            len(to_delete),
+            format_rfc3339(before),
+        )
+        return len(deleted)
 
     def create(self, summary: str, time_zone: Optional[str] = None) -> Any:
         """create calendar
@@ -414,22 +1253,83 @@ class GoogleCalendar:
         if time_zone is not None:
             calendar["timeZone"] = time_zone
 
-        created_calendar = self.service.calendars().insert(body=calendar).execute()
+        created_calendar = self._execute(self.service.calendars().insert(body=calendar))
         self.calendar_id = created_calendar["id"]
         return created_calendar
 
     def delete(self) -> None:
         """delete calendar"""
 
-        self.service.calendars().delete(calendarId=self.calendar_id).execute()
+        self._execute(self.service.calendars().delete(calendarId=self.calendar_id))
+
+    def clear(self) -> None:
+        """delete all events of calendar (only primary calendar of account)"""
+
+        self._execute(self.service.calendars().clear(calendarId=self.calendar_id))
+
+    def acl_rules(self) -> List[ACLRule]:
+        """list ACL rules of calendar
+
+        Returns:
+            list of rules (with id)
+        """
+
+        rules: List[ACLRule] = []
+        page_token: Optional[str] = None
+        while True:
+            response = self._execute(
+                self.service.acl().list(
+                    calendarId=self.calendar_id, pageToken=page_token
+                )
+            )
+            rules.extend(response.get("items", []))
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                break
+        return rules
+
+    def recreate(self) -> Any:
+        """delete all events by replace of calendar with new empty one,
+        with same properties and ACL rules (calendar id is changed)
+
+        Returns:
+            new calendar Resource
+        """
+
+        old_id = self.calendar_id
+        old_calendar = self._execute(self.service.calendars().get(calendarId=old_id))
+        old_rules = self.acl_rules()
+
+        calendar = CalendarData(summary=old_calendar["summary"])
+        for key in ("description", "location", "timeZone"):
+            if key in old_calendar:
+                calendar[key] = old_calendar[key]  # type: ignore
+        created_calendar = self._execute(self.service.calendars().insert(body=calendar))
+        self.calendar_id = created_calendar["id"]
+
+        # new calendar has owner rule for creator
+        exists_rules = {rule["id"] for rule in self.acl_rules()}  # type: ignore
+        for rule in old_rules:
+            if rule["id"] in exists_rules:  # type: ignore
+                continue
+            self._execute(
+                self.service.acl().insert(
+                    calendarId=self.calendar_id,
+                    body=ACLRule(scope=rule["scope"], role=rule["role"]),
+                )
+            )
+
+        self._execute(self.service.calendars().delete(calendarId=old_id))
+        self.logger.warning("calendar %s recreated as %s", old_id, self.calendar_id)
+        return created_calendar
 
     def make_public(self) -> None:
         """make calendar public"""
 
         rule_public = ACLRule(scope=ACLScope(type="default"), role="reader")
-        self.service.acl().insert(
-            calendarId=self.calendar_id, body=rule_public
-        ).execute()
+        self._execute(
+            self.service.acl().insert(calendarId=self.calendar_id, body=rule_public)
+        )
 
     def add_owner(self, email: str) -> None:
         """add calendar owner by email
@@ -439,6 +1339,6 @@ class GoogleCalendar:
         """
 
         rule_owner = ACLRule(scope=ACLScope(type="user", value=email), role="owner")
-        self.service.acl().insert(
-            calendarId=self.calendar_id, body=rule_owner
-        ).execute()
+        self._execute(
+            self.service.acl().insert(calendarId=self.calendar_id, body=rule_owner)
+        )
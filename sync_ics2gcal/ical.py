@@ -1,7 +1,26 @@
 import datetime
+import json
 import logging
-from typing import Union, Dict, Callable, Optional, Mapping, TypedDict
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Union,
+    Dict,
+    Callable,
+    Optional,
+    Mapping,
+    TypedDict,
+    List,
+    Tuple,
+    NamedTuple,
+    Iterator,
+    Any,
+    IO,
+    Iterable,
+    cast,
+)
 
+import dateutil.parser
 from icalendar import Calendar, Event
 from pytz import utc
 
@@ -12,6 +31,7 @@ from .gcal import (
     EventDateTime,
     EventDate,
     EventDataKey,
+    event_content_hash,
 )
 
 DateDateTime = Union[datetime.date, datetime.datetime]
@@ -171,13 +191,332 @@ class EventConverter(Event):  # type: ignore
         return event
 
 
+def ical_date_or_datetime(value: EventDateOrDateTime) -> DateDateTime:
+    """date or datetime from gcal (start or end dict), reverse of
+    gcal_date_or_datetime
+
+    Arguments:
+        value -- { 'date': ... } or { 'dateTime': ... }
+
+    Returns:
+        date or utc datetime
+    """
+
+    if "date" in value:
+        return datetime.date.fromisoformat(value["date"])  # type: ignore
+    result = dateutil.parser.isoparse(value["dateTime"])  # type: ignore
+    return utc.normalize(result.astimezone(utc))
+
+
+def gcal_to_ical(event: EventData) -> Event:
+    """Convert google calendar resource back to icalendar event,
+    with properties used by EventConverter
+
+    instance of recurring event (listed with singleEvents) has UID of series
+    and RECURRENCE-ID of its original start
+
+    Arguments:
+        event -- google calendar#event resource
+
+    Returns:
+        icalendar event
+    """
+
+    ics_event = Event()
+    ics_event.add("UID", event.get("iCalUID") or event["id"])
+    ics_event.add("DTSTART", ical_date_or_datetime(event["start"]))
+    ics_event.add("DTEND", ical_date_or_datetime(event["end"]))
+    if "originalStartTime" in event:
+        ics_event.add(
+            "RECURRENCE-ID", ical_date_or_datetime(event["originalStartTime"])
+        )
+    if "summary" in event:
+        ics_event.add("SUMMARY", event["summary"])
+    if "description" in event:
+        ics_event.add("DESCRIPTION", event["description"])
+    if "location" in event:
+        ics_event.add("LOCATION", event["location"])
+    if "created" in event:
+        ics_event.add("CREATED", dateutil.parser.parse(event["created"]))
+    if "updated" in event:
+        updated = dateutil.parser.parse(event["updated"])
+        ics_event.add("LAST-MODIFIED", updated)
+        ics_event.add("DTSTAMP", updated)
+    if "transparency" in event:
+        ics_event.add("TRANSP", event["transparency"].upper())
+    return ics_event
+
+
+def write_ics(pages: Iterable[EventList], f: IO[str]) -> int:
+    """write events to ics file, page by page, without holding all events
+
+    Arguments:
+        pages -- iterable of event lists (google calendar#event resources)
+        f -- file opened for writing (with newline='')
+
+    Returns:
+        number of written events
+    """
+
+    f.write("BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//sync-ics2gcal//EN\r\n")
+    count: int = 0
+    for page in pages:
+        f.write("".join(gcal_to_ical(event).to_ical().decode() for event in page))
+        count += len(page)
+    f.write("END:VCALENDAR\r\n")
+    return count
+
+
+def event_start_str(event: EventData) -> str:
+    """start date or datetime of event as string"""
+
+    start: EventDateOrDateTime = event["start"]
+    if "date" in start:
+        return start["date"]  # type: ignore
+    return start["dateTime"]  # type: ignore
+
+
+class SourceDelta(NamedTuple):
+    """Changes of source since last snapshot"""
+
+    added: EventList
+    changed: EventList
+    removed: EventList
+
+
+SnapshotEntries = Dict[str, Tuple[str, str]]
+
+
+class SourceSnapshot:
+    """compact snapshot of last synced source: UID -> (content hash, start)"""
+
+    logger = logging.getLogger("SourceSnapshot")
+
+    def __init__(self, filename: str, reconcile_every: int = 0):
+        """
+
+        Arguments:
+            filename -- snapshot filename
+
+        Keyword Arguments:
+            reconcile_every -- make full sync (no delta) every N runs, 0 - never
+        """
+        self.filename: str = filename
+        self.reconcile_every: int = reconcile_every
+        self.runs: int = 0
+        # stale events are not known by snapshot, next sync is full
+        self.reconcile: bool = False
+        self.entries: Optional[SnapshotEntries] = None
+        self.pending: Optional[SnapshotEntries] = None
+
+    def load(self) -> None:
+        """load snapshot from file, if exists"""
+
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.runs = data["runs"]
+        self.reconcile = data.get("reconcile", False)
+        self.entries = {uid: (h, start) for uid, (h, start) in data["events"].items()}
+        self.logger.info("%d events in snapshot", len(self.entries))
+
+    def delta(self, events: EventList, full: bool = False) -> Optional[SourceDelta]:
+        """compare events with snapshot, new entries will be saved by commit
+
+        Arguments:
+            events -- converted source events
+
+        Keyword Arguments:
+            full -- full sync requested, only save new entries
+
+        Returns:
+            SourceDelta or None if full sync needed
+        """
+
+        self.pending = {
+            event["iCalUID"]: (event_content_hash(event), event_start_str(event))
+            for event in events
+        }
+        if full or self.entries is None:
+            return None
+        if self.reconcile:
+            self.logger.info("full sync, previous sync is not applied completely")
+            return None
+        if self.reconcile_every > 0 and self.runs + 1 >= self.reconcile_every:
+            self.logger.info("full sync for reconciliation")
+            return None
+
+        entries: SnapshotEntries = self.entries
+        added: EventList = []
+        changed: EventList = []
+        for event in events:
+            uid = event["iCalUID"]
+            if uid not in entries:
+                added.append(event)
+            elif entries[uid][0] != self.pending[uid][0]:
+                changed.append(event)
+
+        removed: EventList = []
+        for uid, (_, start) in entries.items():
+            if uid in self.pending:
+                continue
+            start_key = "dateTime" if "T" in start else "date"
+            removed.append(
+                EventData(iCalUID=uid, start={start_key: start})  # type: ignore
+            )
+
+        self.logger.info(
+            "source delta: ( added: %d, changed: %d, removed: %d )",
+            len(added),
+            len(changed),
+            len(removed),
+        )
+        return SourceDelta(added, changed, removed)
+
+    def commit(self, full: bool, retry: Iterable[str] = ()) -> None:
+        """save pending entries to file, after sync
+
+        events of not applied operations keep their last synced state:
+        changed and added events are removed from snapshot (added on next delta),
+        removed events are kept (removed on next delta), other events
+        force full sync on next run
+
+        Arguments:
+            full -- full sync was made
+
+        Keyword Arguments:
+            retry -- UIDs of events, which operations are not applied
+        """
+
+        if self.pending is None:
+            return
+        entries, self.pending = self.pending, None
+        previous: SnapshotEntries = self.entries or {}
+        self.reconcile = False
+        retried = 0
+        for uid in retry:
+            retried += 1
+            if uid in entries:
+                del entries[uid]
+            elif uid in previous:
+                entries[uid] = previous[uid]
+            else:
+                self.reconcile = True
+        if retried:
+            self.logger.info("%d events are synced again on next run", retried)
+        self.runs = 0 if full else self.runs + 1
+        self.entries = entries
+        data = {"runs": self.runs, "reconcile": self.reconcile, "events": entries}
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_filename, self.filename)
+
+    def reset(self) -> None:
+        """forget saved entries (remove file), next sync is full"""
+
+        self.entries = None
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+class CompactEvent(Mapping[str, Any]):
+    """Compact read-only event, with same keys as google calendar resource
+
+    start/end dicts are made on access, repeated strings are shared by pool
+    """
+
+    __slots__ = (
+        "iCalUID",
+        "start_key",
+        "start_value",
+        "end_key",
+        "end_value",
+        "summary",
+        "description",
+        "location",
+        "created",
+        "updated",
+        "transparency",
+    )
+
+    _str_keys = (
+        "iCalUID",
+        "summary",
+        "description",
+        "location",
+        "created",
+        "updated",
+        "transparency",
+    )
+
+    def __init__(self, event: EventData, pool: Dict[str, str]):
+        """
+
+        Arguments:
+            event -- converted event
+            pool -- pool of strings, to share equal values between events
+        """
+
+        for key in CompactEvent._str_keys:
+            value: Optional[str] = event.get(key)  # type: ignore
+            if value is not None:
+                value = pool.setdefault(value, value)
+            setattr(self, key, value)
+        ((self.start_key, self.start_value),) = event["start"].items()
+        ((self.end_key, self.end_value),) = event["end"].items()
+
+    def __getitem__(self, key: str) -> Any:
+        value: Any = None
+        if "start" == key:
+            value = {self.start_key: self.start_value}
+        elif "end" == key:
+            value = {self.end_key: self.end_value}
+        elif key in CompactEvent._str_keys:
+            value = getattr(self, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        yield "iCalUID"
+        yield "start"
+        yield "end"
+        for key in CompactEvent._str_keys[1:]:
+            if getattr(self, key) is not None:
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return "CompactEvent({!r})".format(dict(self))
+
+
 class CalendarConverter:
     """Convert icalendar events to google calendar resources"""
 
     logger = logging.getLogger("CalendarConverter")
 
-    def __init__(self, calendar: Optional[Calendar] = None):
+    def __init__(
+        self,
+        calendar: Optional[Calendar] = None,
+        snapshot: Optional[SourceSnapshot] = None,
+        compact: bool = False,
+    ):
+        """
+
+        Keyword Arguments:
+            calendar -- loaded calendar (optional)
+            snapshot -- snapshot of last synced source (optional)
+            compact -- convert to CompactEvent (less memory for large calendars)
+        """
         self.calendar: Optional[Calendar] = calendar
+        self.snapshot: Optional[SourceSnapshot] = snapshot
+        self.compact: bool = compact
+        if snapshot is not None:
+            snapshot.load()
 
     def load(self, filename: str) -> None:
         """load calendar from ics file"""
@@ -189,13 +528,155 @@ class CalendarConverter:
         """load calendar from ics string"""
         self.calendar = Calendar.from_ical(string)
 
-    def events_to_gcal(self) -> EventList:
-        """Convert events to google calendar resources"""
+    def unload(self) -> None:
+        """free loaded calendar, after its events are converted"""
+        self.calendar = None
+
+    def _iter_events(self) -> Iterator[EventData]:
+        """iterate over converted events"""
 
         calendar: Calendar = self.calendar
         ics_events = calendar.walk(name="VEVENT")
         self.logger.info("%d events read", len(ics_events))
+        return map(lambda event: EventConverter(event).convert(), ics_events)
+
+    def iter_events(self) -> Iterator[EventData]:
+        """Convert events to google calendar resources one by one,
+        without list of all events"""
 
-        result = list(map(lambda event: EventConverter(event).convert(), ics_events))
+        return self._iter_events()
+
+    def events_to_gcal(self) -> EventList:
+        """Convert events to google calendar resources"""
+
+        result: EventList
+        if self.compact:
+            pool: Dict[str, str] = {}
+            result = [
+                cast(EventData, CompactEvent(event, pool))
+                for event in self._iter_events()
+            ]
+        else:
+            result = list(self._iter_events())
         self.logger.info("%d events converted", len(result))
         return result
+
+    def events_delta(
+        self, events: EventList, full: bool = False
+    ) -> Optional[SourceDelta]:
+        """changes of converted events since last snapshot
+
+        Arguments:
+            events -- converted events
+
+        Keyword Arguments:
+            full -- full sync requested, only save new snapshot entries
+
+        Returns:
+            SourceDelta or None if no snapshot (full sync needed)
+        """
+
+        if self.snapshot is None:
+            return None
+        return self.snapshot.delta(events, full)
+
+    def commit_snapshot(self, full: bool, retry: Iterable[str] = ()) -> None:
+        """save snapshot of events from last events_delta call (if any)
+
+        Arguments:
+            full -- full sync was made
+
+        Keyword Arguments:
+            retry -- UIDs of events, which operations are not applied
+        """
+
+        if self.snapshot is not None:
+            self.snapshot.commit(full, retry)
+
+    def reset_snapshot(self) -> None:
+        """forget snapshot (if any), next sync is full"""
+
+        if self.snapshot is not None:
+            self.snapshot.reset()
+
+
+class MergeSource(NamedTuple):
+    """One source of merged calendar"""
+
+    converter: CalendarConverter
+    filename: str
+    uid_prefix: Optional[str] = None
+
+
+# rules to select event from many sources with same iCalUID
+MERGE_CONFLICT_RULES = ("first", "last", "updated")
+
+
+class MergedCalendarConverter(CalendarConverter):
+    """Convert events of many ics sources to one list of google calendar
+    resources, sources are loaded and converted concurrently
+    """
+
+    logger = logging.getLogger("MergedCalendarConverter")
+
+    def __init__(
+        self, sources: List[MergeSource], conflict: str = "first", **kwargs: Any
+    ):
+        """
+
+        Arguments:
+            sources -- converters with filenames and optional prefixes of iCalUID
+
+        Keyword Arguments:
+            conflict -- event for same iCalUID from many sources:
+                'first' (default) or 'last' source in list,
+                'updated' - last updated event
+            kwargs -- CalendarConverter arguments
+        """
+        if conflict not in MERGE_CONFLICT_RULES:
+            raise ValueError("unknown conflict rule: {}".format(conflict))
+        super().__init__(**kwargs)
+        self.sources: List[MergeSource] = sources
+        self.conflict: str = conflict
+
+    def _replace(self, exists_event: EventData, new_event: EventData) -> bool:
+        if "first" == self.conflict:
+            return False
+        if "last" == self.conflict:
+            return True
+        return new_event.get("updated", "") > exists_event.get("updated", "")
+
+    @staticmethod
+    def _convert_source(source: MergeSource) -> EventList:
+        source.converter.load(source.filename)
+        events = list(source.converter._iter_events())
+        source.converter.unload()
+        if source.uid_prefix:
+            for event in events:
+                event["iCalUID"] = source.uid_prefix + event["iCalUID"]
+        return events
+
+    def _iter_events(self) -> Iterator[EventData]:
+        with ThreadPoolExecutor(max_workers=max(1, len(self.sources))) as executor:
+            converted = list(
+                executor.map(MergedCalendarConverter._convert_source, self.sources)
+            )
+
+        merged: Dict[str, EventData] = {}
+        conflicts: int = 0
+        for events in converted:
+            for event in events:
+                uid = event["iCalUID"]
+                exists_event = merged.get(uid)
+                if exists_event is not None:
+                    conflicts += 1
+                    if not self._replace(exists_event, event):
+                        continue
+                merged[uid] = event
+        if conflicts > 0:
+            self.logger.warning(
+                "%d events with same iCalUID in many sources, selected by '%s'",
+                conflicts,
+                self.conflict,
+            )
+        return iter(merged.values())
@@ -0,0 +1,461 @@
+import datetime
+import hashlib
+import logging
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pytz
+from icalendar import Calendar
+from icalendar.parser import escape_string, unescape_string, unescape_char
+from icalendar.prop import vDDDTypes
+from icalendar.windows_to_olson import WINDOWS_TO_OLSON
+
+from .cache import ConversionCache
+from .gcal import EventData, EventDateOrDateTime
+from .ical import (
+    CalendarConverter,
+    EventConverter,
+    format_datetime_utc,
+    gcal_date_or_datetime,
+)
+
+# a fold is line break followed by either a space or a tab
+FOLD = re.compile("(\r?\n)+[ \t]")
+NEWLINE = re.compile(r"\r?\n")
+VTIMEZONE = re.compile(
+    r"^BEGIN:VTIMEZONE\r?$.*?^END:VTIMEZONE\r?$", re.MULTILINE | re.DOTALL | re.I
+)
+VTIMEZONE_TZID = re.compile(r"^TZID[;:](?:.*:)?(.*?)\r?$", re.MULTILINE | re.I)
+TZID_PARAM = re.compile(r'TZID=(?:"([^"]*)"|([^;:]*))', re.I)
+
+# version of conversion, part of cache key: change it when converted events change
+CACHE_VERSION = "1"
+
+# properties used by EventConverter
+EVENT_PROPERTIES = frozenset(
+    (
+        "UID",
+        "DTSTART",
+        "DTEND",
+        "DURATION",
+        "SUMMARY",
+        "DESCRIPTION",
+        "LOCATION",
+        "CREATED",
+        "LAST-MODIFIED",
+        "TRANSP",
+    )
+)
+
+# property name -> (parameters, value)
+EventProperties = Dict[str, Tuple[Dict[str, str], str]]
+
+
+class UnsupportedEvent(Exception):
+    """event can't be converted by fast parser"""
+
+
+def split_content_line(line: str) -> Tuple[str, str, str]:
+    """split content line to name, parameters and value
+    (with same escaping as icalendar)
+
+    Arguments:
+        line -- unfolded content line
+
+    Returns:
+        (name, parameters string, value)
+    """
+
+    st = escape_string(line) if "\\" in line else line
+    value_split = st.find(":")
+    name_split = st.find(";", 0, value_split)
+    if '"' in st[:value_split]:
+        # ':' or ';' may be quoted in parameters
+        in_quotes = False
+        name_split = value_split = -1
+        for i, ch in enumerate(st):
+            if ch == '"':
+                in_quotes = not in_quotes
+            elif not in_quotes:
+                if ch == ";" and name_split < 0:
+                    name_split = i
+                if ch == ":":
+                    value_split = i
+                    break
+    if value_split < 0:
+        raise UnsupportedEvent("invalid content line")
+    if name_split < 0:
+        name_split = value_split
+    value = st[value_split + 1 :]
+    if "%" in value:
+        value = unescape_string(value)
+    return st[:name_split].upper(), st[name_split + 1 : value_split], value
+
+
+def unfold_lines(lines: Iterable[str]) -> Iterator[str]:
+    """unfold content lines one by one (same as FOLD for whole text),
+    empty lines are skipped
+
+    Arguments:
+        lines -- lines of ics file
+
+    Returns:
+        iterator of unfolded lines
+    """
+
+    current: Optional[str] = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line:
+            continue
+        if line[0] in " \t" and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current is not None:
+        yield current
+
+
+def parse_parameters(st: str) -> Dict[str, str]:
+    """parse parameters string
+
+    Arguments:
+        st -- parameters string, without property name
+
+    Returns:
+        dict: parameter name -> value
+    """
+
+    result: Dict[str, str] = {}
+    if not st:
+        return result
+    for param in st.split(";"):
+        key, sep, value = param.partition("=")
+        if not sep:
+            raise UnsupportedEvent("invalid parameter")
+        if '"' in value:
+            if len(value) < 2 or '"' != value[0] or '"' != value[-1]:
+                raise UnsupportedEvent("quoted parameter")
+            value = value[1:-1]
+        result[unescape_string(key).upper()] = unescape_string(value)
+    return result
+
+
+def resolve_tzid(tzid: str) -> str:
+    """check that timezone is known without VTIMEZONE (as in icalendar)
+
+    Arguments:
+        tzid -- TZID parameter value
+
+    Raises:
+        UnsupportedEvent -- if custom timezone
+
+    Returns:
+        tzid
+    """
+
+    if tzid.strip("/") not in pytz.all_timezones_set and tzid not in WINDOWS_TO_OLSON:
+        raise UnsupportedEvent("custom timezone: " + tzid)
+    return tzid
+
+
+class FastEventConverter:
+    """Convert event properties to google calendar resource,
+    same as EventConverter, but without icalendar component
+    """
+
+    def __init__(self, props: EventProperties):
+        self.props: EventProperties = props
+
+    def _str_prop(self, prop: str) -> str:
+        value = self.props[prop][1]
+        if "\\" in value:
+            value = unescape_char(value)
+        return value
+
+    def _decoded(self, prop: str):  # type: ignore
+        params, value = self.props[prop]
+        tzid: Optional[str] = params.get("TZID")
+        if tzid is not None:
+            return vDDDTypes.from_ical(value, timezone=resolve_tzid(tzid))
+        if 16 == len(value) and "Z" == value[15] and "T" == value[8]:
+            # utc datetime, most common
+            return datetime.datetime(
+                int(value[:4]),
+                int(value[4:6]),
+                int(value[6:8]),
+                int(value[9:11]),
+                int(value[11:13]),
+                int(value[13:15]),
+                tzinfo=pytz.utc,
+            )
+        return vDDDTypes.from_ical(value)
+
+    def _gcal_end(self) -> EventDateOrDateTime:
+        if "DTEND" in self.props:
+            return gcal_date_or_datetime(self._decoded("DTEND"))
+        start_val = self._decoded("DTSTART")
+        end_val = start_val + self._decoded("DURATION")
+        return gcal_date_or_datetime(end_val, check_value=start_val)
+
+    def convert(self) -> EventData:
+        """Convert
+
+        Raises:
+            UnsupportedEvent, KeyError, ValueError -- if can't convert
+
+        Returns:
+            dict - google calendar#event resource
+        """
+
+        props = self.props
+        event: EventData = EventData(
+            iCalUID=self._str_prop("UID"),
+            start=gcal_date_or_datetime(self._decoded("DTSTART")),
+            end=self._gcal_end(),
+        )
+        if "SUMMARY" in props:
+            event["summary"] = self._str_prop("SUMMARY")
+        if "DESCRIPTION" in props:
+            event["description"] = self._str_prop("DESCRIPTION")
+        if "LOCATION" in props:
+            event["location"] = self._str_prop("LOCATION")
+        if "CREATED" in props:
+            event["created"] = format_datetime_utc(self._decoded("CREATED"))
+        if "LAST-MODIFIED" in props:
+            event["updated"] = format_datetime_utc(self._decoded("LAST-MODIFIED"))
+        if "TRANSP" in props:
+            event["transparency"] = self._str_prop("TRANSP").lower()
+        return event
+
+
+class RawEvent:
+    """VEVENT content lines with parsed properties used by EventConverter"""
+
+    def __init__(self, lines: List[str], props: EventProperties):
+        self.lines: List[str] = lines
+        self.props: EventProperties = props
+
+
+class FastCalendarConverter(CalendarConverter):
+    """Convert ics events to google calendar resources with fast parser,
+    only for properties used by EventConverter
+
+    events with anything else (custom timezones, unusual values, errors)
+    are converted by icalendar and EventConverter
+
+    with stream, file is not loaded to memory: events are read from it
+    on each iteration, one at a time (only VTIMEZONE components are kept)
+    """
+
+    logger = logging.getLogger("FastCalendarConverter")
+
+    def __init__(
+        self,
+        text: Optional[str] = None,
+        cache: Optional[ConversionCache] = None,
+        fast: bool = True,
+        stream: bool = False,
+        **kwargs: Any
+    ):
+        """
+
+        Keyword Arguments:
+            text -- ics content (optional)
+            cache -- cache of converted events between runs (optional)
+            fast -- convert by fast parser, else each event by icalendar
+            stream -- read events from file on iteration, instead of load
+            kwargs -- CalendarConverter arguments
+        """
+        super().__init__(**kwargs)
+        self.text: Optional[str] = None
+        self.filename: Optional[str] = None
+        self.timezones: List[str] = []
+        self.timezones_by_id: Dict[str, str] = {}
+        self.cache: Optional[ConversionCache] = cache
+        self.fast: bool = fast
+        self.stream: bool = stream
+        if text is not None:
+            self.loads(text)
+
+    def load(self, filename: str) -> None:
+        """load calendar from ics file (with stream: only its VTIMEZONE)"""
+        if self.stream:
+            self.text = None
+            self.filename = filename
+            self._set_timezones(self._stream_timezones())
+            self.logger.info("%s opened", filename)
+            return
+        with open(filename, "r", encoding="utf-8") as f:
+            self.loads(f.read())
+            self.logger.info("%s loaded", filename)
+
+    def loads(self, string: str) -> None:
+        """load calendar from ics string"""
+        self.filename = None
+        self.text = FOLD.sub("", string)
+        self._set_timezones([m.group(0) for m in VTIMEZONE.finditer(self.text)])
+
+    def unload(self) -> None:
+        self.text = None
+        self.filename = None
+        self._set_timezones([])
+
+    def _set_timezones(self, timezones: List[str]) -> None:
+        self.timezones = timezones
+        self.timezones_by_id = {}
+        for timezone in self.timezones:
+            match = VTIMEZONE_TZID.search(timezone)
+            if match is not None:
+                self.timezones_by_id[match.group(1)] = timezone
+
+    def _lines(self) -> Iterator[str]:
+        """unfolded lines of loaded text, or of opened file"""
+
+        if self.filename is None:
+            yield from NEWLINE.split(self.text or "")
+            return
+        with open(self.filename, "r", encoding="utf-8") as f:
+            yield from unfold_lines(f)
+
+    def _stream_timezones(self) -> List[str]:
+        """VTIMEZONE components of opened file, as found by VTIMEZONE"""
+
+        timezones: List[str] = []
+        lines: Optional[List[str]] = None
+        for line in self._lines():
+            upper = line.upper()
+            if "BEGIN:VTIMEZONE" == upper:
+                lines = []
+            if lines is not None:
+                lines.append(line)
+                if "END:VTIMEZONE" == upper:
+                    timezones.append("\n".join(lines))
+                    lines = None
+        return timezones
+
+    def raw_events(self) -> Iterator[RawEvent]:
+        """split calendar to VEVENT components
+
+        Returns:
+            iterator of RawEvent
+        """
+
+        lines: List[str] = []
+        props: EventProperties = {}
+        stack: List[str] = []
+        in_event: bool = False
+        unsupported: bool = False
+        for line in self._lines():
+            if not line:
+                continue
+            head = line[:4].upper()
+            if "BEGI" == head or "END:" == head:
+                name, _, value = line.partition(":")
+                name = name.upper()
+                value = value.upper()
+                if "BEGIN" == name:
+                    stack.append(value)
+                    if "VEVENT" == value and not in_event:
+                        in_event = True
+                        lines, props, unsupported = [], {}, False
+                elif "END" == name and stack:
+                    stack.pop()
+                    if "VEVENT" == value and in_event and "VEVENT" not in stack:
+                        lines.append(line)
+                        in_event = False
+                        yield RawEvent(lines, {} if unsupported else props)
+                        continue
+            if not in_event:
+                continue
+            lines.append(line)
+            if self.fast and "VEVENT" == stack[-1]:
+                try:
+                    name, params_str, value = split_content_line(line)
+                    if name in EVENT_PROPERTIES:
+                        if name in props:
+                            # icalendar decodes it as list
+                            raise UnsupportedEvent("duplicate property")
+                        props[name] = (parse_parameters(params_str), value)
+                except UnsupportedEvent:
+                    unsupported = True
+
+    def fallback_convert(self, raw_event: RawEvent) -> EventData:
+        """convert event by icalendar (with all VTIMEZONE components)
+
+        Arguments:
+            raw_event -- event content lines
+
+        Returns:
+            dict - google calendar#event resource
+        """
+
+        text = "\r\n".join(
+            ["BEGIN:VCALENDAR"] + self.timezones + raw_event.lines + ["END:VCALENDAR"]
+        )
+        ics_event = Calendar.from_ical(text).walk(name="VEVENT")[0]
+        return EventConverter(ics_event).convert()  # type: ignore
+
+    @staticmethod
+    def fast_convert(raw_event: RawEvent) -> Optional[EventData]:
+        """convert event by fast parser
+
+        Arguments:
+            raw_event -- event content lines
+
+        Returns:
+            dict - google calendar#event resource, None if not supported
+        """
+
+        if not raw_event.props:
+            return None
+        try:
+            return FastEventConverter(raw_event.props).convert()
+        except (UnsupportedEvent, KeyError, ValueError, TypeError):
+            return None
+
+    def cache_key(self, raw_event: RawEvent) -> str:
+        """key of event in conversion cache: hash of event content
+        with referenced VTIMEZONE components
+
+        Arguments:
+            raw_event -- event content lines
+
+        Returns:
+            hex digest
+        """
+
+        text = "\r\n".join(raw_event.lines)
+        digest = hashlib.sha1(CACHE_VERSION.encode())
+        digest.update(text.encode("utf-8"))
+        # sorted: same key in each process (set order depends on hash seed)
+        tzids = {quoted or value for quoted, value in TZID_PARAM.findall(text)}
+        for tzid in sorted(tzids):
+            timezone = self.timezones_by_id.get(tzid)
+            if timezone is not None:
+                digest.update(timezone.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _iter_events(self) -> Iterator[EventData]:
+        fallback_count: int = 0
+        for raw_event in self.raw_events():
+            key: Optional[str] = None
+            if self.cache is not None:
+                key = self.cache_key(raw_event)
+                cached = self.cache.get(key)
+                if cached is not None:
+                    yield cached
+                    continue
+            event = FastCalendarConverter.fast_convert(raw_event) if self.fast else None
+            if event is None:
+                fallback_count += 1
+                event = self.fallback_convert(raw_event)
+            if self.cache is not None and key is not None:
+                self.cache.put(key, event)
+            yield event
+        if self.cache is not None:
+            self.cache.flush()
+        if fallback_count > 0:
+            self.logger.info("%d events converted by icalendar", fallback_count)
@@ -0,0 +1,140 @@
+import json
+import logging
+import os
+from typing import Any, Dict, IO, List, NamedTuple, Optional, Set, Tuple
+
+from .gcal import EventData, EventList, EventTuple
+
+
+class JournalPlan(NamedTuple):
+    """Remaining operations from journal"""
+
+    to_insert: EventList
+    to_update: List[EventTuple]
+    to_delete: EventList
+
+
+def journal_key(action: str, event: EventData) -> str:
+    """key of operation in journal
+
+    Arguments:
+        action -- action name: insert, update or delete
+        event -- event resource (new event for update)
+
+    Returns:
+        'iCalUID' for insert/update, 'id' for delete
+    """
+
+    if "delete" == action:
+        return str(event["id"])
+    return str(event["iCalUID"])
+
+
+class SyncJournal:
+    """on-disk journal of planned sync operations
+
+    first line of file is the plan, each next line marks one completed operation
+    """
+
+    logger = logging.getLogger("SyncJournal")
+
+    def __init__(self, filename: str):
+        self.filename: str = filename
+        self._file: Optional[IO[str]] = None
+
+    def exists(self) -> bool:
+        """journal file exists"""
+        return os.path.exists(self.filename)
+
+    def load(self) -> Optional[JournalPlan]:
+        """load remaining (not completed) operations
+
+        Returns:
+            JournalPlan or None if no journal
+        """
+
+        if not self.exists():
+            return None
+
+        plan: Optional[Dict[str, Any]] = None
+        done: Set[Tuple[str, str]] = set()
+        with open(self.filename, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # last line may be truncated by crash
+                    self.logger.warning("broken line in journal, skipped")
+                    continue
+                if "plan" in record:
+                    plan = record["plan"]
+                elif "done" in record:
+                    done.add((record["done"], record["key"]))
+
+        if plan is None:
+            return None
+
+        def pending(action: str, event: EventData) -> bool:
+            return (action, journal_key(action, event)) not in done
+
+        result = JournalPlan(
+            [e for e in plan["insert"] if pending("insert", e)],
+            [(new, old) for new, old in plan["update"] if pending("update", new)],
+            [e for e in plan["delete"] if pending("delete", e)],
+        )
+        self.logger.info(
+            "journal loaded, remaining: ( insert: %d, update: %d, delete: %d )",
+            len(result.to_insert),
+            len(result.to_update),
+            len(result.to_delete),
+        )
+        return result
+
+    def start(
+        self, to_insert: EventList, to_update: List[EventTuple], to_delete: EventList
+    ) -> None:
+        """write plan to journal and open it for marking
+
+        Arguments:
+            to_insert -- events to insert
+            to_update -- list of tuples: (new_event, exists_event)
+            to_delete -- events to delete
+        """
+
+        plan = {"insert": to_insert, "update": to_update, "delete": to_delete}
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, "w", encoding="utf-8") as f:
+            # compact events are converted to dict
+            f.write(json.dumps({"plan": plan}, default=dict) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, self.filename)
+        self._file = open(self.filename, "a", encoding="utf-8")
+
+    def mark_done(self, action: str, event: EventData) -> None:
+        """mark operation as completed
+
+        Arguments:
+            action -- action name: insert, update or delete
+            event -- event resource (new event for update)
+        """
+
+        if self._file is None:
+            return
+        record = {"done": action, "key": journal_key(action, event)}
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        """close journal, keep it to resume remaining operations"""
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def finish(self) -> None:
+        """close and remove journal, all operations are applied"""
+
+        self.close()
+        if self.exists():
+            os.remove(self.filename)
@@ -1,10 +1,40 @@
+import csv
+import datetime
 import logging.config
-from typing import Optional, Dict, Any, List
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List, Tuple, TypedDict, Callable
 
+import dateutil.parser
 import fire
 import yaml
+from pytz import utc
 
-from . import GoogleCalendar, GoogleCalendarService
+from . import GoogleCalendar, GoogleCalendarService, ACLRule, ACLScope, write_ics
+from .gcal import BATCH_SIZE, ServiceAccountRing, service_account_email
+
+
+class ManifestItem(TypedDict, total=False):
+    id: str
+    summary: str
+    timezone: str
+    public: bool
+    owners: List[str]
+    acl: List[ACLRule]
+    properties: Dict[str, str]
+
+
+BatchResults = Dict[int, Tuple[Any, Optional[Exception]]]
+
+# batches executed concurrently by bulk commands (size of http pool)
+BATCH_CONCURRENCY = 4
+
+# event fields converted to ics by export
+EXPORT_FIELDS: str = (
+    "id,iCalUID,start,end,summary,description,location,created,updated,"
+    "transparency,originalStartTime"
+)
 
 
 def load_config(filename: str) -> Optional[Dict[str, Any]]:
@@ -18,6 +48,264 @@ def load_config(filename: str) -> Optional[Dict[str, Any]]:
     return result
 
 
+def load_manifest_csv(filename: str) -> List[ManifestItem]:
+    """load calendars manifest from csv file
+
+    columns: id, summary, timezone, public, owners (separated by ';'),
+    acl (rules 'role:type:value' or 'role:type' separated by ';'),
+    property.<name> (calendarList property value)
+    """
+
+    result: List[ManifestItem] = []
+    with open(filename, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            item = ManifestItem()
+            for key in ("id", "summary", "timezone"):
+                if row.get(key):
+                    item[key] = row[key]  # type: ignore
+            if row.get("public"):
+                item["public"] = row["public"].strip().lower() in ("1", "true", "yes")
+            if row.get("owners"):
+                item["owners"] = [x.strip() for x in row["owners"].split(";")]
+            if row.get("acl"):
+                item["acl"] = []
+                for rule in row["acl"].split(";"):
+                    role, scope_type, *scope_value = rule.strip().split(":", 2)
+                    scope = ACLScope(type=scope_type)
+                    if scope_value and scope_value[0]:
+                        # no value for 'default' scope
+                        scope["value"] = scope_value[0]
+                    item["acl"].append(ACLRule(scope=scope, role=role))
+            properties = {
+                key[len("property.") :]: value
+                for key, value in row.items()
+                if key.startswith("property.") and value
+            }
+            if properties:
+                item["properties"] = properties
+            result.append(item)
+    return result
+
+
+def load_manifest(filename: str) -> List[ManifestItem]:
+    """load calendars manifest from yaml (list of items) or csv file"""
+
+    if filename.lower().endswith(".csv"):
+        return load_manifest_csv(filename)
+    with open(filename, "r", encoding="utf-8") as f:
+        items: List[ManifestItem] = yaml.safe_load(f) or []
+    return items
+
+
+def item_acl_rules(item: ManifestItem) -> List[ACLRule]:
+    """all ACL rules of manifest item: owners, acl and public"""
+
+    rules: List[ACLRule] = [
+        ACLRule(scope=ACLScope(type="user", value=email), role="owner")
+        for email in item.get("owners", [])
+    ]
+    rules.extend(item.get("acl", []))
+    if item.get("public", False):
+        rules.append(ACLRule(scope=ACLScope(type="default"), role="reader"))
+    return rules
+
+
+def execute_batches(
+    service: Any, requests: List[Tuple[int, Any]], concurrency: int = 1
+) -> BatchResults:
+    """execute requests with batches
+
+    Arguments:
+        service -- calendar service Resource
+        requests -- list of tuples: (item index, request)
+
+    Keyword Arguments:
+        concurrency -- number of batches executed concurrently,
+            service must use thread-safe http (HttpPool) if more than 1
+
+    Returns:
+        dict: item index -> (response, exception), last result for each item
+    """
+
+    results: BatchResults = {}
+    requests_by_id: List[int] = []
+    lock = threading.Lock()
+
+    def callback(
+        request_id: str, response: Any, exception: Optional[Exception]
+    ) -> None:
+        index = requests_by_id[int(request_id)]
+        with lock:
+            if index in results and results[index][1] is not None:
+                return  # keep first error of item
+            results[index] = (response, exception)
+
+    batches: List[Any] = []
+    for start in range(0, len(requests), BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=callback)
+        for index, request in requests[start : start + BATCH_SIZE]:
+            batch.add(request, request_id=str(len(requests_by_id)))
+            requests_by_id.append(index)
+        batches.append(batch)
+    if concurrency > 1 and len(batches) > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            # result of each batch, to raise its exception
+            for _ in executor.map(lambda batch: batch.execute(), batches):
+                pass
+    else:
+        for batch in batches:
+            batch.execute()
+    return results
+
+
+def print_report(
+    action: str, items: List[ManifestItem], errors: Dict[int, Exception]
+) -> None:
+    """print result for each item of manifest"""
+
+    for index, item in enumerate(items):
+        name = "{}: {}".format(item.get("summary", ""), item.get("id", ""))
+        if index in errors:
+            print("{} failed, {}: {}".format(action, name, errors[index]))
+        else:
+            print("{} ok, {}".format(action, name))
+    print("{}: {} ok, {} failed".format(action, len(items) - len(errors), len(errors)))
+
+
+class BulkCommands:
+    """manage many calendars from manifest file (yaml or csv)"""
+
+    def __init__(
+        self,
+        _service: Any,
+        _account_owner: Optional[Callable[[str], Optional[str]]] = None,
+        _concurrency: int = 1,
+    ) -> None:
+        self._service = _service
+        self._account_owner = _account_owner
+        self._concurrency = _concurrency
+
+    def _execute(
+        self, requests: List[Tuple[int, Any]], errors: Dict[int, Exception]
+    ) -> BatchResults:
+        """execute requests with concurrent batches, add failures to errors"""
+
+        results = execute_batches(self._service, requests, self._concurrency)
+        for index, (_, exception) in results.items():
+            if exception is not None:
+                errors[index] = exception
+        return results
+
+    @staticmethod
+    def _check_ids(items: List[ManifestItem], errors: Dict[int, Exception]) -> None:
+        """items without id are failed"""
+
+        for index, item in enumerate(items):
+            if "id" not in item:
+                errors[index] = ValueError("no calendar id")
+
+    def _update_items(
+        self, items: List[ManifestItem], errors: Dict[int, Exception]
+    ) -> None:
+        """set ACL rules and properties for items with id"""
+
+        requests: List[Tuple[int, Any]] = []
+        for index, item in enumerate(items):
+            if index in errors or "id" not in item:
+                continue
+            for rule in item_acl_rules(item):
+                requests.append(
+                    (
+                        index,
+                        self._service.acl().insert(calendarId=item["id"], body=rule),
+                    )
+                )
+            if "properties" in item:
+                requests.append(
+                    (
+                        index,
+                        self._service.calendarList().patch(
+                            calendarId=item["id"], body=item["properties"]
+                        ),
+                    )
+                )
+        self._execute(requests, errors)
+
+    def create(self, manifest: str) -> None:
+        """create calendars from manifest
+
+        Args:
+            manifest: manifest filename (.yml or .csv), items with keys:
+                summary, timezone, public, owners, acl, properties
+        """
+
+        items = load_manifest(manifest)
+        errors: Dict[int, Exception] = {}
+        requests: List[Tuple[int, Any]] = []
+        for index, item in enumerate(items):
+            calendar: Dict[str, str] = {"summary": item["summary"]}
+            if "timezone" in item:
+                calendar["timeZone"] = item["timezone"]
+            requests.append((index, self._service.calendars().insert(body=calendar)))
+        for index, (response, exception) in self._execute(requests, errors).items():
+            if exception is None:
+                items[index]["id"] = response["id"]
+                owner = (
+                    self._account_owner(response["id"])
+                    if self._account_owner is not None
+                    else None
+                )
+                if owner is not None:
+                    items[index]["owners"] = items[index].get("owners", []) + [owner]
+
+        self._update_items(items, errors)
+        print_report("create", items, errors)
+
+    def update(self, manifest: str) -> None:
+        """update calendars from manifest: rename, add ACL rules, set properties
+
+        Args:
+            manifest: manifest filename (.yml or .csv), items with keys:
+                id, summary, public, owners, acl, properties
+        """
+
+        items = load_manifest(manifest)
+        errors: Dict[int, Exception] = {}
+        BulkCommands._check_ids(items, errors)
+        requests: List[Tuple[int, Any]] = [
+            (
+                index,
+                self._service.calendars().patch(
+                    calendarId=item["id"], body={"summary": item["summary"]}
+                ),
+            )
+            for index, item in enumerate(items)
+            if "summary" in item and index not in errors
+        ]
+        self._execute(requests, errors)
+
+        self._update_items(items, errors)
+        print_report("update", items, errors)
+
+    def remove(self, manifest: str) -> None:
+        """remove calendars from manifest
+
+        Args:
+            manifest: manifest filename (.yml or .csv), items with key: id
+        """
+
+        items = load_manifest(manifest)
+        errors: Dict[int, Exception] = {}
+        BulkCommands._check_ids(items, errors)
+        requests: List[Tuple[int, Any]] = [
+            (index, self._service.calendars().delete(calendarId=item["id"]))
+            for index, item in enumerate(items)
+            if index not in errors
+        ]
+        self._execute(requests, errors)
+        print_report("remove", items, errors)
+
+
 class PropertyCommands:
     """get/set google calendar properties"""
 
@@ -67,8 +355,43 @@ class Commands:
         self._config: Optional[Dict[str, Any]] = load_config(config)
         if self._config is not None and "logging" in self._config:
             logging.config.dictConfig(self._config["logging"])
-        self._service = GoogleCalendarService.from_config(self._config)
+        # thread-safe pool of transports, for concurrent batches
+        service_config: Dict[str, Any] = dict(self._config or {})
+        service_config.setdefault("http_pool_size", BATCH_CONCURRENCY)
+        self._concurrency: int = service_config["http_pool_size"]
+        self._service = GoogleCalendarService.from_config(service_config)
+        self._ring: Optional[ServiceAccountRing] = ServiceAccountRing.from_config(
+            self._config
+        )
         self.property = PropertyCommands(self._service)
+        self.bulk = BulkCommands(self._service, self._account_owner, self._concurrency)
+
+    def _account_owner(self, calendar_id: str) -> Optional[str]:
+        """email of service account assigned to calendar,
+        None if it's account of this command (or no pool of accounts)"""
+
+        if self._config is None or self._ring is None:
+            return None
+        account = self._ring.account(calendar_id)
+        if account == self._config.get("service_account", self._ring.accounts[0]):
+            return None
+        return service_account_email(account)
+
+    def _calendar_ids(self) -> List[str]:
+        """ids of all calendars of account"""
+
+        calendar_ids: List[str] = []
+        page_token: Optional[str] = None
+        while True:
+            response = (
+                self._service.calendarList()
+                .list(fields="nextPageToken,items(id)", pageToken=page_token)
+                .execute()
+            )
+            calendar_ids.extend(item["id"] for item in response.get("items", []))
+            page_token = response.get("nextPageToken")
+            if page_token is None:
+                return calendar_ids
 
     def list(self, show_hidden: bool = False, show_deleted: bool = False) -> None:
         """list calendars
@@ -111,8 +434,40 @@ class Commands:
         calendar.create(summary, timezone)
         if public:
             calendar.make_public()
+        owner = self._account_owner(calendar.calendar_id)
+        if owner is not None:
+            calendar.add_owner(owner)
         print("{}: {}".format(summary, calendar.calendar_id))
 
+    def assign(self, calendar_id: Optional[str] = None) -> None:
+        """share calendars with service accounts assigned to them
+        (from service_accounts in config), run it after change of accounts
+
+        Args:
+            calendar_id: calendar id (default: all calendars of account)
+        """
+
+        if self._ring is None:
+            print("no service_accounts in config")
+            return
+        calendar_ids = [calendar_id] if calendar_id else self._calendar_ids()
+        requests: List[Tuple[int, Any]] = []
+        for index, item_id in enumerate(calendar_ids):
+            owner = self._account_owner(item_id)
+            if owner is not None:
+                rule = ACLRule(scope=ACLScope(type="user", value=owner), role="owner")
+                requests.append(
+                    (index, self._service.acl().insert(calendarId=item_id, body=rule))
+                )
+        results = execute_batches(self._service, requests, self._concurrency)
+        for index, item_id in enumerate(calendar_ids):
+            account = self._ring.account(item_id)
+            exception = results.get(index, (None, None))[1]
+            if exception is not None:
+                print("{}: {} failed, {}".format(item_id, account, exception))
+            else:
+                print("{}: {}".format(item_id, account))
+
     def add_owner(self, calendar_id: str, email: str) -> None:
         """add owner to calendar
 
@@ -145,6 +500,55 @@ class Commands:
         self._service.calendars().patch(body=calendar, calendarId=calendar_id).execute()
         print("{}: {}".format(summary, calendar_id))
 
+    def export(
+        self,
+        calendar_id: str,
+        filename: str,
+        start: str = "1970-01-01",
+        end: Optional[str] = None,
+        shards: int = 8,
+    ) -> None:
+        """export calendar events to ics file
+
+        Args:
+            calendar_id: calendar id
+            filename: ics filename
+            start: export events that ends after this date
+            end: export events that starts before this date (default: all events)
+            shards: number of time ranges listed concurrently
+        """
+        time_min = dateutil.parser.parse(start)
+        if time_min.tzinfo is None:
+            time_min = utc.localize(time_min)
+        time_max: Optional[datetime.datetime] = None
+        if end is not None:
+            time_max = dateutil.parser.parse(end)
+            if time_max.tzinfo is None:
+                time_max = utc.localize(time_max)
+
+        # open range: shards split time until now, last shard is open
+        shard_span = max(
+            (datetime.datetime.now(utc) - time_min) / max(1, shards),
+            datetime.timedelta(days=1),
+        )
+        calendar = GoogleCalendar(
+            self._service,
+            calendar_id,
+            list_shards=shards,
+            list_shard_span=shard_span,
+        )
+        started = time.monotonic()
+        with open(filename, "w", encoding="utf-8", newline="") as f:
+            count = write_ics(
+                calendar.iter_events(time_min, time_max, fields=EXPORT_FIELDS), f
+            )
+        elapsed = time.monotonic() - started
+        print(
+            "{} events exported to {} in {:.1f}s, {:.1f} events/s".format(
+                count, filename, elapsed, count / elapsed if elapsed > 0 else 0.0
+            )
+        )
+
 
 def main() -> None:
     fire.Fire(Commands, name="manage-ics2gcal")
@@ -0,0 +1,185 @@
+import logging
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# period of per-calendar budget, seconds
+BUDGET_PERIOD = 24 * 60 * 60
+
+
+class QuotaExceeded(Exception):
+    """quota budget of API units is exhausted"""
+
+
+class QuotaBudget:
+    """count API units (one per request, also in batch) used by sync run,
+    and limit them by budget per run and per calendar (for last day)
+
+    usage of each run is saved to history (SQLite), if history file set
+    """
+
+    logger = logging.getLogger("QuotaBudget")
+
+    def __init__(
+        self,
+        calendar_id: str,
+        run_budget: Optional[int] = None,
+        calendar_budget: Optional[int] = None,
+        history_file: Optional[str] = None,
+    ):
+        """
+
+        Arguments:
+            calendar_id -- calendar id, key of usage history
+
+        Keyword Arguments:
+            run_budget -- max units for one run (optional)
+            calendar_budget -- max units for calendar in last day,
+                with history of previous runs (optional)
+            history_file -- SQLite filename of usage history (optional)
+        """
+        self.calendar_id: str = calendar_id
+        self.run_budget: Optional[int] = run_budget
+        self.calendar_budget: Optional[int] = calendar_budget
+        self.history_file: Optional[str] = history_file
+        self.used: int = 0
+        self.used_before: int = 0
+        self.started: Optional[float] = None
+        if history_file is not None:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS usage (calendar_id TEXT, "
+                    "started REAL, finished REAL, units INTEGER, deferred INTEGER)"
+                )
+            finally:
+                conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(str(self.history_file), timeout=60, isolation_level=None)
+
+    def start(self) -> None:
+        """start counting of new run, load usage of calendar in last day"""
+
+        self.used = 0
+        self.used_before = 0
+        self.started = time.time()
+        if self.history_file is None:
+            return
+        conn = self._connect()
+        try:
+            (used,) = conn.execute(
+                "SELECT COALESCE(SUM(units), 0) FROM usage "
+                "WHERE calendar_id = ? AND finished > ?",
+                (self.calendar_id, self.started - BUDGET_PERIOD),
+            ).fetchone()
+        finally:
+            conn.close()
+        self.used_before = used
+
+    def remaining(self) -> Optional[int]:
+        """units available in this run
+
+        Returns:
+            number of units, None if no budget
+        """
+
+        limits: List[int] = []
+        if self.run_budget is not None:
+            limits.append(self.run_budget - self.used)
+        if self.calendar_budget is not None:
+            limits.append(self.calendar_budget - self.used_before - self.used)
+        if not limits:
+            return None
+        return max(0, min(limits))
+
+    def use(self, units: int) -> None:
+        """count used units
+
+        Arguments:
+            units -- number of requests
+        """
+
+        self.used += units
+
+    def finish(self, deferred: bool = False) -> None:
+        """end of run, save usage to history
+
+        Keyword Arguments:
+            deferred -- some operations are deferred to next run
+        """
+
+        self.logger.info(
+            "%d units used by %s%s",
+            self.used,
+            self.calendar_id,
+            ", operations deferred" if deferred else "",
+        )
+        if self.history_file is not None:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT INTO usage VALUES (?, ?, ?, ?, ?)",
+                    (
+                        self.calendar_id,
+                        self.started,
+                        time.time(),
+                        self.used,
+                        int(deferred),
+                    ),
+                )
+            finally:
+                conn.close()
+        self.started = None
+
+    def history(self) -> List[Tuple[float, float, int, bool]]:
+        """usage history of calendar
+
+        Returns:
+            list of tuples: (started, finished, units, deferred)
+        """
+
+        if self.history_file is None:
+            return []
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT started, finished, units, deferred FROM usage "
+                "WHERE calendar_id = ? ORDER BY finished",
+                (self.calendar_id,),
+            ).fetchall()
+        finally:
+            conn.close()
+        return [
+            (started, finished, units, bool(d)) for started, finished, units, d in rows
+        ]
+
+    @staticmethod
+    def from_config(
+        calendar_id: str, config: Optional[Dict[str, Any]]
+    ) -> Optional["QuotaBudget"]:
+        """make quota budget from config dict
+
+        Arguments:
+
+        **calendar_id** -- calendar id
+
+        **config** -- config with keys:
+
+        (optional) run_budget: - max API units (requests) for one run
+
+        (optional) calendar_budget: - max API units for calendar in last day
+
+        (optional) history_file: - SQLite filename to save usage of each run
+
+        -- **None**: no quota accounting
+        """
+
+        if config is None:
+            return None
+        return QuotaBudget(
+            calendar_id,
+            run_budget=config.get("run_budget"),
+            calendar_budget=config.get("calendar_budget"),
+            history_file=config.get("history_file"),
+        )
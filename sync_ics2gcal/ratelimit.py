@@ -0,0 +1,156 @@
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+
+class TokenBucket:
+    """token bucket rate limiter for API requests (in one process)
+
+    request of more tokens than bucket capacity is allowed when bucket is full,
+    the bucket goes into debt and next requests wait for it
+    """
+
+    logger = logging.getLogger("TokenBucket")
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+
+        Arguments:
+            rate -- tokens (requests) per second
+
+        Keyword Arguments:
+            capacity -- max tokens in bucket, burst size (default: rate)
+        """
+        self.rate: float = rate
+        self.capacity: float = capacity if capacity is not None else rate
+        self._lock = threading.Lock()
+        self._tokens: float = self.capacity
+        self._updated: float = time.monotonic()
+
+    def _take(self, tokens: float) -> float:
+        """take tokens from bucket if available
+
+        Arguments:
+            tokens -- number of tokens
+
+        Returns:
+            0 if tokens taken, else seconds to wait before next try
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens, wait = self._refill_take(
+                self._tokens, now - self._updated, tokens
+            )
+            self._updated = now
+        return wait
+
+    def _refill_take(
+        self, available: float, elapsed: float, tokens: float
+    ) -> Tuple[float, float]:
+        """refill bucket for elapsed time and take tokens
+
+        Returns:
+            (tokens in bucket, seconds to wait or 0 if tokens taken)
+        """
+
+        available = min(self.capacity, available + elapsed * self.rate)
+        need = min(tokens, self.capacity)
+        if available >= need:
+            return available - tokens, 0.0
+        return available, (need - available) / self.rate
+
+    def acquire(self, tokens: float = 1) -> None:
+        """wait until tokens are available and take them
+
+        Arguments:
+            tokens -- number of tokens (requests)
+        """
+
+        while True:
+            wait = self._take(tokens)
+            if wait <= 0:
+                return
+            self.logger.debug("rate limit, wait %.3f seconds", wait)
+            time.sleep(wait)
+
+    @staticmethod
+    def from_config(config: Optional[Dict[str, Any]]) -> Optional["TokenBucket"]:
+        """make rate limiter from config dict
+
+        Arguments:
+
+        **config** -- config with keys:
+
+        rate: - requests per second
+
+        (optional) capacity: - burst size
+
+        (optional) state_file: - SQLite filename, to share limit between processes
+
+        -- **None**: no rate limit
+        """
+
+        if config is None:
+            return None
+        rate: float = config["rate"]
+        capacity: Optional[float] = config.get("capacity")
+        state_file: Optional[str] = config.get("state_file")
+        if state_file is not None:
+            return SharedTokenBucket(state_file, rate, capacity)
+        return TokenBucket(rate, capacity)
+
+
+class SharedTokenBucket(TokenBucket):
+    """token bucket rate limiter shared by processes on one host, state in SQLite"""
+
+    def __init__(self, state_file: str, rate: float, capacity: Optional[float] = None):
+        """
+
+        Arguments:
+            state_file -- SQLite filename
+            rate -- tokens (requests) per second
+
+        Keyword Arguments:
+            capacity -- max tokens in bucket, burst size (default: rate)
+        """
+        super().__init__(rate, capacity)
+        self.state_file: str = state_file
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS bucket "
+                "(id INTEGER PRIMARY KEY, tokens REAL, updated REAL)"
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO bucket VALUES (0, ?, ?)",
+                (self.capacity, time.time()),
+            )
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.state_file, timeout=60, isolation_level=None)
+
+    def _take(self, tokens: float) -> float:
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                available, updated = conn.execute(
+                    "SELECT tokens, updated FROM bucket WHERE id = 0"
+                ).fetchone()
+                now = time.time()
+                available, wait = self._refill_take(
+                    available, max(0.0, now - updated), tokens
+                )
+                conn.execute(
+                    "UPDATE bucket SET tokens = ?, updated = ? WHERE id = 0",
+                    (available, now),
+                )
+                conn.execute("COMMIT")
+            finally:
+                conn.close()
+        return wait
@@ -0,0 +1,176 @@
+import json
+import logging
+import logging.handlers
+import queue
+from collections import Counter
+from typing import Any, Dict, IO, List, Optional
+
+
+class ResultSink:
+    """receiver of batch request results, one call per event"""
+
+    def success(self, action: str, key: str, value: Any) -> None:
+        """request for event is successful
+
+        Arguments:
+            action -- action name
+            key -- event key name (iCalUID or id)
+            value -- event key value
+        """
+
+    def failure(self, action: str, key: str, value: Any, exception: Exception) -> None:
+        """request for event is failed
+
+        Arguments:
+            action -- action name
+            key -- event key name (iCalUID or id)
+            value -- event key value
+            exception -- request exception
+        """
+
+    def flush(self) -> None:
+        """end of sync, write summary (if any)"""
+
+
+class LoggingResultSink(ResultSink):
+    """log each result"""
+
+    def __init__(self, logger: logging.Logger):
+        self.logger: logging.Logger = logger
+
+    def success(self, action: str, key: str, value: Any) -> None:
+        self.logger.info("event %s ok, %s: %s", action, key, value)
+
+    def failure(self, action: str, key: str, value: Any, exception: Exception) -> None:
+        self.logger.error(
+            "failed to %s event with %s: %s, exception: %s",
+            action,
+            key,
+            value,
+            str(exception),
+        )
+
+
+class SummaryResultSink(LoggingResultSink):
+    """log only failures, and counts of results on flush"""
+
+    def __init__(self, logger: logging.Logger):
+        super().__init__(logger)
+        self.ok: Counter[str] = Counter()
+        self.failed: Counter[str] = Counter()
+
+    def success(self, action: str, key: str, value: Any) -> None:
+        self.ok[action] += 1
+
+    def failure(self, action: str, key: str, value: Any, exception: Exception) -> None:
+        self.failed[action] += 1
+        super().failure(action, key, value, exception)
+
+    def flush(self) -> None:
+        for action in sorted(set(self.ok) | set(self.failed)):
+            self.logger.info(
+                "event %s: %d ok, %d failed",
+                action,
+                self.ok[action],
+                self.failed[action],
+            )
+        self.ok.clear()
+        self.failed.clear()
+
+
+class JsonlResultSink(ResultSink):
+    """write each result to file as json line"""
+
+    def __init__(self, filename: str):
+        self.file: IO[str] = open(filename, "a", encoding="utf-8")
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def success(self, action: str, key: str, value: Any) -> None:
+        self._write({"action": action, key: value, "ok": True})
+
+    def failure(self, action: str, key: str, value: Any, exception: Exception) -> None:
+        self._write(
+            {"action": action, key: value, "ok": False, "error": str(exception)}
+        )
+
+    def flush(self) -> None:
+        self.file.flush()
+
+
+class MultiResultSink(ResultSink):
+    """pass results to many sinks"""
+
+    def __init__(self, sinks: List[ResultSink]):
+        self.sinks: List[ResultSink] = sinks
+
+    def success(self, action: str, key: str, value: Any) -> None:
+        for sink in self.sinks:
+            sink.success(action, key, value)
+
+    def failure(self, action: str, key: str, value: Any, exception: Exception) -> None:
+        for sink in self.sinks:
+            sink.failure(action, key, value, exception)
+
+    def flush(self) -> None:
+        for sink in self.sinks:
+            sink.flush()
+
+
+def start_queue_logging() -> List[logging.handlers.QueueListener]:
+    """move handlers of all configured loggers to background threads,
+    loggers put records to queues and don't wait for handlers
+
+    Returns:
+        started listeners, stop them to flush queues
+    """
+
+    loggers: List[logging.Logger] = [logging.getLogger()]
+    for logger in logging.Logger.manager.loggerDict.values():
+        if isinstance(logger, logging.Logger):
+            loggers.append(logger)
+
+    listeners: List[logging.handlers.QueueListener] = []
+    for logger in loggers:
+        if not logger.handlers:
+            continue
+        records: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(
+            records, *logger.handlers, respect_handler_level=True
+        )
+        logger.handlers = [logging.handlers.QueueHandler(records)]
+        listener.start()
+        listeners.append(listener)
+    return listeners
+
+
+def make_result_sink(
+    config: Optional[Dict[str, Any]], logger: logging.Logger
+) -> ResultSink:
+    """make result sink from config dict
+
+    Arguments:
+
+    **config** -- config with keys:
+
+    (optional) mode: - 'each' (default) to log each result,
+    'summary' to log only failures and counts
+
+    (optional) jsonl: - filename to write each result as json line
+
+    -- **None**: log each result
+
+    **logger** -- logger for results
+    """
+
+    if config is None:
+        config = {}
+    sink: ResultSink
+    if "summary" == config.get("mode", "each"):
+        sink = SummaryResultSink(logger)
+    else:
+        sink = LoggingResultSink(logger)
+    if "jsonl" in config:
+        sink = MultiResultSink([sink, JsonlResultSink(config["jsonl"])])
+    return sink
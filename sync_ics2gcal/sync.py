@@ -1,7 +1,24 @@
 import datetime
+import json
 import logging
+import math
 import operator
-from typing import List, Dict, Set, Tuple, Union, Callable, NamedTuple
+import os
+import tempfile
+from typing import (
+    List,
+    Dict,
+    Set,
+    Tuple,
+    Union,
+    Callable,
+    NamedTuple,
+    Optional,
+    TypeVar,
+    Iterator,
+    Iterable,
+    IO,
+)
 
 import dateutil.parser
 from pytz import utc
@@ -14,8 +31,40 @@ from .gcal import (
     EventDataKey,
     EventDateOrDateTime,
     EventDate,
+    EventCallback,
+    event_fingerprint,
+    stored_fingerprint,
 )
-from .ical import CalendarConverter, DateDateTime
+from .ical import CalendarConverter, DateDateTime, SourceDelta
+from .journal import SyncJournal
+from .quota import QuotaExceeded
+
+_T = TypeVar("_T")
+
+# max open files of windows, while source is split to windows
+MAX_WINDOW_FILES = 16
+
+
+class InsertOperation(NamedTuple):
+    """Insert of source event"""
+
+    event: EventData
+
+
+class UpdateOperation(NamedTuple):
+    """Update of exists event by source event"""
+
+    event: EventData
+    exists_event: EventData
+
+
+class DeleteOperation(NamedTuple):
+    """Delete of exists event"""
+
+    event: EventData
+
+
+SyncOperation = Union[InsertOperation, UpdateOperation, DeleteOperation]
 
 
 class ComparedEvents(NamedTuple):
@@ -31,12 +80,54 @@ class CalendarSync:
 
     logger = logging.getLogger("CalendarSync")
 
-    def __init__(self, gcalendar: GoogleCalendar, converter: CalendarConverter):
+    def __init__(
+        self,
+        gcalendar: GoogleCalendar,
+        converter: CalendarConverter,
+        journal: Optional[SyncJournal] = None,
+        use_import: bool = False,
+        rebuild_method: Optional[str] = None,
+        rebuild_threshold: float = 1.0,
+        on_recreate: Optional[Callable[[str], None]] = None,
+    ):
+        """
+
+        Arguments:
+            gcalendar -- target calendar
+            converter -- source converter
+
+        Keyword Arguments:
+            journal -- journal of sync operations (optional)
+            use_import -- write new events by import (upsert by iCalUID),
+                without search of exists events
+            rebuild_method -- how to delete all events for rebuild of calendar:
+                'clear' (only primary calendar) or 'recreate' (calendar id is
+                changed), None - never rebuild
+            rebuild_threshold -- rebuild if incremental sync costs more requests
+                than rebuild multiplied by threshold
+            on_recreate -- called with new calendar id after recreate,
+                before events are inserted, to save it (optional)
+        """
+        if rebuild_method not in (None, "clear", "recreate"):
+            raise ValueError("unknown rebuild method: {}".format(rebuild_method))
         self.gcalendar: GoogleCalendar = gcalendar
         self.converter: CalendarConverter = converter
+        self.journal: Optional[SyncJournal] = journal
+        self.use_import: bool = use_import
+        self.rebuild_method: Optional[str] = rebuild_method
+        self.rebuild_threshold: float = rebuild_threshold
+        self.on_recreate: Optional[Callable[[str], None]] = on_recreate
+        self.rebuild: bool = False
         self.to_insert: EventList = []
         self.to_update: List[EventTuple] = []
         self.to_delete: EventList = []
+        self.full_sync: bool = True
+        self.deferred: int = 0
+        # UIDs of events, which operations are not applied (synced again)
+        self.not_applied: Set[str] = set()
+        self._applied: Set[str] = set()
+        # events ended before it are pruned, they are not synced again
+        self.retention_cutoff: Optional[datetime.datetime] = None
 
     @staticmethod
     def _events_list_compare(
@@ -77,18 +168,32 @@ class CalendarSync:
 
         return ComparedEvents(items_to_insert, items_to_update, items_to_delete)
 
-    def _filter_events_to_update(self) -> None:
-        """filter 'to_update' events by 'updated' datetime"""
+    @staticmethod
+    def _is_updated(new: EventData, old: EventData) -> bool:
+        """source event is changed since exists event is written:
+        by fingerprint of content (if saved), else by 'updated' datetime
 
-        def filter_updated(event_tuple: EventTuple) -> bool:
-            new, old = event_tuple
-            if "updated" not in new or "updated" not in old:
-                return True
-            new_date = dateutil.parser.parse(new["updated"])
-            old_date = dateutil.parser.parse(old["updated"])
-            return new_date > old_date
+        Arguments:
+            new -- source event
+            old -- exists event
+        """
 
-        self.to_update = list(filter(filter_updated, self.to_update))
+        fingerprint = stored_fingerprint(old)
+        if fingerprint is not None:
+            return fingerprint != event_fingerprint(new)
+        if "updated" not in new or "updated" not in old:
+            return True
+        new_date = dateutil.parser.parse(new["updated"])
+        old_date = dateutil.parser.parse(old["updated"])
+        return new_date > old_date
+
+    def _filter_events_to_update(self) -> None:
+        """filter 'to_update' events by fingerprint of content (if saved),
+        else by 'updated' datetime"""
+
+        self.to_update = [
+            (new, old) for new, old in self.to_update if self._is_updated(new, old)
+        ]
 
     @staticmethod
     def _filter_events_by_date(
@@ -147,45 +252,365 @@ class CalendarSync:
             date = date.replace(tzinfo=utc)
         return date
 
-    def prepare_sync(self, start_date: DateDateTime) -> None:
-        """prepare sync lists by comparison of events
+    def _iter_exists(
+        self, events: EventList
+    ) -> Iterator[Tuple[EventData, Optional[EventData]]]:
+        """find existing events by 'iCalUID', in chunks of batch size
 
         Arguments:
-            start_date -- date/datetime to start sync
+            events -- source events
+
+        Returns:
+            iterator of tuples: (event, exists_event or None if not found)
         """
 
-        start_date = CalendarSync._tz_aware_datetime(start_date)
+        size = self.gcalendar.batch_size
+        for i in range(0, len(events), size):
+            exists, not_found = self.gcalendar.find_exists(events[i : i + size])
+            yield from exists
+            for event in not_found:
+                yield event, None
+
+    def _iter_plan_full(
+        self,
+        start_date: datetime.datetime,
+        events_src: EventList,
+        time_max: Optional[datetime.datetime] = None,
+        skip: Optional[Callable[[EventData], bool]] = None,
+    ) -> Iterator[SyncOperation]:
+        """operations by comparison of all source and listed events,
+        updates and deletes are yielded after listing: writes change pages
+        of listing (as offsets of next pages), so they are not applied
+        while listing is paused
 
-        events_src = self.converter.events_to_gcal()
-        events_dst = self.gcalendar.list_events_from(start_date)
+        Arguments:
+            start_date -- datetime to start sync
+            events_src -- converted source events
+
+        Keyword Arguments:
+            time_max -- list events, that starts before time_max (optional)
+            skip -- filter of listed events, that are not compared (optional)
+        """
 
         # divide source events by start datetime
-        events_src_pending = CalendarSync._filter_events_by_date(
-            events_src, start_date, operator.ge
-        )
-        events_src_past = CalendarSync._filter_events_by_date(
-            events_src, start_date, operator.lt
+        events_src_pending: Dict[str, EventData] = {
+            event["iCalUID"]: event
+            for event in CalendarSync._filter_events_by_date(
+                events_src, start_date, operator.ge
+            )
+        }
+        events_src_past: Dict[str, EventData] = {
+            event["iCalUID"]: event
+            for event in CalendarSync._filter_events_by_date(
+                events_src, start_date, operator.lt
+            )
+        }
+
+        # listed events are small (compared fields only)
+        listed_operations: List[SyncOperation] = []
+        for page in self.gcalendar.iter_events(start_date, time_max):
+            for event_dst in page:
+                if skip is not None and skip(event_dst):
+                    continue
+                uid = event_dst["iCalUID"]
+                event_new = events_src_pending.pop(uid, None)
+                if event_new is None:
+                    # past events from source are updated (moved to past)
+                    event_new = events_src_past.get(uid)
+                if event_new is None:
+                    listed_operations.append(DeleteOperation(event_dst))
+                elif CalendarSync._is_updated(event_new, event_dst):
+                    listed_operations.append(UpdateOperation(event_new, event_dst))
+        yield from listed_operations
+        del listed_operations
+
+        events_new = list(events_src_pending.values())
+        if self.use_import or self.gcalendar.deterministic_ids:
+            # exists events are updated by import, or by id on insert conflict
+            for event in events_new:
+                yield InsertOperation(event)
+            return
+
+        # find if new events exists in gcalendar, for update them
+        for event, exists_event in self._iter_exists(events_new):
+            if exists_event is None:
+                yield InsertOperation(event)
+            elif CalendarSync._is_updated(event, exists_event):
+                yield UpdateOperation(event, exists_event)
+
+    def _iter_plan_delta(
+        self, start_date: datetime.datetime, delta: SourceDelta
+    ) -> Iterator[SyncOperation]:
+        """operations from source changes since last snapshot,
+        without listing of all events
+
+        Arguments:
+            start_date -- datetime to start sync
+            delta -- source changes
+        """
+
+        # removed from source, only pending events are deleted (as in full sync)
+        removed = CalendarSync._filter_events_by_date(
+            delta.removed, start_date, operator.ge
         )
+        if self.gcalendar.deterministic_ids:
+            yield from self._iter_plan_delta_by_ids(start_date, delta, removed)
+            return
+        for event, exists_event in self._iter_exists(removed):
+            if exists_event is not None and "cancelled" != exists_event.get("status"):
+                # ordered by start of removed event from snapshot
+                exists_event["start"] = event["start"]
+                yield DeleteOperation(exists_event)
+
+        # added and changed events are updated if exists, else inserted if pending
+        events_changed = delta.added + delta.changed
+        if self.use_import:
+            # pending events are imported (updated if exists), search only past
+            for event in CalendarSync._filter_events_by_date(
+                events_changed, start_date, operator.ge
+            ):
+                yield InsertOperation(event)
+            events_changed = CalendarSync._filter_events_by_date(
+                events_changed, start_date, operator.lt
+            )
+        for event, exists_event in self._iter_exists(events_changed):
+            if exists_event is not None:
+                if CalendarSync._is_updated(event, exists_event):
+                    yield UpdateOperation(event, exists_event)
+            elif not self.use_import and CalendarSync._filter_events_by_date(
+                [event], start_date, operator.ge
+            ):
+                yield InsertOperation(event)
+
+    def _iter_plan_delta_by_ids(
+        self, start_date: datetime.datetime, delta: SourceDelta, removed: EventList
+    ) -> Iterator[SyncOperation]:
+        """operations from source changes, with deterministic event ids:
+        without search of exists events
 
-        # first events comparison
-        (
-            self.to_insert,
-            self.to_update,
-            self.to_delete,
-        ) = CalendarSync._events_list_compare(events_src_pending, events_dst)
+        Arguments:
+            start_date -- datetime to start sync
+            delta -- source changes
+            removed -- pending removed events
+        """
 
-        # find in events 'to_delete' past events from source, for update (move to past)
-        _, add_to_update, self.to_delete = CalendarSync._events_list_compare(
-            events_src_past, self.to_delete
+        def with_id(event: EventData) -> EventData:
+            return EventData(
+                id=self.gcalendar.event_id(event), iCalUID=event["iCalUID"]
+            )
+
+        for event in removed:
+            # ordered by start of removed event from snapshot
+            yield DeleteOperation(
+                EventData(
+                    id=self.gcalendar.event_id(event),
+                    iCalUID=event["iCalUID"],
+                    start=event["start"],
+                )
+            )
+        # added pending events are inserted (updated if exists),
+        # changed and added past events are only updated
+        for event in CalendarSync._filter_events_by_date(
+            delta.added, start_date, operator.ge
+        ):
+            yield InsertOperation(event)
+        events_past = CalendarSync._filter_events_by_date(
+            delta.added, start_date, operator.lt
         )
-        self.to_update.extend(add_to_update)
+        for event in delta.changed + events_past:
+            yield UpdateOperation(event, with_id(event))
+
+    def iter_plan(
+        self, start_date: DateDateTime, full: bool = False
+    ) -> Iterator[SyncOperation]:
+        """sync operations, yielded as soon as they are determined
+        (apply them by apply_stream)
+
+        rebuild and prioritize are not used, they need the whole plan
+
+        Arguments:
+            start_date -- date/datetime to start sync
+
+        Keyword Arguments:
+            full -- compare with all listed events, even if source snapshot exists
+
+        Returns:
+            iterator of InsertOperation, UpdateOperation and DeleteOperation
+        """
+
+        start_date, events_src, delta = self._prepare_source(start_date, full)
+        if delta is None:
+            yield from self._iter_plan_full(start_date, events_src)
+        else:
+            del events_src
+            yield from self._iter_plan_delta(start_date, delta)
+
+    def _partition_source(
+        self, start_date: datetime.datetime, window: datetime.timedelta, directory: str
+    ) -> Tuple[List[int], Dict[str, int]]:
+        """convert source events and write them to files of time windows
+        (by event start), events before start_date are in first window
+
+        Arguments:
+            start_date -- start of first window
+            window -- length of window
+            directory -- directory for files of windows
+
+        Returns:
+            (sorted indexes of windows with events and first window,
+            UID -> index of window)
+        """
+
+        # least recently used files are closed, and appended when reopened
+        files: Dict[int, IO[str]] = {}
+        indexes: Set[int] = set()
+        windows: Dict[str, int] = {}
+        try:
+            for event in self.converter.iter_events():
+                if not self._is_retained(event):
+                    continue
+                index = max(
+                    0, math.floor((self._event_start(event) - start_date) / window)
+                )
+                f = files.pop(index, None)
+                if f is None:
+                    if len(files) >= MAX_WINDOW_FILES:
+                        files.pop(next(iter(files))).close()
+                    f = open(
+                        os.path.join(directory, "{}.jsonl".format(index)),
+                        "a",
+                        encoding="utf-8",
+                    )
+                    indexes.add(index)
+                files[index] = f
+                f.write(json.dumps(dict(event), ensure_ascii=False) + "\n")
+                windows[event["iCalUID"]] = index
+        finally:
+            for f in files.values():
+                f.close()
+        # source is read again on next run
+        self.converter.unload()
+        return sorted(indexes | {0}), windows
+
+    def iter_plan_windowed(
+        self, start_date: DateDateTime, window: datetime.timedelta
+    ) -> Iterator[SyncOperation]:
+        """sync operations of consecutive time windows (apply them by
+        apply_stream): source events of each window are compared with
+        events listed in window, only one window is held in memory
+
+        source events are split to windows by start in files
+        of temporary directory, it's always full sync, snapshot (if any) is reset
+
+        Arguments:
+            start_date -- date/datetime to start sync
+            window -- length of window
+
+        Returns:
+            iterator of InsertOperation, UpdateOperation and DeleteOperation
+        """
+
+        self._start_quota()
+        self.full_sync = True
+        # snapshot of source is not made, next sync with snapshot is full
+        self.converter.reset_snapshot()
+        start_date = self._sync_start(start_date)
+        with tempfile.TemporaryDirectory() as directory:
+            indexes, windows = self._partition_source(start_date, window, directory)
+            for i, index in enumerate(indexes):
+                time_min = start_date + window * index
+                time_max: Optional[datetime.datetime] = None
+                if i + 1 < len(indexes):
+                    # empty windows are joined with previous
+                    time_max = start_date + window * indexes[i + 1]
+
+                events_src: EventList = []
+                filename = os.path.join(directory, "{}.jsonl".format(index))
+                if os.path.exists(filename):
+                    with open(filename, "r", encoding="utf-8") as f:
+                        events_src = [json.loads(line) for line in f]
+                    os.remove(filename)
+                self.logger.info(
+                    "window from %s: %d source events", time_min, len(events_src)
+                )
+
+                def skip(
+                    event: EventData,
+                    index: int = index,
+                    time_min: datetime.datetime = time_min,
+                ) -> bool:
+                    # event is compared in window of its source event,
+                    # or in window of its start (listed also in previous windows)
+                    source_index = windows.get(event["iCalUID"])
+                    if source_index is not None:
+                        return source_index != index
+                    return index > 0 and self._event_start(event) < time_min
+
+                yield from self._iter_plan_full(time_min, events_src, time_max, skip)
+                # all operations of window are yielded, free its events
+                del events_src, skip
+
+    def _prepare_source(
+        self, start_date: DateDateTime, full: bool
+    ) -> Tuple[datetime.datetime, EventList, Optional[SourceDelta]]:
+        """convert source events and compare them with snapshot
+
+        Returns:
+            (tz aware start datetime, source events, delta or None for full sync)
+        """
+
+        self._start_quota()
+        # pruned events are dropped from snapshot once, not synced again
+        events_src = [
+            event
+            for event in self.converter.events_to_gcal()
+            if self._is_retained(event)
+        ]
+        delta = self.converter.events_delta(events_src, full)
+        self.full_sync = delta is None
+        return self._sync_start(start_date), events_src, delta
+
+    def _sync_start(self, start_date: DateDateTime) -> datetime.datetime:
+        """tz aware start of sync, not earlier than retention cutoff
+        (pruned events are not inserted again)"""
+
+        start_date = CalendarSync._tz_aware_datetime(start_date)
+        if self.retention_cutoff is not None:
+            start_date = max(start_date, self.retention_cutoff)
+        return start_date
 
-        # find if events 'to_insert' exists in gcalendar, for update them
-        add_to_update, self.to_insert = self.gcalendar.find_exists(self.to_insert)
-        self.to_update.extend(add_to_update)
+    def _is_retained(self, event: EventData) -> bool:
+        """event ends after retention cutoff (or there is no retention)"""
 
-        # exclude outdated events from 'to_update' list, by 'updated' field
-        self._filter_events_to_update()
+        if self.retention_cutoff is None or "end" not in event:
+            return True
+        return CalendarSync._event_end(event) > self.retention_cutoff
+
+    def prepare_sync(self, start_date: DateDateTime, full: bool = False) -> None:
+        """prepare sync lists by comparison of events
+
+        Arguments:
+            start_date -- date/datetime to start sync
+
+        Keyword Arguments:
+            full -- compare with all listed events, even if source snapshot exists
+        """
+
+        self.clear()
+        start_date, events_src, delta = self._prepare_source(start_date, full)
+        operations = (
+            self._iter_plan_full(start_date, events_src)
+            if delta is None
+            else self._iter_plan_delta(start_date, delta)
+        )
+        for operation in operations:
+            if isinstance(operation, InsertOperation):
+                self.to_insert.append(operation.event)
+            elif isinstance(operation, UpdateOperation):
+                self.to_update.append((operation.event, operation.exists_event))
+            else:
+                self.to_delete.append(operation.event)
+        self._choose_rebuild(events_src)
 
         self.logger.info(
             "prepared to sync: ( insert: %d, update: %d, delete: %d )",
@@ -194,19 +619,351 @@ class CalendarSync:
             len(self.to_delete),
         )
 
+    @staticmethod
+    def _event_start(event: EventData) -> datetime.datetime:
+        """start of event as tz aware datetime (utc midnight for all-day event)"""
+
+        event_start: EventDateOrDateTime = event["start"]
+        if "dateTime" in event_start:
+            value = event_start["dateTime"]  # type: ignore
+        else:
+            value = event_start["date"]  # type: ignore
+        return CalendarSync._tz_aware_datetime(dateutil.parser.parse(str(value)))
+
+    @staticmethod
+    def _event_end(event: EventData) -> datetime.datetime:
+        """end of event as tz aware datetime (utc midnight for all-day event)"""
+
+        event_end: EventDateOrDateTime = event["end"]
+        if "dateTime" in event_end:
+            value = event_end["dateTime"]  # type: ignore
+        else:
+            value = event_end["date"]  # type: ignore
+        return CalendarSync._tz_aware_datetime(dateutil.parser.parse(str(value)))
+
+    @staticmethod
+    def _event_urgency(event: EventData, now: datetime.datetime) -> float:
+        """seconds between event start and now
+
+        Returns:
+            seconds, infinity if event has no start (it's never deferred)
+        """
+
+        if "start" not in event:
+            return math.inf
+        start = CalendarSync._event_start(event)
+        return abs((start - now).total_seconds())
+
+    def prioritize(
+        self,
+        cutoff: Optional[datetime.timedelta] = None,
+        now: Optional[datetime.datetime] = None,
+    ) -> int:
+        """order prepared sync lists by event start relative to now,
+        nearest events first
+
+        Keyword Arguments:
+            cutoff -- only events starting in this time from now (before or after)
+                are kept, others are deferred to next run (optional)
+            now -- current datetime (default: now)
+
+        Returns:
+            number of deferred operations
+        """
+
+        if now is None:
+            now = datetime.datetime.now(utc)
+        now = CalendarSync._tz_aware_datetime(now)
+        max_urgency = cutoff.total_seconds() if cutoff is not None else math.inf
+
+        def urgent(items: List[_T], event: Callable[[_T], EventData]) -> List[_T]:
+            ranked = [(self._event_urgency(event(item), now), item) for item in items]
+            ranked.sort(key=operator.itemgetter(0))
+
+            def kept(urgency: float) -> bool:
+                # events with unknown start are not deferred
+                return urgency <= max_urgency or math.isinf(urgency)
+
+            # deferred events are prepared again on next run
+            self.not_applied.update(
+                event(item)["iCalUID"] for urgency, item in ranked if not kept(urgency)
+            )
+            return [item for urgency, item in ranked if kept(urgency)]
+
+        total = len(self.to_insert) + len(self.to_update) + len(self.to_delete)
+        self.to_insert = urgent(self.to_insert, lambda e: e)
+        self.to_update = urgent(self.to_update, operator.itemgetter(0))
+        self.to_delete = urgent(self.to_delete, lambda e: e)
+        self.deferred = (
+            total - len(self.to_insert) - len(self.to_update) - len(self.to_delete)
+        )
+        if self.deferred > 0:
+            self.logger.info(
+                "%d operations deferred, events start later than %s from now",
+                self.deferred,
+                cutoff,
+            )
+        return self.deferred
+
+    def _choose_rebuild(self, events_src: EventList) -> None:
+        """replace prepared sync lists with rebuild of calendar
+        (delete all events and insert all source events), if it is cheaper
+
+        Arguments:
+            events_src -- converted source events
+        """
+
+        if self.rebuild_method is None:
+            return
+        incremental_cost = (
+            len(self.to_insert) + len(self.to_update) + len(self.to_delete)
+        )
+        if "clear" == self.rebuild_method:
+            rebuild_cost = 1 + len(events_src)
+        else:
+            # get calendar, list ACL (twice), insert and delete calendar
+            rebuild_cost = 5 + len(events_src)
+        if incremental_cost <= rebuild_cost * self.rebuild_threshold:
+            return
+        self.logger.info(
+            "rebuild calendar (%s), requests: %d instead of %d",
+            self.rebuild_method,
+            rebuild_cost,
+            incremental_cost,
+        )
+        self.rebuild = True
+        self.to_insert = list(events_src)
+        self.to_update = []
+        self.to_delete = []
+
     def clear(self) -> None:
         """clear prepared sync lists (insert, update, delete)"""
         self.to_insert.clear()
         self.to_update.clear()
         self.to_delete.clear()
+        self.deferred = 0
+        self.rebuild = False
+        self.not_applied.clear()
+        self._applied.clear()
+
+    def _start_quota(self) -> None:
+        """start counting of API units for run (if not started)"""
 
-    def apply(self) -> None:
-        """apply sync (insert, update, delete), using prepared lists of events"""
+        quota = self.gcalendar.quota
+        if quota is not None and quota.started is None:
+            quota.start()
 
-        self.gcalendar.insert_events(self.to_insert)
-        self.gcalendar.update_events(self.to_update)
-        self.gcalendar.delete_events(self.to_delete)
+    def prune(
+        self, retention: datetime.timedelta, now: Optional[datetime.datetime] = None
+    ) -> int:
+        """delete events of calendar, that ended more than retention ago,
+        counted in quota budget of run
 
+        Arguments:
+            retention -- time to keep ended events
+
+        Keyword Arguments:
+            now -- current datetime (default: now)
+
+        Returns:
+            number of deleted events
+        """
+
+        self._start_quota()
+        if now is None:
+            now = datetime.datetime.now(utc)
+        # planning of runs starts at cutoff, pruned events are not synced again
+        self.retention_cutoff = CalendarSync._tz_aware_datetime(now) - retention
+        return self.gcalendar.prune_events(self.retention_cutoff)
+
+    def _on_success(self, action: str) -> EventCallback:
+        """callback to remember applied operation
+        and mark it in journal (if any)"""
+
+        def on_success(event: EventData) -> None:
+            self._applied.add(event["iCalUID"])
+            if self.journal is not None:
+                self.journal.mark_done(action, event)
+
+        return on_success
+
+    @staticmethod
+    def _operation_uids(
+        to_insert: EventList, to_update: List[EventTuple], to_delete: EventList
+    ) -> Set[str]:
+        """UIDs of events of operations"""
+
+        uids = {event["iCalUID"] for event in to_insert}
+        uids.update(new["iCalUID"] for new, _ in to_update)
+        uids.update(event["iCalUID"] for event in to_delete)
+        return uids
+
+    def resume(self) -> bool:
+        """load remaining sync lists from journal, left by interrupted apply
+
+        Returns:
+            True if there are operations to resume (no need to prepare sync)
+        """
+
+        if self.journal is None:
+            return False
+        plan = self.journal.load()
+        if plan is None:
+            return False
+        self.to_insert, self.to_update, self.to_delete = plan
+        self._start_quota()
+        self.logger.info("resumed from journal")
+        return True
+
+    def apply(self) -> bool:
+        """apply sync (insert, update, delete), using prepared lists of events
+
+        if quota budget is exhausted, remaining operations are deferred:
+        they are left in journal (if any) for resume, and source snapshot
+        is not saved, so next run prepares them again
+
+        events of failed operations and operations deferred by prioritize
+        are not saved in source snapshot, so next run prepares them again
+
+        Returns:
+            True if all operations are applied, False if deferred or failed
+        """
+
+        self._start_quota()
+        self._applied.clear()
+        if self.rebuild:
+            # before journal: if interrupted, next run prepares sync again
+            if "clear" == self.rebuild_method:
+                self.gcalendar.clear()
+            else:
+                self.gcalendar.recreate()
+                # old calendar is deleted, next runs must use new one
+                if self.on_recreate is not None:
+                    self.on_recreate(self.gcalendar.calendar_id)
+            # snapshot is not valid until all events are inserted
+            self.converter.reset_snapshot()
+        if self.journal is not None:
+            self.journal.start(self.to_insert, self.to_update, self.to_delete)
+
+        total = len(self.to_insert) + len(self.to_update) + len(self.to_delete)
+        planned = CalendarSync._operation_uids(
+            self.to_insert, self.to_update, self.to_delete
+        )
+        written = self.gcalendar.written
+        try:
+            if self.use_import:
+                self.gcalendar.import_events(self.to_insert, self._on_success("insert"))
+            else:
+                self.gcalendar.insert_events(self.to_insert, self._on_success("insert"))
+            self.gcalendar.update_events(self.to_update, self._on_success("update"))
+            self.gcalendar.delete_events(self.to_delete, self._on_success("delete"))
+        except QuotaExceeded as e:
+            # inserts with conflict are also written as updates
+            deferred = max(0, total - (self.gcalendar.written - written))
+            self.logger.warning(
+                "%s, remaining %d operations deferred to next run", e, deferred
+            )
+            if self.journal is not None:
+                self.journal.close()
+            self.gcalendar.result_sink.flush()
+            if self.gcalendar.quota is not None:
+                self.gcalendar.quota.finish(deferred=True)
+            self.clear()
+            return False
+
+        if self.journal is not None:
+            self.journal.finish()
+        self.gcalendar.result_sink.flush()
+        deferred = self.deferred > 0
+        if self.gcalendar.quota is not None:
+            self.gcalendar.quota.finish(deferred)
+        # failed and deferred operations are prepared again on next run,
+        # snapshot is saved to count run for reconcile_every
+        self.not_applied.update(planned - self._applied)
+        applied = not self.not_applied
+        self.converter.commit_snapshot(self.full_sync, self.not_applied)
         self.clear()
 
         self.logger.info("sync done")
+        return applied
+
+    def _apply_batch(
+        self,
+        to_insert: EventList,
+        to_update: List[EventTuple],
+        to_delete: EventList,
+        planned: Set[str],
+    ) -> None:
+        """apply operations and clear lists
+
+        Arguments:
+            planned -- UIDs of sent operations, updated
+        """
+
+        planned.update(CalendarSync._operation_uids(to_insert, to_update, to_delete))
+        if to_insert:
+            if self.use_import:
+                self.gcalendar.import_events(to_insert, self._on_success("insert"))
+            else:
+                self.gcalendar.insert_events(to_insert, self._on_success("insert"))
+            to_insert.clear()
+        if to_update:
+            self.gcalendar.update_events(to_update, self._on_success("update"))
+            to_update.clear()
+        if to_delete:
+            self.gcalendar.delete_events(to_delete, self._on_success("delete"))
+            to_delete.clear()
+
+    def apply_stream(self, operations: Iterable[SyncOperation]) -> bool:
+        """apply operations from stream (of iter_plan): each action is sent
+        by batch as soon as batch is full, only batches are kept in memory
+
+        journal is not used, remaining operations of interrupted stream
+        are prepared again on next run (snapshot is saved after all operations,
+        without events of failed operations: UIDs of sent operations are kept)
+
+        Arguments:
+            operations -- stream of operations
+
+        Returns:
+            True if all operations are applied, False if deferred by quota
+            or failed
+        """
+
+        self._start_quota()
+        self._applied.clear()
+        size = self.gcalendar.batch_size
+        to_insert: EventList = []
+        to_update: List[EventTuple] = []
+        to_delete: EventList = []
+        planned: Set[str] = set()
+        try:
+            for operation in operations:
+                if isinstance(operation, InsertOperation):
+                    to_insert.append(operation.event)
+                    if len(to_insert) >= size:
+                        self._apply_batch(to_insert, [], [], planned)
+                elif isinstance(operation, UpdateOperation):
+                    to_update.append((operation.event, operation.exists_event))
+                    if len(to_update) >= size:
+                        self._apply_batch([], to_update, [], planned)
+                else:
+                    to_delete.append(operation.event)
+                    if len(to_delete) >= size:
+                        self._apply_batch([], [], to_delete, planned)
+            self._apply_batch(to_insert, to_update, to_delete, planned)
+        except QuotaExceeded as e:
+            self.logger.warning("%s, remaining operations deferred to next run", e)
+            self.gcalendar.result_sink.flush()
+            if self.gcalendar.quota is not None:
+                self.gcalendar.quota.finish(deferred=True)
+            return False
+
+        self.gcalendar.result_sink.flush()
+        if self.gcalendar.quota is not None:
+            self.gcalendar.quota.finish()
+        failed = planned - self._applied
+        self._applied.clear()
+        self.converter.commit_snapshot(self.full_sync, failed)
+        self.logger.info("sync done")
+        return not failed
@@ -1,12 +1,39 @@
-from typing import Dict, Any, Union
+from typing import Dict, Any, List, Union, Optional, Tuple
 
 import yaml
 
+import atexit
 import dateutil.parser
 import datetime
+import functools
+import hashlib
 import logging
 import logging.config
-from . import CalendarConverter, GoogleCalendarService, GoogleCalendar, CalendarSync
+import math
+import os
+import socket
+import threading
+import time
+from . import (
+    CalendarConverter,
+    GoogleCalendarService,
+    GoogleCalendar,
+    CalendarSync,
+    SyncJournal,
+    SourceSnapshot,
+    TokenBucket,
+    QuotaBudget,
+    FastCalendarConverter,
+    MergedCalendarConverter,
+    MergeSource,
+    make_result_sink,
+    ConversionCache,
+    RunDeadline,
+    DeadlineExceeded,
+    make_job_queue,
+    start_queue_logging,
+)
+from .gcal import BATCH_SIZE
 
 ConfigDate = Union[str, datetime.datetime]
 
@@ -27,26 +54,390 @@ def get_start_date(date: ConfigDate) -> datetime.datetime:
     return result
 
 
+def source_configs(calendar_config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """list of sources of calendar, each source is a dict with 'file' key"""
+
+    source = calendar_config["source"]
+    if not isinstance(source, list):
+        source = [source]
+    return [item if isinstance(item, dict) else {"file": item} for item in source]
+
+
+def make_converter(
+    calendar_config: Dict[str, Any], stream: bool = False
+) -> CalendarConverter:
+    """make converter of calendar sources
+
+    Args:
+        calendar_config: calendar config dict
+        stream: read events from file one at a time (for windowed sync),
+            instead of loading whole file (not for many sources)
+    """
+
+    snapshot: Optional[SourceSnapshot] = None
+    snapshot_filepath: Optional[str] = calendar_config.get("snapshot")
+    if snapshot_filepath is not None:
+        reconcile_every: int = calendar_config.get("reconcile_every", 0)
+        snapshot = SourceSnapshot(snapshot_filepath, reconcile_every)
+
+    compact: bool = calendar_config.get("compact", False)
+    fast_parser: bool = calendar_config.get("fast_parser", False)
+    cache_config: Optional[Dict[str, Any]] = calendar_config.get("cache")
+    if isinstance(calendar_config.get("source"), list):
+        sources: List[MergeSource] = []
+        for item in source_configs(calendar_config):
+            # each source is converted in own thread, with own cache connection
+            converter: CalendarConverter = (
+                FastCalendarConverter(cache=ConversionCache.from_config(cache_config))
+                if item.get("fast_parser", fast_parser)
+                else CalendarConverter()
+            )
+            sources.append(MergeSource(converter, item["file"], item.get("uid_prefix")))
+        return MergedCalendarConverter(
+            sources,
+            conflict=calendar_config.get("conflict", "first"),
+            snapshot=snapshot,
+            compact=compact,
+        )
+    if fast_parser or stream:
+        # without fast_parser each event is converted by icalendar
+        return FastCalendarConverter(
+            cache=ConversionCache.from_config(cache_config) if fast_parser else None,
+            fast=fast_parser,
+            stream=stream,
+            snapshot=snapshot,
+            compact=compact,
+        )
+    return CalendarConverter(snapshot=snapshot, compact=compact)
+
+
+def load_calendar_id(calendar_config: Dict[str, Any]) -> str:
+    """calendar id from id_file (if exists, written on recreate of calendar),
+    else google_id
+    """
+
+    id_filepath: Optional[str] = calendar_config.get("id_file")
+    if id_filepath is not None and os.path.exists(id_filepath):
+        with open(id_filepath, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    return str(calendar_config["google_id"])
+
+
+def save_calendar_id(calendar_config: Dict[str, Any], calendar_id: str) -> None:
+    """save calendar id to id_file (if set in config)"""
+
+    id_filepath: Optional[str] = calendar_config.get("id_file")
+    if id_filepath is not None:
+        with open(id_filepath, "w", encoding="utf-8") as f:
+            f.write(calendar_id)
+
+
+def journal_filepath(config: Dict[str, Any]) -> Optional[str]:
+    """journal filename from calendar config, with quota budget journal is
+    always used (default name by google_id): operations deferred by quota
+    are resumed, else each run would spend budget to prepare them again
+    """
+
+    filepath: Optional[str] = config["calendar"].get("journal")
+    if filepath is None and config.get("quota") is not None:
+        google_id = str(config["calendar"]["google_id"])
+        digest = hashlib.sha1(google_id.encode("utf-8")).hexdigest()
+        filepath = "ics2gcal-{}.journal".format(digest[:12])
+    return filepath
+
+
+def make_sync(config: Dict[str, Any]) -> CalendarSync:
+    calendar_id: str = load_calendar_id(config["calendar"])
+    journal_file: Optional[str] = journal_filepath(config)
+
+    converter = make_converter(config["calendar"], stream="window_days" in config)
+
+    deadline = RunDeadline.from_config(config.get("deadline"))
+    # configured id is kept after recreate of calendar, account is not changed
+    service = GoogleCalendarService.from_config(
+        config, deadline, config["calendar"]["google_id"]
+    )
+    rate_limiter = TokenBucket.from_config(config.get("rate_limit"))
+    gcalendar = GoogleCalendar(
+        service,
+        calendar_id,
+        rate_limiter=rate_limiter,
+        batch_size=config.get("batch_size", BATCH_SIZE),
+        list_shards=config.get("list_shards", 1),
+        list_shard_span=datetime.timedelta(days=config.get("list_shard_days", 30)),
+        result_sink=make_result_sink(
+            config.get("logging", {}).get("results"), GoogleCalendar.logger
+        ),
+        quota=QuotaBudget.from_config(calendar_id, config.get("quota")),
+        deterministic_ids=config["calendar"].get("deterministic_ids", False),
+        fingerprints=config["calendar"].get("fingerprints", False),
+        deadline=deadline,
+    )
+
+    journal: Optional[SyncJournal] = None
+    if journal_file is not None:
+        journal = SyncJournal(journal_file)
+
+    rebuild_config: Dict[str, Any] = config.get("rebuild") or {}
+    return CalendarSync(
+        gcalendar,
+        converter,
+        journal,
+        use_import=config["calendar"].get("use_import", False),
+        rebuild_method=rebuild_config.get("method"),
+        rebuild_threshold=rebuild_config.get("threshold", 1.0),
+        on_recreate=functools.partial(save_calendar_id, config["calendar"]),
+    )
+
+
+def _finish_quota(sync: CalendarSync) -> None:
+    """save usage of run, that failed before end of apply (if started)"""
+
+    quota = sync.gcalendar.quota
+    if quota is not None and quota.started is not None:
+        quota.finish(deferred=True)
+
+
+def run_sync(sync: CalendarSync, config: Dict[str, Any], full: bool = False) -> None:
+    try:
+        start = get_start_date(config["start_from"])
+        if not isinstance(sync.converter, MergedCalendarConverter):
+            sync.converter.load(config["calendar"]["source"])
+        # else: sources are loaded concurrently on conversion
+        retention_config: Optional[Dict[str, Any]] = config.get("retention")
+        if retention_config is not None:
+            sync.prune(datetime.timedelta(days=retention_config["days"]))
+        if "window_days" in config:
+            window = datetime.timedelta(days=config["window_days"])
+            sync.apply_stream(sync.iter_plan_windowed(start, window))
+            return
+        if config.get("stream", False):
+            sync.apply_stream(sync.iter_plan(start, full))
+            return
+        try:
+            sync.prepare_sync(start, full)
+        except DeadlineExceeded as e:
+            # as deadline in apply: all operations are deferred
+            sync.logger.warning("%s, sync deferred to next run", e)
+            sync.clear()
+            return
+        priority_config: Optional[Dict[str, Any]] = config.get("priority")
+        if priority_config is not None:
+            cutoff: Optional[datetime.timedelta] = None
+            if "cutoff_hours" in priority_config and not sync.full_sync:
+                # only delta runs are fast, full syncs send all operations
+                cutoff = datetime.timedelta(hours=priority_config["cutoff_hours"])
+            sync.prioritize(cutoff)
+        sync.apply()
+    finally:
+        # usage of failed planning (or apply) is saved too
+        _finish_quota(sync)
+
+
+class SourceWatcher:
+    """watch source file for changes, by polling of mtime and content hash"""
+
+    def __init__(self, filename: str, debounce: float):
+        """
+
+        Args:
+            filename: source filename
+            debounce: seconds without writes, before file is considered changed
+        """
+        self.filename: str = filename
+        self.debounce: float = debounce
+        self._stat: Optional[Tuple[int, int]] = None
+        self._digest: Optional[str] = None
+
+    def _file_stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def changed(self) -> bool:
+        """check that source content is changed since last call"""
+
+        stat = self._file_stat()
+        if stat is None or stat == self._stat:
+            return False
+        # wait for burst of writes
+        while True:
+            time.sleep(self.debounce)
+            new_stat = self._file_stat()
+            if new_stat == stat:
+                break
+            stat = new_stat
+        self._stat = stat
+
+        with open(self.filename, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        if digest == self._digest:
+            return False
+        self._digest = digest
+        return True
+
+    def reset(self) -> None:
+        """forget last state, next call of changed() returns True"""
+        self._stat = None
+        self._digest = None
+
+
+def watch(sync: CalendarSync, config: Dict[str, Any], synced: bool = True) -> None:
+    """resync on source changes and full sync every reconcile_interval seconds
+
+    Args:
+        sync: calendar sync
+        config: config dict
+        synced: current source is already synced
+    """
+
+    logger = logging.getLogger("watch")
+    watch_config: Dict[str, Any] = config["watch"] or {}
+    interval: float = watch_config.get("interval", 10)
+    reconcile_interval: float = watch_config.get("reconcile_interval", 3600)
+
+    sources = [
+        SourceWatcher(item["file"], watch_config.get("debounce", 2))
+        for item in source_configs(config["calendar"])
+    ]
+    if synced:
+        for source in sources:
+            source.changed()
+    last_full = time.monotonic()
+    logger.info("watching %s", ", ".join(source.filename for source in sources))
+    while True:
+        time.sleep(interval)
+        full = 0 < reconcile_interval <= time.monotonic() - last_full
+        # check all sources, to remember their current state
+        changed = [source.changed() for source in sources]
+        if not any(changed) and not full:
+            continue
+        if sync.gcalendar.deadline is not None:
+            sync.gcalendar.deadline.start()
+        resumed = False
+        try:
+            resumed = sync.resume()
+            if resumed:
+                sync.apply()
+            else:
+                run_sync(sync, config, full)
+        except Exception:
+            logger.exception("sync failed")
+            _finish_quota(sync)
+            sync.clear()
+            for source in sources:
+                source.reset()
+            continue
+        if resumed:
+            # deferred operations are applied first, changes by next check
+            for source in sources:
+                source.reset()
+            continue
+        if full:
+            last_full = time.monotonic()
+
+
+def sync_once(sync: CalendarSync, config: Dict[str, Any]) -> bool:
+    """resume interrupted sync (if any) or run sync
+
+    Returns:
+        True if sync was resumed
+    """
+
+    resumed = sync.resume()
+    if resumed:
+        try:
+            sync.apply()
+        finally:
+            _finish_quota(sync)
+    else:
+        run_sync(sync, config)
+    return resumed
+
+
+def run_worker(config: Dict[str, Any]) -> None:
+    """sync calendars from config 'calendars' list, by jobs from shared queue
+
+    Args:
+        config: config dict
+    """
+
+    logger = logging.getLogger("worker")
+    worker_config: Dict[str, Any] = config["worker"]
+    queue = make_job_queue(worker_config)
+    worker_id: str = worker_config.get(
+        "id", "{}-{}".format(socket.gethostname(), os.getpid())
+    )
+    interval: float = worker_config.get("interval", 900)
+    retry_interval: float = worker_config.get("retry_interval", 60)
+    heartbeat: float = worker_config.get("heartbeat", 60)
+    poll: float = worker_config.get("poll", 5)
+
+    for calendar_config in config.get("calendars", []):
+        # id_file is stable key, calendar id is changed by rebuild
+        key: str = calendar_config.get("id_file") or calendar_config["google_id"]
+        queue.add(key, calendar_config)
+
+    while True:
+        job = queue.acquire(worker_id)
+        if job is None:
+            if worker_config.get("exit_when_idle", False):
+                return
+            time.sleep(poll)
+            continue
+
+        stop = threading.Event()
+        thread: Optional[threading.Thread] = None
+        error: Optional[str] = None
+        try:
+            job_config = dict(config, calendar=job.config)
+            sync = make_sync(job_config)
+            # lost lease stops sync before next request, other worker has job
+            deadline = sync.gcalendar.deadline
+            if deadline is None:
+                deadline = RunDeadline(math.inf, reserve=0)
+                sync.gcalendar.deadline = deadline
+            thread = queue.keep_lease(
+                job,
+                heartbeat,
+                stop,
+                functools.partial(
+                    deadline.cancel, "lease of {} is lost".format(job.calendar)
+                ),
+            )
+            sync_once(sync, job_config)
+        except Exception as e:
+            logger.exception("sync of %s failed", job.calendar)
+            error = str(e)
+        finally:
+            stop.set()
+            if thread is not None:
+                thread.join()
+        queue.release(
+            job, time.time() + (interval if error is None else retry_interval), error
+        )
+
+
 def main() -> None:
     config = load_config()
 
     if "logging" in config:
         logging.config.dictConfig(config["logging"])
+        if config["logging"].get("results", {}).get("queue", False):
+            for listener in start_queue_logging():
+                atexit.register(listener.stop)
 
-    calendar_id: str = config["calendar"]["google_id"]
-    ics_filepath: str = config["calendar"]["source"]
-
-    start = get_start_date(config["start_from"])
-
-    converter = CalendarConverter()
-    converter.load(ics_filepath)
+    if "worker" in config:
+        run_worker(config)
+        return
 
-    service = GoogleCalendarService.from_config(config)
-    gcalendar = GoogleCalendar(service, calendar_id)
+    sync = make_sync(config)
+    resumed = sync_once(sync, config)
 
-    sync = CalendarSync(gcalendar, converter)
-    sync.prepare_sync(start)
-    sync.apply()
+    if "watch" in config:
+        watch(sync, config, synced=not resumed)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,312 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+
+class SyncJob(NamedTuple):
+    """Sync job of one calendar, leased by worker"""
+
+    calendar: str
+    config: Dict[str, Any]
+    worker: str
+    lease_expires: float
+
+
+class SyncJobQueue:
+    """queue of per-calendar sync jobs shared by workers, in SQLite table
+
+    worker takes due job with time-limited lease and extends it by heartbeats,
+    job with active lease is not taken by other workers, so each calendar
+    is synced by at most one worker at a time
+
+    workers must run on one host: SQLite locking is not reliable
+    on network filesystems (use PostgresJobQueue for workers on many hosts)
+    """
+
+    logger = logging.getLogger("SyncJobQueue")
+
+    def __init__(self, filename: str, lease_seconds: float = 300):
+        """
+
+        Arguments:
+            filename -- SQLite filename
+
+        Keyword Arguments:
+            lease_seconds -- lease time, job is taken by other worker
+                if lease is not extended
+        """
+        self.filename: str = filename
+        self.lease_seconds: float = lease_seconds
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (calendar TEXT PRIMARY KEY, "
+                "config TEXT, due REAL, worker TEXT, lease_expires REAL, "
+                "last_error TEXT)"
+            )
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.filename, timeout=60, isolation_level=None)
+
+    def add(
+        self, calendar: str, config: Dict[str, Any], due: Optional[float] = None
+    ) -> None:
+        """add job or update config of exists job (due time is kept)
+
+        Arguments:
+            calendar -- calendar id
+            config -- calendar config
+
+        Keyword Arguments:
+            due -- time to sync (default: now)
+        """
+
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO jobs (calendar, config, due) VALUES (?, ?, ?) "
+                "ON CONFLICT (calendar) DO UPDATE SET config = excluded.config",
+                (calendar, json.dumps(config), due if due is not None else time.time()),
+            )
+        finally:
+            conn.close()
+
+    def acquire(self, worker: str) -> Optional[SyncJob]:
+        """take due job without active lease
+
+        Arguments:
+            worker -- worker id
+
+        Returns:
+            SyncJob or None if no due jobs
+        """
+
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = conn.execute(
+                "SELECT calendar, config FROM jobs WHERE due <= ? "
+                "AND (lease_expires IS NULL OR lease_expires < ?) "
+                "ORDER BY due LIMIT 1",
+                (now, now),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            calendar, config = row
+            lease_expires = now + self.lease_seconds
+            conn.execute(
+                "UPDATE jobs SET worker = ?, lease_expires = ? WHERE calendar = ?",
+                (worker, lease_expires, calendar),
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        self.logger.info("%s taken by %s", calendar, worker)
+        return SyncJob(calendar, json.loads(config), worker, lease_expires)
+
+    def heartbeat(self, job: SyncJob) -> bool:
+        """extend lease of job, also expired lease not taken by other worker
+
+        Arguments:
+            job -- taken job
+
+        Returns:
+            True if lease is extended, False if lease is lost
+        """
+
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE calendar = ? AND worker = ?",
+                (time.time() + self.lease_seconds, job.calendar, job.worker),
+            )
+            return cursor.rowcount > 0
+        finally:
+            conn.close()
+
+    def release(
+        self, job: SyncJob, next_due: float, error: Optional[str] = None
+    ) -> None:
+        """release lease of job and schedule next sync
+
+        Arguments:
+            job -- taken job
+            next_due -- time of next sync
+
+        Keyword Arguments:
+            error -- error of sync (optional)
+        """
+
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE jobs SET due = ?, worker = NULL, lease_expires = NULL, "
+                "last_error = ? WHERE calendar = ? AND worker = ?",
+                (next_due, error, job.calendar, job.worker),
+            )
+        finally:
+            conn.close()
+
+    def keep_lease(
+        self,
+        job: SyncJob,
+        interval: float,
+        stop: threading.Event,
+        on_lost: Optional[Callable[[], None]] = None,
+    ) -> threading.Thread:
+        """start thread with heartbeats of job, until stop is set
+
+        Arguments:
+            job -- taken job
+            interval -- seconds between heartbeats
+            stop -- event to stop heartbeats
+
+        Keyword Arguments:
+            on_lost -- called when lease is lost, to stop the job (optional)
+
+        Returns:
+            started thread
+        """
+
+        def heartbeats() -> None:
+            while not stop.wait(interval):
+                if not self.heartbeat(job):
+                    self.logger.warning("lease of %s is lost", job.calendar)
+                    if on_lost is not None:
+                        on_lost()
+                    return
+
+        thread = threading.Thread(target=heartbeats, daemon=True)
+        thread.start()
+        return thread
+
+
+class PostgresJobQueue(SyncJobQueue):
+    """queue of per-calendar sync jobs in PostgreSQL table, shared by workers
+    on many hosts: due job is taken with row lock (FOR UPDATE SKIP LOCKED),
+    leases are counted by clock of database server
+
+    needs psycopg (version 3) package
+    """
+
+    logger = logging.getLogger("PostgresJobQueue")
+
+    def __init__(self, url: str, lease_seconds: float = 300):
+        """
+
+        Arguments:
+            url -- PostgreSQL connection string (postgresql://...)
+
+        Keyword Arguments:
+            lease_seconds -- lease time, job is taken by other worker
+                if lease is not extended
+        """
+        try:
+            import psycopg
+        except ImportError as e:
+            raise ImportError("PostgresJobQueue requires psycopg package") from e
+
+        self._psycopg: Any = psycopg
+        self.url: str = url
+        self.lease_seconds: float = lease_seconds
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (calendar TEXT PRIMARY KEY, "
+                "config TEXT, due DOUBLE PRECISION, worker TEXT, "
+                "lease_expires DOUBLE PRECISION, last_error TEXT)"
+            )
+        finally:
+            conn.close()
+
+    def _connect(self) -> Any:
+        return self._psycopg.connect(self.url, autocommit=True)
+
+    def add(
+        self, calendar: str, config: Dict[str, Any], due: Optional[float] = None
+    ) -> None:
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO jobs (calendar, config, due) VALUES (%s, %s, %s) "
+                "ON CONFLICT (calendar) DO UPDATE SET config = excluded.config",
+                (calendar, json.dumps(config), due if due is not None else time.time()),
+            )
+        finally:
+            conn.close()
+
+    def acquire(self, worker: str) -> Optional[SyncJob]:
+        conn = self._connect()
+        try:
+            # job locked by other worker's acquire is skipped
+            row = conn.execute(
+                "WITH clock AS "
+                "(SELECT EXTRACT(EPOCH FROM clock_timestamp()) AS now) "
+                "UPDATE jobs SET worker = %s, lease_expires = clock.now + %s "
+                "FROM clock WHERE calendar = ("
+                "SELECT calendar FROM jobs, clock WHERE due <= clock.now "
+                "AND (lease_expires IS NULL OR lease_expires < clock.now) "
+                "ORDER BY due LIMIT 1 FOR UPDATE OF jobs SKIP LOCKED) "
+                "RETURNING calendar, config, lease_expires",
+                (worker, self.lease_seconds),
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        calendar, config, lease_expires = row
+        self.logger.info("%s taken by %s", calendar, worker)
+        return SyncJob(calendar, json.loads(config), worker, float(lease_expires))
+
+    def heartbeat(self, job: SyncJob) -> bool:
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = "
+                "EXTRACT(EPOCH FROM clock_timestamp()) + %s "
+                "WHERE calendar = %s AND worker = %s",
+                (self.lease_seconds, job.calendar, job.worker),
+            )
+            return bool(cursor.rowcount > 0)
+        finally:
+            conn.close()
+
+    def release(
+        self, job: SyncJob, next_due: float, error: Optional[str] = None
+    ) -> None:
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE jobs SET due = %s, worker = NULL, lease_expires = NULL, "
+                "last_error = %s WHERE calendar = %s AND worker = %s",
+                (next_due, error, job.calendar, job.worker),
+            )
+        finally:
+            conn.close()
+
+
+def make_job_queue(config: Dict[str, Any]) -> SyncJobQueue:
+    """make job queue from worker config dict
+
+    Arguments:
+
+    **config** -- config with keys:
+
+    queue_url: - PostgreSQL connection string, for workers on many hosts
+
+    queue_file: - SQLite filename, for workers on one host (if no queue_url)
+
+    (optional) lease_seconds: - lease time of taken job, default 300
+    """
+
+    lease_seconds: float = config.get("lease_seconds", 300)
+    if config.get("queue_url"):
+        return PostgresJobQueue(config["queue_url"], lease_seconds)
+    return SyncJobQueue(config["queue_file"], lease_seconds)
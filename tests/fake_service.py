@@ -0,0 +1,285 @@
+"""In-memory stand-in for google calendar service Resource (one calendar)"""
+
+import functools
+import itertools
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import dateutil.parser
+import dateutil.tz
+
+from sync_ics2gcal.gcal import EventData, EventList
+
+
+class FakeHttpError(Exception):
+    def __init__(self, status: int):
+        super().__init__("HTTP {}".format(status))
+        self.status_code = status
+
+
+class FakeRequest:
+    def __init__(self, func: Callable[..., Any], **kwargs: Any):
+        self.func = func
+        self.kwargs = kwargs
+
+    def execute(self, **_: Any) -> Any:
+        return self.func(**self.kwargs)
+
+
+class FakeBatch:
+    def __init__(self, service: "FakeService", callback: Callable[..., None]):
+        self.service = service
+        self.callback = callback
+        self.requests: List[Tuple[str, FakeRequest]] = []
+
+    def add(self, request: FakeRequest, request_id: Optional[str] = None) -> None:
+        self.requests.append((str(request_id), request))
+
+    def execute(self, **_: Any) -> None:
+        self.service.batches.append(len(self.requests))
+        for request_id, request in self.requests:
+            try:
+                response = request.execute()
+            except FakeHttpError as e:
+                self.callback(request_id, None, e)
+            else:
+                self.callback(request_id, response, None)
+
+
+@functools.lru_cache(maxsize=None)
+def parse_time(value: str) -> Any:
+    return dateutil.parser.parse(value)
+
+
+def event_time(value: Any) -> Any:
+    result = parse_time(value.get("dateTime", value.get("date", "")))
+    if result.tzinfo is None:
+        # all-day event, in UTC for tests
+        result = result.replace(tzinfo=dateutil.tz.UTC)
+    return result
+
+
+def select_fields(event: EventData, fields: Optional[str]) -> EventData:
+    """partial resource of listed event, by items(...) of fields parameter"""
+
+    if fields is None or "items(" not in fields:
+        return event
+    selector = fields[fields.index("items(") + len("items(") : fields.rindex(")")]
+    result: Dict[str, Any] = {}
+    for path in selector.split(","):
+        keys = path.split("/")
+        value: Any = event
+        for key in keys:
+            value = value.get(key) if isinstance(value, dict) else None
+        if value is None:
+            continue
+        target = result
+        for key in keys[:-1]:
+            target = target.setdefault(key, {})
+        target[keys[-1]] = value
+    return result  # type: ignore
+
+
+class FakeEvents:
+    def __init__(self, service: "FakeService"):
+        self.service = service
+
+    def _list(
+        self,
+        calendarId: str,
+        iCalUID: Optional[str] = None,
+        timeMin: Optional[str] = None,
+        timeMax: Optional[str] = None,
+        pageToken: Optional[str] = None,
+        maxResults: int = 250,
+        showDeleted: bool = False,
+        fields: Optional[str] = None,
+        **_: Any
+    ) -> Dict[str, Any]:
+        self.service.calls.append("list")
+        items: EventList = []
+        for event in self.service.events_by_id.values():
+            if iCalUID is not None and event["iCalUID"] != iCalUID:
+                continue
+            if not showDeleted and "cancelled" == event.get("status"):
+                continue
+            if timeMin is not None and event_time(event["end"]) <= event_time(
+                {"dateTime": timeMin}
+            ):
+                continue
+            if timeMax is not None and event_time(event["start"]) >= event_time(
+                {"dateTime": timeMax}
+            ):
+                continue
+            items.append(select_fields(event, fields))
+        offset = int(pageToken or 0)
+        response: Dict[str, Any] = {"items": items[offset : offset + maxResults]}
+        if offset + maxResults < len(items):
+            response["nextPageToken"] = str(offset + maxResults)
+        return response
+
+    def list(self, **kwargs: Any) -> FakeRequest:
+        return FakeRequest(self._list, **kwargs)
+
+    def _insert(self, calendarId: str, body: EventData, **_: Any) -> EventData:
+        self.service.call("insert")
+        event: EventData = dict(body)  # type: ignore
+        if "id" not in event:
+            event["id"] = "fake{}".format(next(self.service.ids))
+        if event["id"] in self.service.events_by_id:
+            raise FakeHttpError(409)
+        for exists_event in self.service.events_by_id.values():
+            if exists_event["iCalUID"] == event["iCalUID"]:
+                raise FakeHttpError(409)
+        self.service.events_by_id[event["id"]] = event
+        return event
+
+    def insert(self, **kwargs: Any) -> FakeRequest:
+        return FakeRequest(self._insert, **kwargs)
+
+    def _import(self, calendarId: str, body: EventData, **_: Any) -> EventData:
+        self.service.call("import")
+        for event_id, exists_event in self.service.events_by_id.items():
+            if exists_event["iCalUID"] == body["iCalUID"]:
+                event: EventData = dict(body)  # type: ignore
+                event["id"] = event_id
+                self.service.events_by_id[event_id] = event
+                return event
+        event = dict(body)  # type: ignore
+        event["id"] = "fake{}".format(next(self.service.ids))
+        self.service.events_by_id[event["id"]] = event
+        return event
+
+    def import_(self, **kwargs: Any) -> FakeRequest:
+        return FakeRequest(self._import, **kwargs)
+
+    def _update(
+        self, calendarId: str, eventId: str, body: EventData, **_: Any
+    ) -> EventData:
+        self.service.call("update")
+        if eventId not in self.service.events_by_id:
+            raise FakeHttpError(404)
+        event: EventData = dict(body)  # type: ignore
+        event["id"] = eventId
+        self.service.events_by_id[eventId] = event
+        return event
+
+    def update(self, **kwargs: Any) -> FakeRequest:
+        return FakeRequest(self._update, **kwargs)
+
+    def patch(self, **kwargs: Any) -> FakeRequest:
+        return FakeRequest(self._update, **kwargs)
+
+    def _delete(self, calendarId: str, eventId: str, **_: Any) -> str:
+        self.service.call("delete")
+        if eventId not in self.service.events_by_id:
+            raise FakeHttpError(404)
+        if "cancelled" == self.service.events_by_id[eventId].get("status"):
+            raise FakeHttpError(410)
+        del self.service.events_by_id[eventId]
+        return ""
+
+    def delete(self, **kwargs: Any) -> FakeRequest:
+        return FakeRequest(self._delete, **kwargs)
+
+
+class FakeCalendars:
+    def __init__(self, service: "FakeService"):
+        self.service = service
+
+    def _get(self, calendarId: str) -> Dict[str, Any]:
+        self.service.calls.append("calendars.get")
+        return self.service.calendars_by_id[calendarId]
+
+    def get(self, **kwargs: Any) -> FakeRequest:
+        return FakeRequest(self._get, **kwargs)
+
+    def _insert(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        self.service.calls.append("calendars.insert")
+        calendar = dict(body, id="cal{}".format(next(self.service.ids)))
+        self.service.calendars_by_id[calendar["id"]] = calendar
+        self.service.acl_by_calendar[calendar["id"]] = {
+            "user:owner": {"id": "user:owner", "role": "owner"}
+        }
+        return calendar
+
+    def insert(self, **kwargs: Any) -> FakeRequest:
+        return FakeRequest(self._insert, **kwargs)
+
+    def _delete(self, calendarId: str) -> str:
+        self.service.calls.append("calendars.delete")
+        del self.service.calendars_by_id[calendarId]
+        del self.service.acl_by_calendar[calendarId]
+        self.service.events_by_id.clear()
+        return ""
+
+    def delete(self, **kwargs: Any) -> FakeRequest:
+        return FakeRequest(self._delete, **kwargs)
+
+    def _clear(self, calendarId: str) -> str:
+        self.service.calls.append("calendars.clear")
+        self.service.events_by_id.clear()
+        return ""
+
+    def clear(self, **kwargs: Any) -> FakeRequest:
+        return FakeRequest(self._clear, **kwargs)
+
+
+class FakeAcl:
+    def __init__(self, service: "FakeService"):
+        self.service = service
+
+    def _list(self, calendarId: str, **_: Any) -> Dict[str, Any]:
+        self.service.calls.append("acl.list")
+        return {"items": list(self.service.acl_by_calendar[calendarId].values())}
+
+    def list(self, **kwargs: Any) -> FakeRequest:
+        return FakeRequest(self._list, **kwargs)
+
+    def _insert(self, calendarId: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        self.service.calls.append("acl.insert")
+        scope = body["scope"]
+        rule_id = scope["type"] + ":" + scope.get("value", "")
+        rule = dict(body, id=rule_id.rstrip(":"))
+        self.service.acl_by_calendar[calendarId][rule["id"]] = rule
+        return rule
+
+    def insert(self, **kwargs: Any) -> FakeRequest:
+        return FakeRequest(self._insert, **kwargs)
+
+
+class FakeService:
+    def __init__(self, events: Optional[EventList] = None):
+        self.ids = itertools.count()
+        self.events_by_id: Dict[str, EventData] = {}
+        self.calls: List[str] = []
+        # calls of events methods, that fail with HTTP 403
+        self.fail: Set[str] = set()
+        self.batches: List[int] = []
+        self.calendars_by_id: Dict[str, Dict[str, Any]] = {
+            "test": {"id": "test", "summary": "test", "timeZone": "UTC"}
+        }
+        self.acl_by_calendar: Dict[str, Dict[str, Dict[str, Any]]] = {
+            "test": {"user:owner": {"id": "user:owner", "role": "owner"}}
+        }
+        for event in events or []:
+            event = dict(event)  # type: ignore
+            if "id" not in event:
+                event["id"] = "fake{}".format(next(self.ids))
+            self.events_by_id[event["id"]] = event
+
+    def call(self, name: str) -> None:
+        self.calls.append(name)
+        if name in self.fail:
+            raise FakeHttpError(403)
+
+    def events(self) -> FakeEvents:
+        return FakeEvents(self)
+
+    def new_batch_http_request(self, callback: Callable[..., None]) -> FakeBatch:
+        return FakeBatch(self, callback)
+
+    def calendars(self) -> FakeCalendars:
+        return FakeCalendars(self)
+
+    def acl(self) -> FakeAcl:
+        return FakeAcl(self)
@@ -1,11 +1,22 @@
 import datetime
+import os
+import subprocess
+import sys
+from pathlib import Path
 from typing import Tuple, Any
 
 import pytest
 from pytz import timezone, utc
 
-from sync_ics2gcal import CalendarConverter
-from sync_ics2gcal.ical import format_datetime_utc
+from sync_ics2gcal import (
+    CalendarConverter,
+    ConversionCache,
+    SourceSnapshot,
+    FastCalendarConverter,
+    MergedCalendarConverter,
+    MergeSource,
+)
+from sync_ics2gcal.ical import format_datetime_utc, event_content_hash
 
 uid = "UID:uisgtr8tre93wewe0yr8wqy@test.com"
 only_start_date = (
@@ -117,6 +128,21 @@ def test_event_start_end(param_events_start_end: Tuple[str, str, str, str]) -> N
     assert event["end"] == {date_type: end}
 
 
+def test_compact_events(param_events_start_end: Tuple[str, str, str, str]) -> None:
+    (_, ics_str, _, _) = param_events_start_end
+    ics_str = ics_str.replace(
+        "END:VEVENT", "SUMMARY:test\r\nTRANSP:OPAQUE\r\nEND:VEVENT"
+    )
+    converter = CalendarConverter()
+    converter.loads(ics_str)
+    compact_converter = CalendarConverter(compact=True)
+    compact_converter.loads(ics_str)
+    events = converter.events_to_gcal()
+    compact_events = compact_converter.events_to_gcal()
+    assert [dict(event) for event in compact_events] == events
+    assert event_content_hash(compact_events[0]) == event_content_hash(events[0])
+
+
 def test_event_created_updated() -> None:
     converter = CalendarConverter()
     converter.loads(ics_test_event(created_updated))
@@ -144,3 +170,252 @@ def test_event_created_updated() -> None:
 )
 def test_format_datetime_utc(value: datetime.datetime, expected_str: str) -> None:
     assert format_datetime_utc(value) == expected_str
+
+
+def snapshot_test_events(uids: str, summary: str = "") -> str:
+    content = ""
+    for i, uid_val in enumerate(uids):
+        content += (
+            "BEGIN:VEVENT\r\nUID:{}@test.com\r\n"
+            "DTSTART;VALUE=DATE:201802{:02d}\r\nDURATION:P1D\r\n"
+            "SUMMARY:{}\r\nEND:VEVENT\r\n"
+        ).format(uid_val, i + 1, summary)
+    return ics_test_cal(content)
+
+
+def test_snapshot_delta(tmp_path: Path) -> None:
+    filename = str(tmp_path / "test.snapshot")
+
+    converter = CalendarConverter(snapshot=SourceSnapshot(filename))
+    converter.loads(snapshot_test_events("abc"))
+    assert converter.events_delta(converter.events_to_gcal()) is None
+    converter.commit_snapshot(True)
+
+    converter = CalendarConverter(snapshot=SourceSnapshot(filename))
+    converter.loads(snapshot_test_events("abd"))
+    events = converter.events_to_gcal()
+    events[1]["summary"] = "changed"
+    delta = converter.events_delta(events)
+    assert delta is not None
+    assert [e["iCalUID"] for e in delta.added] == ["d@test.com"]
+    assert [e["iCalUID"] for e in delta.changed] == ["b@test.com"]
+    assert delta.removed == [{"iCalUID": "c@test.com", "start": {"date": "2018-02-03"}}]
+
+
+def test_snapshot_retry(tmp_path: Path) -> None:
+    filename = str(tmp_path / "test.snapshot")
+    converter = CalendarConverter(snapshot=SourceSnapshot(filename))
+    converter.loads(snapshot_test_events("abc"))
+    converter.events_delta(converter.events_to_gcal())
+    converter.commit_snapshot(True)
+
+    # failed: update of b, delete of removed c
+    converter.loads(snapshot_test_events("ab"))
+    events = converter.events_to_gcal()
+    events[1]["summary"] = "changed"
+    converter.events_delta(events)
+    converter.commit_snapshot(False, ["b@test.com", "c@test.com"])
+    delta = converter.events_delta(events)
+    assert delta is not None
+    assert [e["iCalUID"] for e in delta.added] == ["b@test.com"]
+    assert [e["iCalUID"] for e in delta.removed] == ["c@test.com"]
+
+    # failed delete of event unknown by snapshot: next sync is full
+    converter.commit_snapshot(False, ["x@test.com"])
+    converter = CalendarConverter(snapshot=SourceSnapshot(filename))
+    converter.loads(snapshot_test_events("ab"))
+    assert converter.events_delta(converter.events_to_gcal()) is None
+
+
+@pytest.mark.parametrize(
+    "conflict,summary",
+    [("first", "one"), ("last", "two")],
+)
+def test_merged_sources(tmp_path: Path, conflict: str, summary: str) -> None:
+    (tmp_path / "one.ics").write_text(snapshot_test_events("abc", "one"))
+    (tmp_path / "two.ics").write_text(snapshot_test_events("cd", "two"))
+    (tmp_path / "three.ics").write_text(snapshot_test_events("ab", "three"))
+
+    converter = MergedCalendarConverter(
+        [
+            MergeSource(CalendarConverter(), str(tmp_path / "one.ics")),
+            MergeSource(FastCalendarConverter(), str(tmp_path / "two.ics")),
+            MergeSource(CalendarConverter(), str(tmp_path / "three.ics"), "three-"),
+        ],
+        conflict=conflict,
+    )
+    events = {e["iCalUID"]: e for e in converter.events_to_gcal()}
+    assert sorted(events) == [
+        "a@test.com",
+        "b@test.com",
+        "c@test.com",
+        "d@test.com",
+        "three-a@test.com",
+        "three-b@test.com",
+    ]
+    assert events["c@test.com"]["summary"] == summary
+
+
+def test_snapshot_reconcile(tmp_path: Path) -> None:
+    filename = str(tmp_path / "test.snapshot")
+    for i in range(4):
+        converter = CalendarConverter(snapshot=SourceSnapshot(filename, 2))
+        converter.loads(snapshot_test_events("abc"))
+        delta = converter.events_delta(converter.events_to_gcal())
+        # first run without snapshot, then every 2nd run is full sync
+        assert (delta is None) == (i % 2 == 0)
+        converter.commit_snapshot(delta is None)
+
+
+custom_vtimezone = """BEGIN:VTIMEZONE
+TZID:Custom Zone
+BEGIN:STANDARD
+DTSTART:19700101T000000
+TZOFFSETFROM:+0300
+TZOFFSETTO:+0300
+END:STANDARD
+END:VTIMEZONE
+"""
+
+fast_parser_corpus = [
+    ics_test_cal(""),
+    ics_test_event(date_val),
+    ics_test_event(date_duration),
+    ics_test_event(datetime_utc_val),
+    ics_test_event(datetime_utc_duration),
+    ics_test_event(created_updated),
+    ics_test_event(
+        uid
+        + """
+DTSTART;TZID=Europe/Moscow:20180319T092001
+DTEND;TZID="Europe/Moscow":20180319T102001
+SUMMARY:escaped\\, text\\; with \\\\ and\\nnew line
+DESCRIPTION:long description folded
+  to next line
+LOCATION:100% sure
+TRANSP:TRANSPARENT
+"""
+    ),
+    ics_test_event(
+        uid
+        + """
+DTSTART:20180319T092001
+DURATION:-PT1H
+BEGIN:VALARM
+TRIGGER:-PT15M
+DESCRIPTION:alarm
+END:VALARM
+"""
+    ),
+    ics_test_event(
+        uid
+        + """
+DTSTART;TZID=Custom Zone:20180319T092001
+DTEND;TZID=Custom Zone:20180319T102001
+"""
+    ).replace("BEGIN:VEVENT", custom_vtimezone + "BEGIN:VEVENT"),
+    ics_test_event(
+        uid
+        + """
+DTSTART;TZID=Russian Standard Time:20180319T092001
+DTEND;VALUE=DATE-TIME:20180319T102001Z
+DESCRIPTION:first
+DESCRIPTION:second
+"""
+    ),
+]
+
+
+@pytest.mark.parametrize("ics_str", fast_parser_corpus)
+def test_fast_parser_equivalence(ics_str: str, tmp_path: Path) -> None:
+    ics_str = ics_str.replace("\r\n", "\n").replace("\n", "\r\n")
+    converter = CalendarConverter()
+    converter.loads(ics_str)
+    fast_converter = FastCalendarConverter(ics_str)
+    # events are read from file one at a time
+    filename = tmp_path / "test.ics"
+    filename.write_bytes(ics_str.encode("utf-8"))
+    stream_converters = [
+        FastCalendarConverter(fast=fast, stream=True) for fast in (True, False)
+    ]
+    for stream_converter in stream_converters:
+        stream_converter.load(str(filename))
+        assert stream_converter.text is None
+    # same VTIMEZONE (keys of conversion cache) as loaded from file
+    file_converter = FastCalendarConverter()
+    file_converter.load(str(filename))
+
+    try:
+        expected = converter.events_to_gcal()
+    except Exception as e:
+        for other in [fast_converter] + stream_converters:
+            with pytest.raises(type(e)):
+                other.events_to_gcal()
+    else:
+        assert fast_converter.events_to_gcal() == expected
+        for stream_converter in stream_converters:
+            assert stream_converter.events_to_gcal() == expected
+            assert stream_converter.timezones == file_converter.timezones
+
+
+@pytest.mark.parametrize("ics_str", [ics_test_event(""), ics_test_event(uid + "\r\n")])
+def test_fast_parser_errors(ics_str: str) -> None:
+    with pytest.raises((KeyError, ValueError)):
+        FastCalendarConverter(ics_str).events_to_gcal()
+
+
+def test_conversion_cache(tmp_path: Path) -> None:
+    events = (
+        "BEGIN:VEVENT\nUID:first\nDTSTART;TZID=Custom Zone:20180319T092001\n"
+        "DTEND;TZID=Custom Zone:20180319T102001\nEND:VEVENT\n"
+        "BEGIN:VEVENT\nUID:second\nDTSTART:20180319T092001Z\n"
+        "DTEND:20180319T102001Z\nSUMMARY:test\nEND:VEVENT\n"
+    )
+    ics_str = ics_test_cal(custom_vtimezone + events).replace("\n", "\r\n")
+    expected = FastCalendarConverter(ics_str).events_to_gcal()
+
+    cache = ConversionCache(str(tmp_path / "cache.sqlite"))
+    assert FastCalendarConverter(ics_str, cache).events_to_gcal() == expected
+    assert FastCalendarConverter(ics_str, cache).events_to_gcal() == expected
+
+    def counts(ics_str: str) -> Tuple[int, int]:
+        converter = FastCalendarConverter(ics_str, cache)
+        result = converter.iter_events()
+        next(result)
+        next(result)
+        # counts are reset by flush at end of conversion
+        hits_misses = cache.hits, cache.misses
+        assert list(result) == []
+        return hits_misses
+
+    assert counts(ics_str) == (2, 0)
+    # changed timezone of first event
+    assert counts(ics_str.replace("+0300", "+0400")) == (1, 1)
+
+    # least recently used events are evicted
+    cache.max_bytes = 300
+    assert counts(ics_str) == (2, 0)
+    assert counts(ics_str.replace("+0300", "+0400")) == (1, 1)
+
+
+def test_cache_key_hash_seed() -> None:
+    script = (
+        "from sync_ics2gcal.icsparser import FastCalendarConverter, RawEvent\n"
+        "converter = FastCalendarConverter()\n"
+        "converter.timezones_by_id = {'A': 'a', 'B': 'b', 'C': 'c'}\n"
+        "lines = ['DTSTART;TZID=A:20180319T092001', 'DTEND;TZID=B:20180319T102001',"
+        " 'RDATE;TZID=\"C\":20180320T092001']\n"
+        "print(converter.cache_key(RawEvent(lines, {})))\n"
+    )
+    keys = set()
+    for seed in range(5):
+        env = dict(os.environ, PYTHONHASHSEED=str(seed))
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        keys.add(result.stdout.strip())
+    assert len(keys) == 1
@@ -0,0 +1,212 @@
+import datetime
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, List
+
+import dateutil.parser
+from google.auth.credentials import AnonymousCredentials
+from pytz import utc
+
+from sync_ics2gcal import (
+    CalendarConverter,
+    GoogleCalendar,
+    HttpPool,
+    ServiceAccountRing,
+    write_ics,
+)
+from sync_ics2gcal.gcal import service_account_email
+from sync_ics2gcal.ical import format_datetime_utc
+from sync_ics2gcal.manage_calendars import EXPORT_FIELDS
+from .fake_service import FakeService
+from .test_sync import gen_events
+
+
+def test_list_events_sharded() -> None:
+    start = utc.localize(datetime.datetime(2018, 1, 1))
+    # events are 1 hour long, with start every hour: many spans shard bounds
+    events = gen_events(0, 1000, start)
+    service = FakeService(events)
+
+    gcalendar = GoogleCalendar(service, "test")
+    listed = gcalendar.list_events_from(start)
+    assert len(listed) == len(events)
+
+    for shards in (2, 5):
+        gcalendar = GoogleCalendar(
+            service,
+            "test",
+            list_shards=shards,
+            list_shard_span=datetime.timedelta(hours=101, minutes=30),
+        )
+        listed_sharded = gcalendar.list_events_from(start)
+        assert sorted(e["id"] for e in listed_sharded) == sorted(
+            e["id"] for e in listed
+        )
+
+    end = start + datetime.timedelta(hours=500)
+    listed_range = gcalendar.list_events_from(start, end)
+    assert len(listed_range) == 500
+
+
+def test_list_events_sharded_long() -> None:
+    start = utc.localize(datetime.datetime(2018, 1, 1))
+    events = gen_events(0, 100, start) + gen_events(0, 30, start, no_time=True)
+    # events span many shards
+    for i, event in enumerate(events[:10]):
+        event["end"] = {"dateTime": "2018-02-0{}T00:00:00Z".format(i % 9 + 1)}
+    service = FakeService(events)
+    gcalendar = GoogleCalendar(
+        service,
+        "test",
+        list_shards=4,
+        list_shard_span=datetime.timedelta(hours=7),
+    )
+    listed = gcalendar.list_events_from(start)
+    assert sorted(e["id"] for e in listed) == sorted(service.events_by_id)
+
+    # requested fields are extended by start and end
+    pages = list(gcalendar.iter_events(start, fields="id"))
+    assert sorted(e["id"] for page in pages for e in page) == sorted(
+        service.events_by_id
+    )
+
+
+def test_batch_size() -> None:
+    start = utc.localize(datetime.datetime(2018, 1, 1))
+    service = FakeService()
+    gcalendar = GoogleCalendar(service, "test", batch_size=40)
+    gcalendar.insert_events(gen_events(0, 100, start))
+    assert service.batches == [40, 40, 20]
+    assert len(service.events_by_id) == 100
+
+
+def test_insert_conflict_other_id() -> None:
+    start = utc.localize(datetime.datetime(2018, 1, 1))
+    events = gen_events(0, 3, start)
+    # deleted event with same iCalUID, inserted without deterministic id
+    exists = dict(events[0], id="other", status="cancelled")
+    service = FakeService([exists])  # type: ignore
+    gcalendar = GoogleCalendar(service, "test", deterministic_ids=True)
+    inserted: List[str] = []
+    gcalendar.insert_events(events, lambda e: inserted.append(e["iCalUID"]))
+    assert service.calls == ["insert"] * 3 + ["update", "import"]
+    assert sorted(inserted) == sorted(e["iCalUID"] for e in events)
+    assert "status" not in service.events_by_id["other"]
+    assert len(service.events_by_id) == 3
+
+
+def test_http_pool() -> None:
+    pool = HttpPool(AnonymousCredentials(), size=3, timeout=5)
+    lock = threading.Lock()
+    active: List[Any] = []
+    used: List[int] = []
+
+    def make_request(http: Any) -> Any:
+        def request(*_: Any, **__: Any) -> Any:
+            with lock:
+                # transport is used by one thread at a time
+                assert http not in active
+                active.append(http)
+                used.append(len(active))
+            time.sleep(0.01)
+            with lock:
+                active.remove(http)
+            return id(http)
+
+        return request
+
+    transports = list(pool._pool.queue)
+    assert len(transports) == 3
+    assert all(http.timeout == 5 for http in transports)
+    for http in transports:
+        http.request = make_request(http)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: pool.request("uri"), range(40)))
+    assert set(results) == {id(http) for http in transports}
+    assert max(used) <= 3
+
+    closed: List[int] = []
+    for http in transports:
+        http.close = lambda http=http: closed.append(id(http))
+    pool.close()
+    assert sorted(closed) == sorted(id(http) for http in transports)
+    assert len(pool._pool.queue) == 3
+
+
+def test_export_ics(tmp_path: Path) -> None:
+    start = utc.localize(datetime.datetime(2018, 1, 1))
+    all_day_events = gen_events(300, 310, start, no_time=True)
+    for event in all_day_events:
+        del event["created"], event["updated"]
+    events = gen_events(0, 300, start) + all_day_events
+    gcalendar = GoogleCalendar(FakeService(events), "test", list_shards=4)
+
+    filename = tmp_path / "export.ics"
+    with open(filename, "w", encoding="utf-8", newline="") as f:
+        count = write_ics(
+            gcalendar.iter_events(
+                start, start + datetime.timedelta(days=400), fields=EXPORT_FIELDS
+            ),
+            f,
+        )
+    assert count == len(events)
+
+    converter = CalendarConverter()
+    converter.load(str(filename))
+    exported = {event["iCalUID"]: event for event in converter.events_to_gcal()}
+    assert len(exported) == len(events)
+    for event in events:
+        new_event = exported[event["iCalUID"]]
+        for key in ("summary", "location", "description"):
+            assert new_event[key] == event[key]  # type: ignore
+        for key in ("start", "end"):
+            value = event[key]  # type: ignore
+            if "dateTime" in value:
+                # same value as converted from source
+                value = {
+                    "dateTime": format_datetime_utc(
+                        dateutil.parser.isoparse(value["dateTime"])
+                    )
+                }
+            assert new_event[key] == value  # type: ignore
+
+
+def test_prune_events() -> None:
+    start = utc.localize(datetime.datetime(2018, 1, 1))
+    events = gen_events(0, 300, start) + gen_events(0, 10, start, no_time=True)
+    service = FakeService(events)
+    gcalendar = GoogleCalendar(service, "test", batch_size=20, list_shards=3)
+
+    before = start + datetime.timedelta(hours=100)
+    # all-day events end at midnight (UTC) of next day: 4 of 10 ended
+    assert gcalendar.prune_events(before) == 104
+    assert len(service.events_by_id) == 206
+    assert service.calls.count("delete") == 104
+    assert gcalendar.prune_events(before) == 0
+
+
+def test_service_account_ring(tmp_path: Path) -> None:
+    calendar_ids = [
+        "calendar{}@group.calendar.google.com".format(i) for i in range(300)
+    ]
+    ring = ServiceAccountRing(["a.json", "b.json", "c.json"])
+    assigned = {calendar_id: ring.account(calendar_id) for calendar_id in calendar_ids}
+    counts = Counter(assigned.values())
+    assert set(counts) == {"a.json", "b.json", "c.json"}
+    assert min(counts.values()) > 50
+
+    # only calendars of new account are moved
+    ring = ServiceAccountRing(["a.json", "b.json", "c.json", "d.json"])
+    moved = [c for c in calendar_ids if ring.account(c) != assigned[c]]
+    assert 0 < len(moved) < 150
+    assert all(ring.account(c) == "d.json" for c in moved)
+
+    account_file = tmp_path / "account.json"
+    account_file.write_text('{"client_email": "sync@project.iam.gserviceaccount.com"}')
+    assert "sync@project.iam.gserviceaccount.com" == service_account_email(
+        str(account_file)
+    )
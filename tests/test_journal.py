@@ -0,0 +1,57 @@
+from pathlib import Path
+
+from sync_ics2gcal import SyncJournal
+from sync_ics2gcal.gcal import EventData, EventList
+
+
+def gen_events(count: int) -> EventList:
+    result: EventList = []
+    for i in range(count):
+        event: EventData = {
+            "id": "id{:06d}".format(i),
+            "iCalUID": "test{:06d}".format(i),
+            "summary": "test event {}".format(i),
+        }
+        result.append(event)
+    return result
+
+
+def test_no_journal(tmp_path: Path) -> None:
+    journal = SyncJournal(str(tmp_path / "sync.journal"))
+    assert journal.load() is None
+
+
+def test_resume_remaining(tmp_path: Path) -> None:
+    events = gen_events(9)
+    to_insert = events[:3]
+    to_update = list(zip(events[3:6], events[3:6]))
+    to_delete = events[6:]
+
+    journal = SyncJournal(str(tmp_path / "sync.journal"))
+    journal.start(to_insert, to_update, to_delete)
+    journal.mark_done("insert", to_insert[0])
+    journal.mark_done("update", to_update[1][0])
+    journal.mark_done("delete", to_delete[2])
+
+    # simulate crash: journal is not finished, new instance loads it
+    plan = SyncJournal(journal.filename).load()
+    assert plan is not None
+    assert plan.to_insert == to_insert[1:]
+    assert plan.to_update == [to_update[0], to_update[2]]
+    assert plan.to_delete == to_delete[:2]
+
+    journal.finish()
+    assert not journal.exists()
+
+
+def test_truncated_line(tmp_path: Path) -> None:
+    events = gen_events(2)
+    journal = SyncJournal(str(tmp_path / "sync.journal"))
+    journal.start(events, [], [])
+    journal.mark_done("insert", events[0])
+    with open(journal.filename, "a", encoding="utf-8") as f:
+        f.write('{"done": "ins')
+
+    plan = SyncJournal(journal.filename).load()
+    assert plan is not None
+    assert plan.to_insert == events[1:]
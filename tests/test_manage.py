@@ -0,0 +1,128 @@
+import datetime
+from pathlib import Path
+from typing import Any
+
+from icalendar import Calendar
+from pytz import utc
+
+from sync_ics2gcal.manage_calendars import (
+    BATCH_SIZE,
+    BulkCommands,
+    Commands,
+    item_acl_rules,
+    load_manifest,
+)
+from .fake_service import FakeService
+from .test_sync import gen_events
+
+manifest_csv = """id,summary,timezone,public,owners,acl,property.colorId
+,Tenant 1,Europe/Moscow,true,a@example.com;b@example.com,reader:domain:example.com,3
+cal2@group.calendar.google.com,Tenant 2,,,,,
+"""
+
+manifest_yaml = """
+- summary: Tenant 1
+  timezone: Europe/Moscow
+  public: true
+  owners: [a@example.com, b@example.com]
+  acl:
+    - role: reader
+      scope: {type: domain, value: example.com}
+  properties:
+    colorId: "3"
+- id: cal2@group.calendar.google.com
+  summary: Tenant 2
+"""
+
+
+def test_manifest_csv_yaml(tmp_path: Path) -> None:
+    csv_path = tmp_path / "manifest.csv"
+    csv_path.write_text(manifest_csv, encoding="utf-8")
+    yaml_path = tmp_path / "manifest.yml"
+    yaml_path.write_text(manifest_yaml, encoding="utf-8")
+
+    items = load_manifest(str(csv_path))
+    assert items == load_manifest(str(yaml_path))
+    assert len(items) == 2
+    assert items[0]["properties"] == {"colorId": "3"}
+    assert "public" not in items[1]
+
+
+def test_manifest_csv_default_scope(tmp_path: Path) -> None:
+    csv_path = tmp_path / "manifest.csv"
+    csv_path.write_text("summary,acl\nTenant,reader:default\n", encoding="utf-8")
+
+    items = load_manifest(str(csv_path))
+    assert items[0]["acl"] == [{"scope": {"type": "default"}, "role": "reader"}]
+
+
+def test_bulk_concurrent(tmp_path: Path, capsys: Any) -> None:
+    count = BATCH_SIZE * 3 + 1
+    csv_path = tmp_path / "manifest.csv"
+    csv_path.write_text(
+        "summary,acl\n"
+        + "".join("Tenant {},reader:default\n".format(i) for i in range(count)),
+        encoding="utf-8",
+    )
+    service = FakeService()
+    bulk = BulkCommands(service, _concurrency=4)
+
+    bulk.create(str(csv_path))
+    assert sorted(service.batches) == [1, 1] + [BATCH_SIZE] * 6
+    assert len(service.calendars_by_id) == count + 1
+    assert all(
+        "default" in service.acl_by_calendar[calendar_id]
+        for calendar_id in service.calendars_by_id
+        if calendar_id != "test"
+    )
+    assert "create: {} ok, 0 failed".format(count) in capsys.readouterr().out
+
+    # items without id are failed, others are removed
+    yaml_path = tmp_path / "manifest.yml"
+    yaml_path.write_text("- summary: no id\n- id: test\n", encoding="utf-8")
+    bulk.remove(str(yaml_path))
+    assert "test" not in service.calendars_by_id
+    out = capsys.readouterr().out
+    assert "remove failed, no id: : no calendar id" in out
+    assert "remove: 1 ok, 1 failed" in out
+
+
+def test_item_acl_rules() -> None:
+    rules = item_acl_rules(
+        {
+            "owners": ["a@example.com"],
+            "acl": [{"scope": {"type": "domain", "value": "x.com"}, "role": "reader"}],
+            "public": True,
+        }
+    )
+    assert rules == [
+        {"scope": {"type": "user", "value": "a@example.com"}, "role": "owner"},
+        {"scope": {"type": "domain", "value": "x.com"}, "role": "reader"},
+        {"scope": {"type": "default"}, "role": "reader"},
+    ]
+
+
+def test_export(tmp_path: Path) -> None:
+    start = utc.localize(datetime.datetime(2018, 1, 1))
+    # last event is 22 years later
+    events = gen_events(0, 10, start) + gen_events(200000, 200001, start)
+    # instances of recurring event, with UID of series
+    for event in events[:3]:
+        event["iCalUID"] = "series@test.com"
+        event["originalStartTime"] = event["start"]
+    commands = Commands.__new__(Commands)
+    commands._service = FakeService(events)
+
+    filename = tmp_path / "export.ics"
+    commands.export("test", str(filename), start="2017-01-01", shards=4)
+    calendar = Calendar.from_ical(filename.read_bytes())
+    exported = calendar.walk("VEVENT")
+    assert len(exported) == len(events)
+    recurrence_ids = [
+        event.decoded("RECURRENCE-ID")
+        for event in exported
+        if "series@test.com" == str(event["UID"])
+    ]
+    assert sorted(recurrence_ids) == [
+        start + datetime.timedelta(hours=i) for i in range(3)
+    ]
@@ -0,0 +1,126 @@
+import datetime
+import math
+from pathlib import Path
+
+import pytest
+from pytz import utc
+
+from sync_ics2gcal import (
+    CalendarSync,
+    DeadlineExceeded,
+    GoogleCalendar,
+    QuotaBudget,
+    RunDeadline,
+    SyncJournal,
+)
+from .fake_service import FakeService
+from .test_sync import ListConverter, gen_events
+
+
+def test_budget_deferral(tmp_path: Path) -> None:
+    start = utc.localize(datetime.datetime(2018, 1, 1))
+    events = gen_events(0, 50, start)
+    service = FakeService()
+    history_file = str(tmp_path / "quota.sqlite")
+    journal = SyncJournal(str(tmp_path / "sync.journal"))
+
+    quota = QuotaBudget("test", run_budget=35, history_file=history_file)
+    gcalendar = GoogleCalendar(service, "test", batch_size=10, quota=quota)
+    sync = CalendarSync(gcalendar, ListConverter(events), journal)
+    sync.prepare_sync(start)
+    # 1 list + 50 find_exists requests are not limited
+    assert not sync.apply()
+    assert len(service.events_by_id) == 0
+    assert quota.history()[0][2:] == (51, True)
+
+    quota = QuotaBudget("test", run_budget=30, history_file=history_file)
+    gcalendar = GoogleCalendar(service, "test", batch_size=20, quota=quota)
+    sync = CalendarSync(gcalendar, ListConverter(events), journal)
+    assert sync.resume()
+    service.batches.clear()
+    assert not sync.apply()
+    assert service.batches == [20, 10]
+    assert len(service.events_by_id) == 30
+
+    # remaining operations are resumed from journal, by calendar budget for day
+    quota = QuotaBudget("test", calendar_budget=101, history_file=history_file)
+    gcalendar = GoogleCalendar(service, "test", batch_size=20, quota=quota)
+    sync = CalendarSync(gcalendar, ListConverter(events), journal)
+    assert sync.resume()
+    assert len(sync.to_insert) == 20
+    assert sync.apply()
+    assert len(service.events_by_id) == 50
+    assert [h[2:] for h in quota.history()] == [(51, True), (30, True), (20, False)]
+
+
+class CountdownDeadline(RunDeadline):
+    """each check before batch takes 100 seconds"""
+
+    def check(self) -> None:
+        self.expires -= 100
+        super().check()
+
+
+def test_deadline_deferral(tmp_path: Path) -> None:
+    start = utc.localize(datetime.datetime(2018, 1, 1))
+    events = gen_events(0, 50, start)
+    service = FakeService()
+    journal = SyncJournal(str(tmp_path / "sync.journal"))
+
+    deadline = CountdownDeadline(400, reserve=50)
+    gcalendar = GoogleCalendar(service, "test", batch_size=10, deadline=deadline)
+    sync = CalendarSync(gcalendar, ListConverter(events), journal, use_import=True)
+    sync.prepare_sync(start)
+    service.batches.clear()
+    # batches are started with 300, 200, 100 seconds left
+    assert not sync.apply()
+    assert service.batches == [10, 10, 10]
+
+    gcalendar = GoogleCalendar(service, "test", batch_size=10)
+    sync = CalendarSync(gcalendar, ListConverter(events), journal, use_import=True)
+    assert sync.resume()
+    assert len(sync.to_insert) == 20
+    assert sync.apply()
+    assert len(service.events_by_id) == 50
+
+
+def test_deadline_cancel() -> None:
+    start = utc.localize(datetime.datetime(2018, 1, 1))
+    service = FakeService()
+    deadline = RunDeadline(math.inf, reserve=0)
+    gcalendar = GoogleCalendar(service, "test", batch_size=10, deadline=deadline)
+    sync = CalendarSync(
+        gcalendar, ListConverter(gen_events(0, 50, start)), use_import=True
+    )
+    sync.prepare_sync(start)
+    # lease of job is lost: no more requests
+    deadline.cancel("lease is lost")
+    assert not sync.apply()
+    assert service.events_by_id == {}
+    with pytest.raises(DeadlineExceeded):
+        gcalendar.list_events_from(start)
+
+
+def test_deadline_timeout() -> None:
+    deadline = RunDeadline(60)
+    assert deadline.timeout(5) == 5
+    assert 0 < deadline.timeout() <= 60
+    deadline.check()
+    with pytest.raises(DeadlineExceeded):
+        RunDeadline(10, reserve=30).check()
+    with pytest.raises(DeadlineExceeded):
+        RunDeadline(0).timeout()
+
+
+def test_prune_budget() -> None:
+    start = utc.localize(datetime.datetime(2018, 1, 1))
+    service = FakeService(gen_events(0, 50, start))
+    quota = QuotaBudget("test", run_budget=25)
+    gcalendar = GoogleCalendar(service, "test", batch_size=10, quota=quota)
+    sync = CalendarSync(gcalendar, ListConverter([]))
+
+    # 1 list request, remaining events are deleted by next run
+    now = start + datetime.timedelta(days=10)
+    assert sync.prune(datetime.timedelta(days=1), now) == 24
+    assert service.batches[-3:] == [10, 10, 4]
+    assert len(service.events_by_id) == 26
@@ -0,0 +1,29 @@
+from pathlib import Path
+
+from sync_ics2gcal import TokenBucket, SharedTokenBucket
+
+
+def test_token_bucket() -> None:
+    bucket = TokenBucket(rate=10, capacity=5)
+    assert bucket._take(3) == 0
+    assert bucket._take(2) == 0
+    # bucket is empty, wait for refill
+    assert bucket._take(1) > 0
+
+
+def test_token_bucket_debt() -> None:
+    bucket = TokenBucket(rate=10, capacity=5)
+    # more than capacity is allowed when bucket is full
+    assert bucket._take(20) == 0
+    wait = bucket._take(1)
+    assert 1.5 < wait <= 1.6
+
+
+def test_shared_token_bucket(tmp_path: Path) -> None:
+    state_file = str(tmp_path / "bucket.sqlite")
+    bucket1 = SharedTokenBucket(state_file, rate=1, capacity=4)
+    bucket2 = SharedTokenBucket(state_file, rate=1, capacity=4)
+    assert bucket1._take(2) == 0
+    assert bucket2._take(2) == 0
+    assert bucket1._take(1) > 0
+    assert bucket2._take(1) > 0
@@ -0,0 +1,43 @@
+import datetime
+import json
+import logging
+from pathlib import Path
+
+import pytest
+from pytz import utc
+
+from sync_ics2gcal import GoogleCalendar, make_result_sink
+from .fake_service import FakeService
+from .test_sync import gen_events
+
+
+def test_summary_sink(tmp_path: Path, caplog: pytest.LogCaptureFixture) -> None:
+    start = utc.localize(datetime.datetime(2018, 1, 1))
+    service = FakeService()
+    logger = logging.getLogger("test_results")
+    sink = make_result_sink(
+        {"mode": "summary", "jsonl": str(tmp_path / "results.jsonl")}, logger
+    )
+    gcalendar = GoogleCalendar(service, "test", result_sink=sink)
+
+    events = gen_events(0, 10, start)
+    with caplog.at_level(logging.INFO, logger="test_results"):
+        gcalendar.insert_events(events)
+        # events without ids: updates fail
+        missing = gen_events(10, 12, start)
+        for event in missing:
+            event["id"] = "missing"
+        gcalendar.update_events(list(zip(missing, missing)))
+        sink.flush()
+
+    messages = [r.getMessage() for r in caplog.records]
+    assert len(messages) == 4
+    assert messages[-2:] == [
+        "event insert: 10 ok, 0 failed",
+        "event update: 0 ok, 2 failed",
+    ]
+
+    with open(tmp_path / "results.jsonl", "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 12
+    assert sum(r["ok"] for r in records) == 10
@@ -1,16 +1,30 @@
 import datetime
 import hashlib
 import operator
+import tracemalloc
 from copy import deepcopy
 from random import shuffle
-from typing import Union, List, Dict, Optional, AnyStr
+from pathlib import Path
+from typing import Union, List, Dict, Optional, AnyStr, Iterator, Callable
 
 import dateutil.parser
 import pytest
 from pytz import timezone, utc
 
-from sync_ics2gcal import CalendarSync, DateDateTime
+from sync_ics2gcal import (
+    CalendarSync,
+    InsertOperation,
+    UpdateOperation,
+    DeleteOperation,
+    DateDateTime,
+    CalendarConverter,
+    FastCalendarConverter,
+    GoogleCalendar,
+)
+from sync_ics2gcal import gcal
 from sync_ics2gcal.gcal import EventDateOrDateTime, EventData, EventList
+from sync_ics2gcal.ical import SourceSnapshot, write_ics
+from .fake_service import FakeService
 
 
 def sha1(s: AnyStr) -> str:
@@ -199,3 +213,445 @@ def test_filter_events_no_updated() -> None:
     sync.to_update = list(zip(events_old, events_new))
     sync._filter_events_to_update()
     assert len(sync.to_update) == count // 2
+
+
+class ListConverter(CalendarConverter):
+    def __init__(self, events: EventList):
+        super().__init__()
+        self.events = events
+
+    def _iter_events(self) -> Iterator[EventData]:
+        return iter(deepcopy(self.events))
+
+
+def test_sync_import() -> None:
+    start = utc.localize(datetime.datetime(2018, 1, 1))
+    events = gen_events(0, 20, start)
+    # deleted in google calendar, not listed, but exists with same iCalUID
+    exists = deepcopy(events[:5])
+    for event in exists:
+        event["status"] = "cancelled"
+    service = FakeService(exists)
+
+    sync = CalendarSync(
+        GoogleCalendar(service, "test"), ListConverter(events), use_import=True
+    )
+    sync.prepare_sync(start)
+    assert len(sync.to_insert) == 20
+    sync.apply()
+
+    assert service.calls == ["list"] + ["import"] * 20
+    assert len(service.events_by_id) == 20
+    assert all("status" not in event for event in service.events_by_id.values())
+
+
+def test_prioritize() -> None:
+    now = utc.localize(datetime.datetime(2018, 1, 1))
+    events = gen_events(-10, 10, now)
+    shuffle(events)
+
+    sync = CalendarSync(GoogleCalendar(FakeService(), "test"), ListConverter([]))
+    sync.to_insert = events[:10]
+    sync.to_update = list(zip(events[10:], events[10:]))
+    sync.to_delete = [{"id": "unknown_start", "iCalUID": "unknown"}]
+    assert sync.prioritize(now=now) == 0
+    starts = [get_start_date(e) for e in sync.to_insert]
+    distances = [abs(start - now) for start in starts]  # type: ignore
+    assert distances == sorted(distances)
+
+    # events are 1 hour long, start every hour
+    deferred = sync.prioritize(datetime.timedelta(hours=3, minutes=30), now=now)
+    assert deferred == 20 - 7
+    kept = sync.to_insert + [new for new, _ in sync.to_update]
+    assert sorted(get_start_date(e) for e in kept) == [  # type: ignore
+        now + datetime.timedelta(hours=i) for i in range(-3, 4)
+    ]
+    # event with unknown start is never deferred
+    assert sync.to_delete == [{"id": "unknown_start", "iCalUID": "unknown"}]
+
+
+def test_prioritize_snapshot(tmp_path: Path) -> None:
+    now = utc.localize(datetime.datetime(2018, 1, 1))
+    # event in 16 days is outside of cutoff
+    events = gen_events(0, 10, now) + gen_events(400, 401, now)
+    service = FakeService()
+    converter = ListConverter(events)
+    converter.snapshot = SourceSnapshot(str(tmp_path / "test.snapshot"), 3)
+    sync = CalendarSync(GoogleCalendar(service, "test"), converter)
+    sync.prepare_sync(now)
+    assert sync.apply()
+
+    events[-1]["summary"] = "changed"
+    events[-1]["updated"] = "2030-01-01T00:00:00Z"
+    full_syncs = []
+    for _ in range(3):
+        sync.prepare_sync(now)
+        full_syncs.append(sync.full_sync)
+        cutoff = None if sync.full_sync else datetime.timedelta(hours=48)
+        sync.prioritize(cutoff, now=now)
+        sync.apply()
+    # deferred runs are counted for reconciliation
+    assert full_syncs == [False, False, True]
+    summaries = [e["summary"] for e in service.events_by_id.values()]
+    assert "changed" in summaries
+
+
+@pytest.mark.parametrize("deterministic_ids", [False, True])
+def test_prioritize_deletes(tmp_path: Path, deterministic_ids: bool) -> None:
+    now = utc.localize(datetime.datetime(2018, 1, 1))
+    events = gen_events(0, 10, now) + gen_events(400, 401, now)
+    service = FakeService()
+    converter = ListConverter(events)
+    converter.snapshot = SourceSnapshot(str(tmp_path / "test.snapshot"))
+    gcalendar = GoogleCalendar(service, "test", deterministic_ids=deterministic_ids)
+    sync = CalendarSync(gcalendar, converter)
+    sync.prepare_sync(now)
+    assert sync.apply()
+
+    # deletes are ordered by start of removed events from snapshot
+    del events[-1], events[0]
+    sync.prepare_sync(now)
+    assert not sync.full_sync
+    assert sync.prioritize(datetime.timedelta(hours=48), now=now) == 1
+    assert [get_start_date(e) for e in sync.to_delete] == [now]
+    assert not sync.apply()
+    assert len(service.events_by_id) == 10
+
+
+@pytest.mark.parametrize("method", ["clear", "recreate"])
+def test_rebuild(method: str) -> None:
+    start = utc.localize(datetime.datetime(2018, 1, 1))
+    service = FakeService(gen_events(0, 20, start))
+    reader = {"role": "reader", "scope": {"type": "domain", "value": "x.com"}}
+    service.acl_by_calendar["test"]["domain:x.com"] = dict(reader, id="domain:x.com")
+
+    # same events with new UIDs
+    events = gen_events(0, 20, start)
+    for event in events:
+        event["iCalUID"] = "new" + event["iCalUID"]
+    recreated = []
+
+    def on_recreate(calendar_id: str) -> None:
+        recreated.append((calendar_id, len(service.events_by_id)))
+
+    sync = CalendarSync(
+        GoogleCalendar(service, "test"),
+        ListConverter(events),
+        rebuild_method=method,
+        on_recreate=on_recreate,
+    )
+    sync.prepare_sync(start)
+    assert sync.rebuild
+    assert (len(sync.to_insert), len(sync.to_delete)) == (20, 0)
+    sync.apply()
+
+    assert sorted(e["iCalUID"] for e in service.events_by_id.values()) == sorted(
+        e["iCalUID"] for e in events
+    )
+    calendar_id = sync.gcalendar.calendar_id
+    assert (calendar_id == "test") == ("clear" == method)
+    # new id is saved before inserts
+    assert recreated == ([] if "clear" == method else [(calendar_id, 0)])
+    assert service.calendars_by_id[calendar_id]["summary"] == "test"
+    assert "domain:x.com" in service.acl_by_calendar[calendar_id]
+
+    # small changes are synced as usual
+    events[0]["summary"] = "changed"
+    events[0]["updated"] = "2030-01-01T00:00:00Z"
+    sync.prepare_sync(start)
+    assert not sync.rebuild
+    assert len(sync.to_update) == 1
+
+
+def test_sync_deterministic_ids(tmp_path: Path) -> None:
+    start = utc.localize(datetime.datetime(2018, 1, 1))
+    events = gen_events(0, 10, start)
+    service = FakeService()
+    gcalendar = GoogleCalendar(service, "test", deterministic_ids=True)
+    # deleted event with same id exists
+    gcalendar.insert_events(events[:1])
+    service.events_by_id[gcalendar.event_id(events[0])]["status"] = "cancelled"
+
+    converter = ListConverter(events)
+    converter.snapshot = SourceSnapshot(str(tmp_path / "test.snapshot"))
+    sync = CalendarSync(gcalendar, converter)
+    sync.prepare_sync(start)
+    sync.apply()
+    assert sorted(service.events_by_id) == sorted(map(gcalendar.event_id, events))
+    assert "status" not in service.events_by_id[gcalendar.event_id(events[0])]
+
+    # changes are applied by ids, without search
+    service.calls.clear()
+    events[1]["summary"] = "changed"
+    del events[2]
+    sync.prepare_sync(start)
+    sync.apply()
+    assert service.calls == ["update", "delete"]
+    assert len(service.events_by_id) == 9
+
+
+def test_delete_by_ids_missing(tmp_path: Path) -> None:
+    start = utc.localize(datetime.datetime(2018, 1, 1))
+    events = gen_events(0, 10, start)
+    # inserted before deterministic ids, with ids from google
+    service = FakeService(events[:2])
+    gcalendar = GoogleCalendar(service, "test", deterministic_ids=True)
+    converter = ListConverter(events)
+    converter.snapshot = SourceSnapshot(str(tmp_path / "test.snapshot"))
+    sync = CalendarSync(gcalendar, converter)
+    sync.prepare_sync(start)
+    assert sync.apply()
+    assert len(service.events_by_id) == 10
+
+    # event with other id is found by iCalUID, missing event is already deleted
+    del service.events_by_id[gcalendar.event_id(events[2])]
+    del events[:3]
+    sync.prepare_sync(start)
+    assert not sync.full_sync
+    assert len(sync.to_delete) == 3
+    assert sync.apply()
+    assert sorted(service.events_by_id) == sorted(map(gcalendar.event_id, events))
+
+    # nothing is prepared again
+    sync.prepare_sync(start)
+    assert not sync.full_sync
+    assert sync.to_delete == []
+
+
+@pytest.mark.parametrize(
+    "use_import, deterministic_ids", [(True, False), (False, True)]
+)
+def test_retention_not_synced_again(
+    tmp_path: Path, use_import: bool, deterministic_ids: bool
+) -> None:
+    start = utc.localize(datetime.datetime(2018, 1, 1))
+    events = gen_events(0, 20, start)
+    service = FakeService()
+    gcalendar = GoogleCalendar(service, "test", deterministic_ids=deterministic_ids)
+    converter = ListConverter(events)
+    converter.snapshot = SourceSnapshot(str(tmp_path / "test.snapshot"))
+    sync = CalendarSync(gcalendar, converter, use_import=use_import)
+    sync.prepare_sync(start)
+    assert sync.apply()
+    assert len(service.events_by_id) == 20
+
+    # events ended by 11:00 are pruned, changed one is not synced again
+    now = start + datetime.timedelta(hours=12)
+    assert sync.prune(datetime.timedelta(hours=1), now) == 11
+    events[2]["summary"] = "changed"
+    events[2]["updated"] = "2018-03-01T00:00:00Z"
+    for full in (False, True, False):
+        sync.prepare_sync(start, full)
+        assert (sync.to_insert, sync.to_update, sync.to_delete) == ([], [], [])
+    assert len(service.events_by_id) == 9
+
+    operations = list(sync.iter_plan_windowed(start, datetime.timedelta(hours=5)))
+    assert operations == []
+
+
+def test_snapshot_failed_operations(tmp_path: Path) -> None:
+    start = utc.localize(datetime.datetime(2018, 1, 1))
+    events = gen_events(0, 10, start)
+    service = FakeService()
+    service.fail.add("insert")
+    converter = ListConverter(events)
+    converter.snapshot = SourceSnapshot(str(tmp_path / "test.snapshot"))
+    sync = CalendarSync(GoogleCalendar(service, "test"), converter)
+    sync.prepare_sync(start)
+    assert not sync.apply()
+
+    # failed inserts are prepared again by delta
+    service.fail.clear()
+    sync.prepare_sync(start)
+    assert not sync.full_sync
+    assert len(sync.to_insert) == 10
+    assert sync.apply()
+    assert len(service.events_by_id) == 10
+
+    # failed delete of removed event is prepared again
+    service.fail.add("delete")
+    del events[0]
+    for _ in range(2):
+        sync.prepare_sync(start)
+        assert not sync.full_sync
+        assert len(sync.to_delete) == 1
+        sync.apply()
+        service.fail.clear()
+    assert len(service.events_by_id) == 9
+
+
+def test_delete_already_deleted(tmp_path: Path) -> None:
+    start = utc.localize(datetime.datetime(2018, 1, 1))
+    events = gen_events(0, 10, start)
+    service = FakeService()
+    converter = ListConverter(events)
+    converter.snapshot = SourceSnapshot(str(tmp_path / "test.snapshot"))
+    sync = CalendarSync(GoogleCalendar(service, "test"), converter)
+    sync.prepare_sync(start)
+    assert sync.apply()
+
+    # deleted in google calendar, then removed from source: nothing to delete
+    exists = list(service.events_by_id.values())
+    exists[0]["status"] = "cancelled"
+    removed = [e for e in events if e["iCalUID"] == exists[0]["iCalUID"]]
+    events.remove(removed[0])
+    sync.prepare_sync(start)
+    assert not sync.full_sync
+    assert sync.to_delete == []
+    assert sync.apply()
+
+    # missing and cancelled events are deleted successfully
+    deleted: EventList = []
+    to_delete: EventList = [exists[0], {"id": "missing", "iCalUID": "x"}]
+    sync.gcalendar.delete_events(to_delete, deleted.append)
+    assert service.calls[-2:] == ["delete", "delete"]
+    assert deleted == to_delete
+
+
+def test_sync_fingerprints() -> None:
+    start = utc.localize(datetime.datetime(2018, 1, 1))
+    events = gen_events(0, 10, start)
+    service = FakeService()
+    converter = ListConverter(events)
+    sync = CalendarSync(GoogleCalendar(service, "test", fingerprints=True), converter)
+    sync.prepare_sync(start)
+    sync.apply()
+
+    # source is exported again: all events have new LAST-MODIFIED
+    for event in events:
+        event["updated"] = "2030-01-01T00:00:00Z"
+    events[3]["summary"] = "changed"
+    sync.prepare_sync(start)
+    assert [new["summary"] for new, _ in sync.to_update] == ["changed"]
+
+
+def test_stream_plan() -> None:
+    start = utc.localize(datetime.datetime(2018, 1, 1))
+    events = gen_events(0, 30, start)
+    service = FakeService(gen_events(10, 40, start))
+    sync = CalendarSync(
+        GoogleCalendar(service, "test", batch_size=4), ListConverter(events)
+    )
+
+    sync.prepare_sync(start)
+    prepared = (
+        sorted(e["iCalUID"] for e in sync.to_insert),
+        sorted(new["iCalUID"] for new, _ in sync.to_update),
+        sorted(e["iCalUID"] for e in sync.to_delete),
+    )
+    sync.clear()
+
+    operations = list(sync.iter_plan(start))
+    assert prepared == (
+        sorted(
+            o.event["iCalUID"] for o in operations if isinstance(o, InsertOperation)
+        ),
+        sorted(
+            o.event["iCalUID"] for o in operations if isinstance(o, UpdateOperation)
+        ),
+        sorted(
+            o.event["iCalUID"] for o in operations if isinstance(o, DeleteOperation)
+        ),
+    )
+    assert tuple(map(len, prepared)) == (10, 0, 10)
+
+    service.batches.clear()
+    assert sync.apply_stream(iter(operations))
+    # deletes are found by listing, inserts after it
+    assert service.batches == [4, 4, 4, 4, 2, 2]
+    assert sorted(e["iCalUID"] for e in service.events_by_id.values()) == sorted(
+        e["iCalUID"] for e in events
+    )
+
+
+def test_stream_plan_pages(monkeypatch: pytest.MonkeyPatch) -> None:
+    start = utc.localize(datetime.datetime(2018, 1, 1))
+    events = gen_events(0, 10, start)
+    service = FakeService(gen_events(10, 30, start))
+    # pages of listing are shifted by deletes
+    monkeypatch.setattr(gcal, "LIST_PAGE_SIZE", 5)
+    sync = CalendarSync(
+        GoogleCalendar(service, "test", batch_size=2), ListConverter(events)
+    )
+    assert sync.apply_stream(sync.iter_plan(start))
+    assert sorted(e["iCalUID"] for e in service.events_by_id.values()) == sorted(
+        e["iCalUID"] for e in events
+    )
+
+
+def test_windowed_sync() -> None:
+    start = utc.localize(datetime.datetime(2018, 1, 1))
+    window = datetime.timedelta(hours=10)
+    events = gen_events(0, 50, start) + gen_events(80, 90, start)
+    exists = gen_events(5, 60, start)
+    # changed event, moved to other window
+    events[20]["start"] = {"dateTime": "2018-01-03T10:30:00Z"}
+    events[20]["end"] = {"dateTime": "2018-01-03T11:30:00Z"}
+    events[20]["updated"] = "2018-03-01T00:00:00Z"
+    # past event in google calendar, not synced
+    exists += gen_events(100, 103, start - datetime.timedelta(days=5))
+    service = FakeService(exists)
+    gcalendar = GoogleCalendar(service, "test", batch_size=8)
+    sync = CalendarSync(gcalendar, ListConverter(events))
+
+    operations = list(sync.iter_plan_windowed(start, window))
+    inserted = [o.event for o in operations if isinstance(o, InsertOperation)]
+    updated = [o.event for o in operations if isinstance(o, UpdateOperation)]
+    deleted = [o.event for o in operations if isinstance(o, DeleteOperation)]
+    assert len(inserted) == 15
+    assert [e["iCalUID"] for e in updated] == [events[20]["iCalUID"]]
+    assert len(deleted) == 10
+
+    assert sync.apply_stream(iter(operations))
+    synced = sorted(
+        e["iCalUID"]
+        for e in service.events_by_id.values()
+        if CalendarSync._event_start(e) >= start
+    )
+    assert synced == sorted(e["iCalUID"] for e in events)
+    assert len(service.events_by_id) == len(events) + 3
+
+    sync = CalendarSync(gcalendar, ListConverter(events))
+    assert not list(sync.iter_plan_windowed(start, window))
+
+
+def test_windowed_sync_memory(tmp_path: Path) -> None:
+    start = utc.localize(datetime.datetime(2018, 1, 1))
+    window = datetime.timedelta(hours=12)
+
+    def peak_memory(func: Callable[[], None]) -> int:
+        tracemalloc.start()
+        try:
+            func()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def full_and_windowed(count: int) -> List[int]:
+        events = gen_events(0, count, start)
+        for event in events:
+            event["description"] = "x" * 6000
+        filename = str(tmp_path / "{}.ics".format(count))
+        with open(filename, "w", encoding="utf-8", newline="") as f:
+            write_ics([events], f)
+        del events
+
+        def full() -> None:
+            converter = FastCalendarConverter()
+            converter.load(filename)
+            converter.events_to_gcal()
+
+        def windowed() -> None:
+            converter = FastCalendarConverter(stream=True)
+            sync = CalendarSync(GoogleCalendar(FakeService(), "test"), converter)
+            converter.load(filename)
+            for _ in sync.iter_plan_windowed(start, window):
+                pass
+
+        return [peak_memory(full), peak_memory(windowed)]
+
+    # source is read one event at a time, only one window is in memory
+    full_1, windowed_1 = full_and_windowed(100)
+    full_2, windowed_2 = full_and_windowed(200)
+    assert windowed_1 * 5 < full_1
+    assert (windowed_2 - windowed_1) * 10 < full_2 - full_1
@@ -0,0 +1,90 @@
+import datetime
+import math
+from pathlib import Path
+from typing import Any, Dict, Iterator
+
+import pytest
+
+from sync_ics2gcal import CalendarSync, GoogleCalendar, QuotaBudget, RunDeadline
+from sync_ics2gcal.gcal import EventData
+from sync_ics2gcal.sync_calendar import SourceWatcher, journal_filepath, run_sync
+from .fake_service import FakeService
+from .test_sync import ListConverter, gen_events
+
+
+def test_source_watcher(tmp_path: Path) -> None:
+    source = tmp_path / "test.ics"
+    watcher = SourceWatcher(str(source), debounce=0)
+    assert not watcher.changed()
+
+    source.write_text("BEGIN:VCALENDAR\r\nEND:VCALENDAR\r\n")
+    assert watcher.changed()
+    assert not watcher.changed()
+
+    # same content, new mtime
+    source.write_text("BEGIN:VCALENDAR\r\nEND:VCALENDAR\r\n")
+    assert not watcher.changed()
+
+    source.write_text("BEGIN:VCALENDAR\r\nX-TEST:1\r\nEND:VCALENDAR\r\n")
+    assert watcher.changed()
+
+    watcher.reset()
+    assert watcher.changed()
+
+
+def test_quota_journal() -> None:
+    config: Dict[str, Any] = {"calendar": {"google_id": "test"}}
+    assert journal_filepath(config) is None
+    # operations deferred by quota are resumed from journal
+    config["quota"] = {"run_budget": 100}
+    assert journal_filepath(config) == "ics2gcal-a94a8fe5ccb1.journal"
+    config["calendar"]["journal"] = "test.journal"
+    assert journal_filepath(config) == "test.journal"
+
+
+class LoadedConverter(ListConverter):
+    def load(self, filename: str) -> None:
+        pass
+
+
+class BrokenConverter(LoadedConverter):
+    def _iter_events(self) -> Iterator[EventData]:
+        raise ValueError("broken source")
+
+
+def test_quota_failed_planning(tmp_path: Path) -> None:
+    quota = QuotaBudget("test", history_file=str(tmp_path / "quota.sqlite"))
+    sync = CalendarSync(
+        GoogleCalendar(FakeService(), "test", quota=quota), BrokenConverter([])
+    )
+    config: Dict[str, Any] = {
+        "start_from": "2018-01-01",
+        "calendar": {"source": "test.ics"},
+        "retention": {"days": 30},
+    }
+    with pytest.raises(ValueError):
+        run_sync(sync, config)
+    # usage of prune is saved, next run is counted from start
+    assert [(units, deferred) for _, _, units, deferred in quota.history()] == [
+        (1, True)
+    ]
+    assert quota.started is None
+
+
+def test_deadline_planning(tmp_path: Path) -> None:
+    quota = QuotaBudget("test", history_file=str(tmp_path / "quota.sqlite"))
+    deadline = RunDeadline(math.inf, reserve=0)
+    service = FakeService()
+    gcalendar = GoogleCalendar(service, "test", quota=quota, deadline=deadline)
+    events = gen_events(0, 10, datetime.datetime(2018, 1, 1))
+    sync = CalendarSync(gcalendar, LoadedConverter(events))
+    config: Dict[str, Any] = {
+        "start_from": "2018-01-01",
+        "calendar": {"source": "test.ics"},
+    }
+    # lease is lost before listing: run is deferred, not failed
+    deadline.cancel("lease is lost")
+    run_sync(sync, config)
+    assert service.calls == []
+    assert not sync.to_insert
+    assert [deferred for _, _, _, deferred in quota.history()] == [True]
@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, List
+
+import pytest
+
+from sync_ics2gcal import PostgresJobQueue, SyncJobQueue, make_job_queue
+
+QueueFactory = Callable[..., SyncJobQueue]
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def make_queue(request: pytest.FixtureRequest, tmp_path: Path) -> QueueFactory:
+    """queue of backend, postgres needs psycopg and database
+    in ICS2GCAL_TEST_POSTGRES (connection string), all its jobs are removed"""
+
+    if "sqlite" == request.param:
+        return lambda **kwargs: SyncJobQueue(str(tmp_path / "jobs.sqlite"), **kwargs)
+    pytest.importorskip("psycopg")
+    url = os.environ.get("ICS2GCAL_TEST_POSTGRES")
+    if not url:
+        pytest.skip("ICS2GCAL_TEST_POSTGRES is not set")
+    queue = PostgresJobQueue(url)
+    conn = queue._connect()
+    try:
+        conn.execute("DELETE FROM jobs")
+    finally:
+        conn.close()
+    return lambda **kwargs: PostgresJobQueue(url, **kwargs)
+
+
+def test_job_lease(make_queue: QueueFactory) -> None:
+    queue = make_queue(lease_seconds=0.2)
+    queue.add("first", {"google_id": "first"})
+    queue.add("second", {"google_id": "second"}, due=time.time() + 3600)
+
+    job = queue.acquire("worker-1")
+    assert job is not None
+    assert job.calendar == "first"
+    assert job.config == {"google_id": "first"}
+    # leased job is not taken by other worker, second job is not due
+    assert queue.acquire("worker-2") is None
+
+    assert queue.heartbeat(job)
+    time.sleep(0.3)
+    # lease is expired, job is taken by other worker
+    job2 = queue.acquire("worker-2")
+    assert job2 is not None
+    assert job2.calendar == "first"
+    assert not queue.heartbeat(job)
+
+    # release by worker without lease is ignored
+    queue.release(job, time.time())
+    assert queue.acquire("worker-3") is None
+
+    queue.release(job2, time.time())
+    job3 = queue.acquire("worker-3")
+    assert job3 is not None
+    assert job3.calendar == "first"
+
+
+def test_add_keeps_due(make_queue: QueueFactory) -> None:
+    queue = make_queue()
+    queue.add("first", {"source": "a.ics"}, due=time.time() + 3600)
+    queue.add("first", {"source": "b.ics"})
+    assert queue.acquire("worker") is None
+
+    queue.add("second", {"source": "c.ics"})
+    job = queue.acquire("worker")
+    assert job is not None
+    queue.release(job, time.time() - 1)
+    queue.add("second", {"source": "d.ics"})
+    job = queue.acquire("worker")
+    assert job is not None
+    assert job.config == {"source": "d.ics"}
+
+
+def test_lost_lease(make_queue: QueueFactory) -> None:
+    queue = make_queue(lease_seconds=0.1)
+    queue.add("first", {})
+    job = queue.acquire("worker-1")
+    assert job is not None
+    time.sleep(0.2)
+    # expired lease, not taken by other worker, is extended
+    assert queue.heartbeat(job)
+    time.sleep(0.2)
+    assert queue.acquire("worker-2") is not None
+
+    lost = threading.Event()
+    stop = threading.Event()
+    thread = queue.keep_lease(job, 0.01, stop, lost.set)
+    assert lost.wait(5)
+    stop.set()
+    thread.join()
+
+
+def test_concurrent_acquire(make_queue: QueueFactory) -> None:
+    queue = make_queue()
+    for i in range(20):
+        queue.add("calendar{}".format(i), {})
+
+    taken: List[str] = []
+
+    def take(worker: str) -> None:
+        while True:
+            job = queue.acquire(worker)
+            if job is None:
+                return
+            taken.append(job.calendar)
+
+    threads = [
+        threading.Thread(target=take, args=("worker-{}".format(i),)) for i in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # each job is taken once
+    assert sorted(taken) == sorted("calendar{}".format(i) for i in range(20))
+
+
+def test_make_job_queue(tmp_path: Path) -> None:
+    queue = make_job_queue({"queue_file": str(tmp_path / "jobs.sqlite")})
+    assert type(queue) is SyncJobQueue
+    assert queue.lease_seconds == 300